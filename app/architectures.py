@@ -0,0 +1,43 @@
+"""
+Architectures de classification entraînables par train_model.py (MODEL_ARCH) et reconstruites par l'API.
+
+Chaque entrée donne le constructeur torchvision et le chemin de la dernière couche Linear,
+remplacée par une tête à `num_classes` sorties. Le nom de l'architecture est enregistré avec
+les poids (métadonnées .meta.json et en-tête .safetensors) : l'API reconstruit le bon modèle.
+"""
+import torch.nn as nn
+
+ARCHITECTURES = {
+    "resnet18": "fc",
+    "resnet34": "fc",
+    "resnet50": "fc",
+    "mobilenet_v3_small": "classifier.3",
+    "mobilenet_v3_large": "classifier.3",
+    "efficientnet_b0": "classifier.1",
+    "regnet_y_400mf": "fc",
+}
+
+# Architecture des modèles antérieurs aux métadonnées
+DEFAULT_ARCHITECTURE = "resnet18"
+
+
+def check_architecture(architecture):
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Architecture inconnue : {architecture} (attendu : {', '.join(ARCHITECTURES)})")
+    return architecture
+
+
+def build_model(architecture, num_classes, pretrained=False):
+    """ Modèle torchvision (poids ImageNet si `pretrained`) dont la tête a `num_classes` sorties """
+    from torchvision import models
+
+    head_path = ARCHITECTURES[check_architecture(architecture)]
+    model = models.get_model(architecture, weights="DEFAULT" if pretrained else None)
+    parent_path, _, name = head_path.rpartition(".")
+    parent = model.get_submodule(parent_path) if parent_path else model
+    setattr(parent, name, nn.Linear(getattr(parent, name).in_features, num_classes))
+    return model
+
+
+def count_parameters(model):
+    return sum(parameter.numel() for parameter in model.parameters())
@@ -0,0 +1,294 @@
+"""
+Backends d'inférence CPU pour le modèle servi (ResNet18 par défaut, voir architectures.py).
+
+Chaque backend est produit à partir du state_dict entraîné (voir export_model.py)
+et s'utilise comme un module torch : `logits = model(batch)`.
+
+    eager        : torchvision ResNet18 fp32 (comportement historique)
+    torchscript  : TorchScript figé (torch.jit.freeze, optimize_for_inference au chargement)
+    onnx         : ONNX Runtime (CPUExecutionProvider)
+    int8_dynamic : quantification dynamique int8 de la tête fc seule : les convolutions restent en fp32,
+                   aucun gain attendu sur un CNN (gardé pour comparaison, jamais retenu par la parité)
+    int8_static  : quantification statique int8 (FX, calibrée sur des images de train)
+
+Le modèle eager peut en plus tourner en bfloat16 (autocast CPU) et/ou au format
+mémoire channels_last, selon les métadonnées écrites par train_model.py.
+
+Ses poids sont lus de préférence au format safetensors (model_v1_123.safetensors),
+memory-mappé : pas de copie du fichier en mémoire ni de désérialisation pickle.
+En channels_last, ils sont lus depuis une variante dont les convolutions sont déjà rangées dans
+ce format (model_v1_123.cl.safetensors) : restent mappés et partagés, sans conversion par process.
+"""
+import importlib.util
+import os
+
+import torch
+import torch.nn as nn
+
+from architectures import DEFAULT_ARCHITECTURE, build_model
+
+BACKENDS = ["eager", "torchscript", "onnx", "int8_dynamic", "int8_static"]
+
+# Suffixe des artefacts exportés, à côté du fichier du modèle (ex: model_v1_123.onnx)
+ARTIFACT_SUFFIXES = {
+    "torchscript": ".torchscript.pt",
+    "onnx": ".onnx",
+    "int8_dynamic": ".int8_dynamic.pt",
+    "int8_static": ".int8_static.pt",
+}
+# Backends qui ne quantifient que la tête (Linear) : pas d'accélération attendue sur un CNN
+HEAD_ONLY_BACKENDS = {"int8_dynamic"}
+
+# Métadonnées d'entraînement (architecture, précision, channels_last...) : model_v1_123.meta.json
+METADATA_SUFFIX = ".meta.json"
+# Poids au format safetensors, à côté du .pt : model_v1_123.safetensors
+WEIGHTS_SUFFIX = ".safetensors"
+# Variante channels_last : poids 4-D des convolutions stockés en OHWI (model_v1_123.cl.safetensors)
+CHANNELS_LAST_WEIGHTS_SUFFIX = ".cl" + WEIGHTS_SUFFIX
+SAFETENSORS_AVAILABLE = importlib.util.find_spec("safetensors") is not None
+PRECISIONS = ["fp32", "bf16"]
+
+INPUT_SHAPE = (1, 3, 224, 224)
+
+
+def build_resnet18(num_classes):
+    """ Architecture ResNet18 identique à celle de train_model.py """
+    return build_model("resnet18", num_classes)
+
+
+def _select_quantized_engine():
+    """ Moteur int8 du CPU : x86 (fbgemm + onednn) si disponible """
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = "x86" if "x86" in engines else "fbgemm"
+    return torch.backends.quantized.engine
+
+
+def artifact_path(model_path, backend):
+    """ Chemin de l'artefact d'un backend pour un fichier de modèle donné """
+    stem, _ = os.path.splitext(model_path)
+    return stem + ARTIFACT_SUFFIXES[backend]
+
+
+def metadata_path(model_path):
+    stem, _ = os.path.splitext(model_path)
+    return stem + METADATA_SUFFIX
+
+
+def weights_path(model_path):
+    stem, _ = os.path.splitext(model_path)
+    return stem + WEIGHTS_SUFFIX
+
+
+def channels_last_weights_path(model_path):
+    stem, _ = os.path.splitext(model_path)
+    return stem + CHANNELS_LAST_WEIGHTS_SUFFIX
+
+
+# ---------------------------
+# Poids memory-mappés
+# ---------------------------
+def load_weights(path, mmap=True):
+    """
+    state_dict (ou modèle complet) d'un fichier de poids, sans lire le fichier en mémoire :
+    .safetensors memory-mappé, .pt via torch.load(mmap=True) (format zip de torch >= 1.6).
+    Les pages mappées sont celles du cache de pages : partagées par tous les process qui
+    lisent le même fichier. `mmap=False` copie les poids dans la mémoire privée du process.
+    Une variante channels_last (.cl.safetensors) est rendue en vues OIHW au format channels_last.
+    """
+    if path.endswith(WEIGHTS_SUFFIX):
+        from safetensors.torch import load, load_file
+
+        if not mmap:
+            with open(path, "rb") as f:
+                state_dict = load(f.read())
+        else:
+            state_dict = load_file(path, device="cpu")
+        if path.endswith(CHANNELS_LAST_WEIGHTS_SUFFIX):
+            # OHWI contigu permuté en OIHW = tenseur channels_last : PrecisionModel n'a rien à recopier
+            state_dict = {name: t.permute(0, 3, 1, 2) if t.dim() == 4 else t for name, t in state_dict.items()}
+        return state_dict
+    if not mmap:
+        return torch.load(path, map_location="cpu")
+    try:
+        return torch.load(path, map_location="cpu", mmap=True)
+    except RuntimeError:
+        # Ancien format de sérialisation (non zip) : pas de mmap possible
+        return torch.load(path, map_location="cpu")
+
+
+def save_safetensors(state_dict, path, metadata=None):
+    """
+    Écrit le state_dict en .safetensors (écriture atomique) ; False si safetensors n'est pas installé.
+    `metadata` (ex: {"architecture": "resnet18"}) est gardé dans l'en-tête du fichier.
+    """
+    if not SAFETENSORS_AVAILABLE:
+        return False
+    from safetensors.torch import save_file
+
+    # Fichier temporaire propre au process : plusieurs workers peuvent convertir le même modèle
+    partial = f"{path}.{os.getpid()}.part"
+    save_file({name: tensor.contiguous() for name, tensor in state_dict.items()}, partial, metadata=metadata)
+    os.replace(partial, path)
+    return True
+
+
+def save_channels_last_safetensors(state_dict, path, metadata=None):
+    """ Variante channels_last du .safetensors (poids 4-D en OHWI), relue sans copie par load_weights """
+    return save_safetensors(
+        {name: t.permute(0, 2, 3, 1) if t.dim() == 4 else t for name, t in state_dict.items()}, path, metadata
+    )
+
+
+def weights_metadata(path):
+    """ Métadonnées de l'en-tête d'un fichier .safetensors ({} pour un .pt ou sans en-tête) """
+    if not path.endswith(WEIGHTS_SUFFIX):
+        return {}
+    from safetensors import safe_open
+
+    with safe_open(path, framework="pt") as f:
+        return f.metadata() or {}
+
+
+def build_from_state_dict(state_dict, num_classes, architecture=DEFAULT_ARCHITECTURE):
+    """
+    Modèle construit sur le device "meta" (aucune allocation ni initialisation aléatoire des poids)
+    puis lié directement aux tenseurs du state_dict (assign=True : pas de copie des poids mappés).
+    """
+    with torch.device("meta"):
+        model = build_model(architecture, num_classes)
+    model.load_state_dict(state_dict, assign=True)
+    return model
+
+
+# ---------------------------
+# Export des artefacts
+# ---------------------------
+def export_torchscript(model, path):
+    example = torch.randn(*INPUT_SHAPE)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model.eval(), example)
+    # Le module figé (BN fusionnées dans les convolutions) est sérialisable ;
+    # optimize_for_inference est appliqué au chargement (non sérialisable)
+    torch.jit.save(torch.jit.freeze(scripted), path)
+
+
+def export_onnx(model, path):
+    example = torch.randn(*INPUT_SHAPE)
+    torch.onnx.export(
+        model.eval(), example, path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+def export_int8_dynamic(model, path):
+    # La quantification dynamique ne s'applique qu'aux couches Linear (ici la tête fc) :
+    # les convolutions, l'essentiel du calcul, restent en fp32 (voir export_int8_static)
+    from torch.ao.quantization import quantize_dynamic
+
+    quantized = quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        scripted = torch.jit.trace(quantized, torch.randn(*INPUT_SHAPE))
+    torch.jit.save(torch.jit.freeze(scripted), path)
+
+
+def export_int8_static(model, path, calibration_batches):
+    """ Quantification statique int8 (FX graph mode), calibrée sur quelques batchs d'images """
+    import copy
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = _select_quantized_engine()
+    example = torch.randn(*INPUT_SHAPE)
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(),
+        get_default_qconfig_mapping(engine),
+        example_inputs=(example,),
+    )
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+        quantized = convert_fx(prepared)
+        scripted = torch.jit.trace(quantized, example)
+    torch.jit.save(torch.jit.freeze(scripted), path)
+
+
+# ---------------------------
+# Chargement des backends
+# ---------------------------
+class OnnxModel:
+    """ Session ONNX Runtime exposée comme un module torch (tenseur → logits) """
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, batch):
+        outputs = self.session.run(None, {"input": batch.contiguous().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+
+class PrecisionModel:
+    """
+    Modèle eager exécuté en bfloat16 (autocast CPU) et/ou en channels_last.
+    Les entrées restent des tenseurs NCHW fp32 et les logits sont rendus en fp32.
+    La conversion channels_last réalloue les poids qui ne sont pas déjà dans ce format (copie privée
+    du process) : model.load_model les lit depuis la variante .cl.safetensors pour l'éviter.
+    """
+
+    def __init__(self, model, precision="fp32", channels_last=False):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Précision inconnue : {precision} (attendu : {', '.join(PRECISIONS)})")
+        self.precision = precision
+        self.channels_last = channels_last
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        self.model = model.eval()
+
+    def __call__(self, batch):
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        if self.precision == "bf16":
+            with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                return self.model(batch).float()
+        return self.model(batch)
+
+    def eval(self):
+        return self
+
+    @property
+    def label(self):
+        """ Suffixe du nom de backend (ex: eager_bf16_cl), qui entre dans la clé du cache """
+        return "".join([
+            f"_{self.precision}" if self.precision != "fp32" else "",
+            "_cl" if self.channels_last else "",
+        ])
+
+
+def load_backend(backend, model_path):
+    """ Charge l'artefact exporté d'un backend (hors eager) """
+    if backend not in ARTIFACT_SUFFIXES:
+        raise ValueError(f"Backend inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+    path = artifact_path(model_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Artefact introuvable pour le backend '{backend}' : {path}")
+
+    if backend == "onnx":
+        return OnnxModel(path)
+    if backend == "int8_static":
+        _select_quantized_engine()
+    model = torch.jit.load(path, map_location="cpu")
+    model.eval()
+    if backend == "torchscript":
+        model = torch.jit.optimize_for_inference(model)
+    return model
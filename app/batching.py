@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+import torch
+
+
+# ---------------------------
+# Micro-batching des requêtes
+# ---------------------------
+class MicroBatcher:
+    """
+    Regroupe les tenseurs soumis par des requêtes concurrentes en un seul batch.
+
+    Une tâche de fond attend la première requête, puis collecte les suivantes
+    jusqu'à `max_batch_size` images ou `max_wait_ms` millisecondes. Le batch est
+    empilé en un seul tenseur, passe une seule fois dans le modèle, et chaque
+    requête récupère son propre résultat via un Future.
+
+    Chaque requête peut préciser un `group` (ex: version de modèle épinglée) :
+    un batch ne mélange jamais deux groupes, et `infer_fn(batch, group)` est
+    appelé avec le groupe commun.
+
+    Au plus `max_concurrent_batches` batchs sont envoyés en parallèle à
+    l'exécuteur (typiquement un par worker d'inférence) ; pendant ce temps
+    les nouvelles requêtes s'accumulent et formeront le batch suivant.
+
+    Si la requête fournit un dict `timings`, il reçoit les intervalles perf_counter
+    (début, fin) de son attente dans la file (`batch_wait`) et de l'inférence de son batch.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=5.0,
+                 executor=None, max_concurrent_batches=1,
+                 batch_size_metric=None, queue_wait_metric=None, in_flight_metric=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size doit être >= 1")
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.executor = executor
+        self.max_concurrent_batches = max(max_concurrent_batches, 1)
+        self.batch_size_metric = batch_size_metric
+        self.queue_wait_metric = queue_wait_metric
+        self.in_flight_metric = in_flight_metric
+        self._queue = None
+        self._slots = None
+        self._task = None
+        self._dispatching = set()
+        self._deferred = []  # requêtes d'un autre groupe, servies au batch suivant
+
+    def start(self):
+        """Démarre la boucle de batching (à appeler depuis la boucle asyncio)."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Arrête la boucle et fait échouer les requêtes encore en attente."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        pending = self._deferred
+        self._deferred = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future, _, _, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher arrêté"))
+
+    async def submit(self, tensor: torch.Tensor, group=None, timings=None):
+        """Soumet un tenseur (C, H, W) et attend le résultat qui lui correspond."""
+        if self._task is None:
+            raise RuntimeError("Batcher non démarré")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future, time.perf_counter(), group, timings))
+        return await future
+
+    async def _collect(self):
+        """Attend une première requête puis remplit le batch jusqu'aux limites."""
+        loop = asyncio.get_running_loop()
+        if self._deferred:
+            first = self._deferred.pop(0)
+        else:
+            first = await self._queue.get()
+        group = first[3]
+        items = [first]
+
+        # Requêtes du même groupe mises de côté lors du batch précédent
+        remaining_deferred = []
+        for item in self._deferred:
+            if item[3] == group and len(items) < self.max_batch_size:
+                items.append(item)
+            else:
+                remaining_deferred.append(item)
+        self._deferred = remaining_deferred
+
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch_size:
+            # On vide d'abord ce qui est déjà en file, sans attendre
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item[3] == group:
+                items.append(item)
+            else:
+                self._deferred.append(item)
+        return items, group
+
+    @property
+    def queue_size(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self):
+        while True:
+            # On attend un worker libre avant de former le batch : pendant que
+            # tous les workers calculent, les requêtes s'accumulent dans la file.
+            await self._slots.acquire()
+            try:
+                items, group = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Les requêtes annulées entre-temps (client déconnecté) sont ignorées
+            items = [item for item in items if not item[1].done()]
+            if not items:
+                self._slots.release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._dispatch(items, group))
+            # On garde une référence forte tant que le batch est en cours
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+
+    async def _dispatch(self, items, group):
+        loop = asyncio.get_running_loop()
+        dequeued_at = time.perf_counter()
+        if self.queue_wait_metric is not None:
+            for _, _, enqueued_at, _, _ in items:
+                self.queue_wait_metric.observe(dequeued_at - enqueued_at)
+        if self.batch_size_metric is not None:
+            self.batch_size_metric.observe(len(items))
+        if self.in_flight_metric is not None:
+            self.in_flight_metric.inc(len(items))
+
+        try:
+            batch = torch.stack([tensor for tensor, _, _, _, _ in items])
+            inference_start = time.perf_counter()
+            results = await loop.run_in_executor(self.executor, self.infer_fn, batch, group)
+            inference_end = time.perf_counter()
+        except Exception as e:
+            for _, future, _, _, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if self.in_flight_metric is not None:
+                self.in_flight_metric.dec(len(items))
+            self._slots.release()
+
+        for (_, future, enqueued_at, _, timings), result in zip(items, results):
+            if timings is not None:
+                timings["batch_wait"] = (enqueued_at, dequeued_at)
+                timings["inference"] = (inference_start, inference_end)
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,273 @@
+"""
+Scoring en masse d'images stockées sur MinIO (ou sur disque) avec sortie NDJSON.
+
+Pipeline en flux continu :
+    listing des objets → téléchargement + décodage concurrents (fenêtre bornée)
+    → inférence par batch → émission d'une ligne JSON par image
+
+La mémoire reste constante quelle que soit la taille du bucket : seuls
+`prefetch` objets et un batch de tenseurs sont en mémoire à un instant donné.
+
+Exemples :
+    python bulk.py --bucket dataset-fish --prefix test/ --output test.ndjson
+    python bulk.py --split test --output test.ndjson
+    python bulk.py --local-dir ../FishImgDataset/test --output test.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from utils import is_image_name
+
+# Configuration par défaut
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "32"))
+BULK_PREFETCH = int(os.getenv("BULK_PREFETCH", "64"))
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "8"))
+DATASET_BUCKET = "dataset-fish"
+
+
+# ---------------------------
+# Sources d'images
+# ---------------------------
+class MinioSource:
+    """ Objets d'un bucket MinIO, éventuellement filtrés par préfixe """
+
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def keys(self):
+        for obj in self.client.list_objects(self.bucket, prefix=self.prefix, recursive=True):
+            if not obj.is_dir and is_image_name(obj.object_name):
+                yield obj.object_name
+
+    def fetch(self, key):
+        response = self.client.get_object(self.bucket, key)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+
+class LocalSource:
+    """ Fichiers d'un dossier local (même arborescence que le bucket : split/label/fichier) """
+
+    def __init__(self, root, prefix=""):
+        self.root = root
+        self.prefix = prefix
+
+    def keys(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if key.startswith(self.prefix) and is_image_name(key):
+                    yield key
+
+    def fetch(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+
+def keys_from_split(split, mysql_config):
+    """
+    Clés des objets d'un split de la table fish_data (tous les splits si `split` est None),
+    lues en flux (curseur côté serveur, sans charger toute la table en mémoire).
+    """
+    import pymysql
+    import pymysql.cursors
+
+    conn = pymysql.connect(cursorclass=pymysql.cursors.SSCursor, **mysql_config)
+    try:
+        with conn.cursor() as cursor:
+            if split is None:
+                cursor.execute("SELECT split, species_label, file_name FROM fish_data")
+            else:
+                cursor.execute("SELECT split, species_label, file_name FROM fish_data WHERE split = %s", (split,))
+            for row_split, label, file_name in cursor:
+                yield f"{row_split}/{label}/{file_name}"
+    finally:
+        conn.close()
+
+
+def label_from_key(key):
+    """ Label réel déduit du dossier parent ("split/label/fichier" ou "label/fichier"), sinon None """
+    parts = key.split("/")
+    return parts[-2] if len(parts) >= 2 else None
+
+
+# ---------------------------
+# Pipeline de scoring
+# ---------------------------
+class ScoringStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.scored = 0
+        self.errors = 0
+        self.correct = 0
+        self.labelled = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def images_per_sec(self):
+        return self.scored / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        summary = {
+            "scored": self.scored,
+            "errors": self.errors,
+            "elapsed_s": round(self.elapsed, 2),
+            "images_per_sec": round(self.images_per_sec, 2),
+        }
+        if self.labelled:
+            summary["accuracy"] = round(100 * self.correct / self.labelled, 2)
+        return summary
+
+
+def decoded_batches(source, keys, decode_fn, batch_size=BULK_BATCH_SIZE,
+                    prefetch=BULK_PREFETCH, workers=BULK_WORKERS):
+    """
+    Génère des tuples (clés, tenseurs, erreurs) : un batch de tenseurs décodés dans l'ordre
+    des clés, précédé des erreurs [(clé, exception)] rencontrées en le remplissant.
+    Le téléchargement et le décodage tournent dans un pool de threads pendant que
+    le batch précédent est consommé.
+    """
+    def load(key):
+        return decode_fn(source.fetch(key))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk") as pool:
+        window = deque()
+        key_iter = iter(keys)
+        batch, errors = [], []
+
+        # Fenêtre glissante : au plus `prefetch` objets téléchargés/décodés d'avance
+        for key in key_iter:
+            window.append((key, pool.submit(load, key)))
+            if len(window) >= prefetch:
+                break
+
+        while window:
+            key, future = window.popleft()
+            next_key = next(key_iter, None)
+            if next_key is not None:
+                window.append((next_key, pool.submit(load, next_key)))
+            try:
+                batch.append((key, future.result()))
+            except Exception as e:
+                errors.append((key, e))
+                continue
+            if len(batch) >= batch_size:
+                yield [k for k, _ in batch], torch.stack([t for _, t in batch]), errors
+                batch, errors = [], []
+
+        if batch or errors:
+            yield [k for k, _ in batch], torch.stack([t for _, t in batch]) if batch else None, errors
+
+
+def score_stream(source, keys, decode_fn, infer_fn, batch_size=BULK_BATCH_SIZE,
+                 prefetch=BULK_PREFETCH, workers=BULK_WORKERS, top_k=1, stats=None):
+    """
+    Génère un dict de résultat par image, dans l'ordre des clés.
+
+    `decode_fn(bytes) -> tenseur` et `infer_fn(batch, top_k) -> [[(label, conf), ...]]`
+    sont ceux de model.py.
+    """
+    stats = stats or ScoringStats()
+
+    for keys_batch, batch, errors in decoded_batches(source, keys, decode_fn, batch_size, prefetch, workers):
+        for key, error in errors:
+            stats.errors += 1
+            yield {"key": key, "error": str(error)}
+        if batch is None:
+            continue
+        predictions = infer_fn(batch, top_k)
+        for key, top in zip(keys_batch, predictions):
+            label, confidence = top[0]
+            result = {"key": key, "prediction": label, "confidence": round(confidence * 100, 2)}
+            if top_k > 1:
+                result["top_k"] = [{"label": l, "confidence": round(c * 100, 2)} for l, c in top]
+            true_label = label_from_key(key)
+            if true_label is not None:
+                result["label"] = true_label
+                stats.labelled += 1
+                stats.correct += int(true_label == label)
+            stats.scored += 1
+            yield result
+
+
+def write_ndjson(results, out, stats, progress_every=1000):
+    """ Écrit les résultats ligne par ligne (flush régulier) et affiche le débit """
+    for i, result in enumerate(results, start=1):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        if i % progress_every == 0:
+            out.flush()
+            print(f"⏱️  {stats.scored} images — {stats.images_per_sec:.1f} img/s", file=sys.stderr)
+    out.flush()
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+def main():
+    p = argparse.ArgumentParser(description="Scoring en masse d'images MinIO/locales au format NDJSON")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--prefix", help="Préfixe d'objets dans le bucket (ex: test/)")
+    src.add_argument("--split", help="Split de la table fish_data (train/test)")
+    src.add_argument("--local-dir", help="Dossier local à la place de MinIO")
+    p.add_argument("--bucket", default=DATASET_BUCKET, help="Bucket MinIO")
+    p.add_argument("--endpoint", default=os.getenv("MINIO_ENDPOINT"), help="Endpoint MinIO (défaut : celui de model.py)")
+    p.add_argument("--mysql-host", default=os.getenv("MYSQL_HOST", "mysql"))
+    p.add_argument("--output", "-o", default="-", help="Fichier NDJSON de sortie (- pour stdout)")
+    p.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    p.add_argument("--prefetch", type=int, default=BULK_PREFETCH)
+    p.add_argument("--workers", type=int, default=BULK_WORKERS)
+    p.add_argument("--top-k", type=int, default=1)
+    args = p.parse_args()
+
+    from model import decode_image, get_minio_client, predict_topk
+
+    if args.local_dir:
+        source = LocalSource(args.local_dir)
+        keys = source.keys()
+    else:
+        client = get_minio_client()
+        if args.endpoint:
+            from minio import Minio
+            client = Minio(args.endpoint, access_key="admin-user", secret_key="admin-password", secure=False)
+        source = MinioSource(client, args.bucket, args.prefix or "")
+        if args.split:
+            mysql_config = dict(host=args.mysql_host, user="root", password="root", database="mlops")
+            keys = keys_from_split(args.split, mysql_config)
+        else:
+            keys = source.keys()
+
+    stats = ScoringStats()
+    results = score_stream(
+        source, keys, decode_image, predict_topk,
+        batch_size=args.batch_size, prefetch=args.prefetch, workers=args.workers,
+        top_k=args.top_k, stats=stats,
+    )
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        write_ndjson(results, out, stats)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"✅ Scoring terminé : {json.dumps(stats.summary())}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
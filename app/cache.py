@@ -0,0 +1,127 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(image_bytes: bytes, model_version: str) -> str:
+    """ Clé de cache : hash du contenu envoyé + version du modèle chargé """
+    return f"fish:{model_version}:{hashlib.blake2b(image_bytes, digest_size=20).hexdigest()}"
+
+
+class RedisCacheBackend:
+    """
+    Cache partagé entre les réplicas (Redis). Toute erreur réseau est traitée
+    comme un miss : le cache ne doit jamais faire échouer une prédiction.
+    """
+
+    def __init__(self, url, ttl_seconds):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        try:
+            raw = self.client.get(key)
+        except Exception:
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, key, value):
+        try:
+            self.client.set(key, json.dumps(value), ex=int(self.ttl_seconds) or None)
+        except Exception:
+            pass
+
+
+# ---------------------------
+# Cache des prédictions
+# ---------------------------
+class PredictionCache:
+    """
+    Cache LRU en mémoire, borné en nombre d'entrées et en durée de vie (TTL),
+    avec un backend partagé optionnel consulté en cas de miss local.
+
+    Les clés contiennent la version du modèle, et `set_model_version()` purge
+    les entrées des autres versions dès que le modèle actif change.
+    Toutes les méthodes sont thread-safe (appelées depuis le pool de décodage).
+    """
+
+    def __init__(self, max_entries=4096, ttl_seconds=3600, shared=None,
+                 hits_metric=None, misses_metric=None, evictions_metric=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.hits_metric = hits_metric
+        self.misses_metric = misses_metric
+        self.evictions_metric = evictions_metric
+        self.model_version = None
+        self._entries = OrderedDict()  # clé → (version, expiration, valeur)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_model_version(self, model_version: str):
+        """ Invalide les entrées des autres versions quand le modèle actif change """
+        with self._lock:
+            if model_version == self.model_version:
+                return
+            stale = [key for key, (version, _, _) in self._entries.items() if version != model_version]
+            for key in stale:
+                del self._entries[key]
+            self._evicted("model_change", len(stale))
+            self.model_version = model_version
+
+    def get(self, image_bytes: bytes, model_version: str):
+        """ Renvoie (clé, valeur en cache ou None) pour une image et une version de modèle """
+        key = content_key(image_bytes, model_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                _, expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hit("local")
+                    return key, value
+                del self._entries[key]
+                self._evicted("ttl")
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._store(key, model_version, value)
+                self._hit("shared")
+                return key, value
+
+        if self.misses_metric is not None:
+            self.misses_metric.inc()
+        return key, None
+
+    def set(self, key: str, model_version: str, value):
+        """ Enregistre une prédiction (localement et dans le backend partagé) """
+        self._store(key, model_version, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def _store(self, key, model_version, value):
+        with self._lock:
+            self._entries[key] = (model_version, time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evicted("lru")
+
+    def _hit(self, source):
+        if self.hits_metric is not None:
+            self.hits_metric.labels(source=source).inc()
+
+    def _evicted(self, reason, count=1):
+        if count and self.evictions_metric is not None:
+            self.evictions_metric.labels(reason=reason).inc(count)
@@ -0,0 +1,86 @@
+"""
+Cascade de modèles : un petit modèle rapide (MobileNetV3-small, entraîné par train_model.py avec
+MODEL_ARCH=mobilenet_v3_small) répond d'abord ; seules les images dont la confiance top-1 est
+sous le seuil passent dans le modèle complet (ResNet18).
+
+Le seuil est choisi par train_model.py sur la validation pour atteindre une précision cible
+(métadonnées `cascade.threshold` du petit modèle) ; CASCADE_THRESHOLD le remplace.
+
+Chaque classement renvoyé indique l'étape qui a répondu (`fast` : petit modèle, `full` : modèle complet)
+et son coût : temps de calcul amorti sur le batch et GFLOPs estimés (petit modèle + modèle complet si escalade).
+"""
+import time
+
+import torch
+
+STAGES = ["fast", "full"]
+
+
+class Ranking(list):
+    """ Classement [(label, confiance), ...] d'une image, avec l'étape qui a répondu et son coût """
+
+    def __init__(self, ranked, stage="full", cost_s=0.0, gflops=None):
+        super().__init__(ranked)
+        self.stage = stage
+        self.cost_s = cost_s
+        self.gflops = gflops
+
+
+def count_gflops(model, input_shape=(1, 3, 224, 224)):
+    """ GFLOPs d'une passe avant sur une image, None si non mesurable (ONNX Runtime, DummyModel...) """
+    try:
+        from torch.utils.flop_counter import FlopCounterMode
+
+        counter = FlopCounterMode(display=False)
+        with torch.no_grad(), counter:
+            model(torch.zeros(*input_shape))
+        flops = counter.get_total_flops()
+    except Exception:
+        return None
+    return round(flops / 1e9, 4) if flops else None
+
+
+def timed_probabilities(model, batch):
+    """ Probabilités (N, classes) du modèle et durée de la passe avant (s) """
+    start = time.perf_counter()
+    with torch.no_grad():
+        probs = torch.nn.functional.softmax(model(batch).float(), dim=1)
+    return probs, time.perf_counter() - start
+
+
+class Cascade:
+    """ Petit modèle de tête de cascade et seuil d'escalade, partagés par toutes les versions servies """
+
+    def __init__(self, version, model, threshold, gflops=None):
+        self.version = version
+        self.model = model
+        self.threshold = threshold
+        self.gflops = gflops
+
+    @property
+    def label(self):
+        """ Suffixe de la clé du modèle servi : un autre seuil donne d'autres prédictions en cache """
+        return f"cascade:{self.version}@{self.threshold:.4f}"
+
+    def describe(self):
+        return {"fast_model": self.version, "threshold": self.threshold, "fast_gflops": self.gflops}
+
+    def run(self, batch, full_model, full_gflops=None):
+        """
+        Probabilités (N, classes) du batch et, par image, (étape, coût en s, GFLOPs) :
+        le petit modèle voit tout le batch, le modèle complet seulement les images sous le seuil.
+        """
+        probs, fast_s = timed_probabilities(self.model, batch)
+        n = len(batch)
+        stages = ["fast"] * n
+        costs = [fast_s / n] * n
+        escalated = (probs.max(dim=1).values < self.threshold).nonzero().flatten()
+        if len(escalated):
+            full_probs, full_s = timed_probabilities(full_model, batch[escalated])
+            probs[escalated] = full_probs
+            for i in escalated.tolist():
+                stages[i] = "full"
+                costs[i] += full_s / len(escalated)
+        escalated_gflops = None if self.gflops is None or full_gflops is None else self.gflops + full_gflops
+        gflops = [self.gflops if stage == "fast" else escalated_gflops for stage in stages]
+        return probs, stages, costs, gflops
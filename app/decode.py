@@ -0,0 +1,99 @@
+import os
+import warnings
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+# ---------------------------
+# Configuration du décodage
+# ---------------------------
+# Limites appliquées avant le décodage complet (protection mémoire / latence)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+# Même limite pour la garde de PIL (DecompressionBombError au-delà de 2x, levée dès Image.open) ;
+# son avertissement entre 1x et 2x est inutile, open_image refuse déjà ces images
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
+# Taille décompressée totale des images d'une archive (/predict/batch), vérifiée avant extraction
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(512 * 1024 * 1024)))
+# Décodage JPEG à résolution réduite (mode draft de libjpeg : échelle 1/2, 1/4 ou 1/8)
+DECODE_DRAFT = os.getenv("DECODE_DRAFT", "1") == "1"
+
+INPUT_SIZE = (224, 224)
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Normalisation appliquée directement sur les valeurs 0-255 :
+# (x / 255 - mean) / std  ==  (x - 255 * mean) / (255 * std)
+_MEAN_255 = torch.tensor(IMAGENET_MEAN).mul(255).view(3, 1, 1)
+_INV_STD_255 = torch.tensor(IMAGENET_STD).mul(255).reciprocal().view(3, 1, 1)
+
+
+class ImageTooLargeError(ValueError):
+    """ Image refusée car elle dépasse MAX_UPLOAD_BYTES ou MAX_IMAGE_PIXELS """
+
+
+def check_upload_size(size: int):
+    if size > MAX_UPLOAD_BYTES:
+        raise ImageTooLargeError(
+            f"Fichier trop volumineux ({size / 1024 / 1024:.1f} MB, max {MAX_UPLOAD_BYTES / 1024 / 1024:.0f} MB)"
+        )
+
+
+def open_image(image_bytes: bytes, size=INPUT_SIZE) -> Image.Image:
+    """
+    Ouvre l'image et vérifie ses limites sans décoder les pixels, puis demande
+    à libjpeg de décoder directement à l'échelle la plus proche de `size`.
+    """
+    check_upload_size(len(image_bytes))
+    try:
+        image = Image.open(BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"Image trop grande (plus de {2 * MAX_IMAGE_PIXELS} pixels, max {MAX_IMAGE_PIXELS})") from e
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image trop grande ({width}x{height} pixels, max {MAX_IMAGE_PIXELS})"
+        )
+    if DECODE_DRAFT and image.format == "JPEG":
+        # Ne réduit jamais en dessous de `size` : le Resize final reste un sous-échantillonnage
+        image.draft("RGB", size)
+    return image
+
+
+def decode_to_tensor(image_bytes: bytes, size=INPUT_SIZE) -> torch.Tensor:
+    """
+    Décodage rapide : bytes → tenseur normalisé (3, H, W) float32.
+
+    Équivalent à Resize → ToTensor → Normalize de torchvision, mais la
+    conversion float32 et la normalisation se font en une seule copie du
+    tableau uint8 224x224 (puis en place), sans tenseur intermédiaire.
+    """
+    image = open_image(image_bytes, size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+
+    pixels = torch.from_numpy(np.array(image))  # (H, W, 3) uint8, déjà à la taille finale
+    return normalize_pixels(pixels.permute(2, 0, 1))
+
+
+def normalize_pixels(pixels: torch.Tensor) -> torch.Tensor:
+    """
+    Pixels uint8 (3, H, W) ou (N, 3, H, W), vue NHWC permutée comprise → tenseur normalisé float32
+    contigu : une seule copie (conversion), la normalisation se fait ensuite en place.
+    """
+    tensor = pixels.to(torch.float32, memory_format=torch.contiguous_format)
+    return tensor.sub_(_MEAN_255).mul_(_INV_STD_255)
+
+
+def warmup_jpeg(width=640, height=480) -> bytes:
+    """ JPEG synthétique (dégradé) pour chauffer le chemin de décodage au démarrage """
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    pixels = np.stack([np.tile(gradient, (height, 1))] * 3, axis=-1)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,143 @@
+import asyncio
+import multiprocessing
+import signal
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+import torch
+
+
+class QueueFullError(Exception):
+    """ Levée quand trop de requêtes sont déjà en attente (backpressure → HTTP 429) """
+
+
+# Barrière partagée par les processus d'inférence (ExecutionPools.broadcast), transmise à leur lancement
+_broadcast_barrier = None
+
+
+def _init_inference_worker(num_threads, initializer=None, barrier=None):
+    """ Initialisation d'un processus d'inférence : limite les threads intra-op de torch, puis `initializer()` """
+    global _broadcast_barrier
+    _broadcast_barrier = barrier
+    # Gestionnaires hérités du worker web (uvicorn/gunicorn) : SIGTERM doit arrêter ce processus
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if initializer is not None:
+        initializer()
+
+
+def _run_once_per_worker(fn, args, timeout):
+    # Bloqué jusqu'à ce que chaque processus ait pris sa tâche : aucun n'en exécute deux
+    _broadcast_barrier.wait(timeout)
+    return fn(*args)
+
+
+# ---------------------------
+# Pools d'exécution hors boucle asyncio
+# ---------------------------
+class ExecutionPools:
+    """
+    Sort le travail CPU de la boucle asyncio :
+    - décodage + préprocessing dans un pool de threads borné,
+    - inférence dans un pool dédié (threads ou processus).
+
+    Le nombre de requêtes admises est borné par `max_queue` : au-delà,
+    `admit()` lève QueueFullError pour que l'API réponde 429.
+    En mode processus, `inference_initializer` (fonction de module) est appelée
+    au lancement de chaque worker, ex: chargement du modèle.
+
+    `start()` est appelé au démarrage du worker web : le nombre de threads torch (set_num_threads
+    démarre déjà des threads intra-op) et le ProcessPoolExecutor (files et pipes) ne sont fixés
+    qu'à ce moment, pas à l'import : avec le preload de gunicorn, rien de tout cela n'existe dans
+    le master au moment du fork.
+    """
+
+    def __init__(self, decode_workers=2, inference_workers=1, inference_kind="thread",
+                 max_queue=64, torch_threads=None, queue_depth_metric=None, inference_initializer=None):
+        if inference_kind not in ("thread", "process"):
+            raise ValueError(f"Type de pool d'inférence inconnu : {inference_kind}")
+        self.max_queue = max_queue
+        self.inference_workers = inference_workers
+        self.inference_kind = inference_kind
+        self.queue_depth_metric = queue_depth_metric
+        self._pending = 0
+
+        self.decode_executor = ThreadPoolExecutor(
+            max_workers=decode_workers, thread_name_prefix="decode"
+        )
+        self._torch_threads = torch_threads
+        self._inference_initializer = inference_initializer
+        self._inference_executor = None
+        self._barrier = None
+        if inference_kind == "thread":
+            self._inference_executor = ThreadPoolExecutor(
+                max_workers=inference_workers, thread_name_prefix="inference"
+            )
+
+    def start(self):
+        """ Threads torch du process puis pool d'inférence (à appeler après le fork) """
+        if self._torch_threads:
+            torch.set_num_threads(self._torch_threads)
+        return self.inference_executor
+
+    @property
+    def inference_executor(self):
+        if self._inference_executor is None:
+            self._barrier = multiprocessing.Barrier(self.inference_workers)
+            self._inference_executor = ProcessPoolExecutor(
+                max_workers=self.inference_workers,
+                initializer=_init_inference_worker,
+                initargs=(self._torch_threads, self._inference_initializer, self._barrier),
+            )
+        return self._inference_executor
+
+    def broadcast(self, fn, *args, timeout=60.0):
+        """
+        Mode processus : exécute `fn(*args)` une fois dans chaque processus d'inférence (ex: activer
+        une nouvelle version) et renvoie les résultats. Bloquant : à appeler hors boucle asyncio.
+        """
+        if self.inference_kind != "process":
+            raise RuntimeError("broadcast n'a de sens qu'avec un pool d'inférence en processus")
+        executor = self.inference_executor
+        futures = [executor.submit(_run_once_per_worker, fn, args, timeout) for _ in range(self.inference_workers)]
+        wait(futures)
+        if any(future.exception() is not None for future in futures):
+            # Barrière cassée (délai dépassé) : remise à zéro pour la diffusion suivante
+            self._barrier.reset()
+        return [future.result() for future in futures]
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @contextmanager
+    def admit(self, n=1):
+        """ Réserve `n` places dans la file, ou lève QueueFullError si elle est pleine """
+        if self._pending + n > self.max_queue:
+            raise QueueFullError(
+                f"File d'attente pleine ({self._pending}/{self.max_queue} requêtes en cours)"
+            )
+        self._pending += n
+        self._update_metric()
+        try:
+            yield
+        finally:
+            self._pending -= n
+            self._update_metric()
+
+    async def decode(self, fn, *args):
+        """ Exécute une fonction de décodage/préprocessing dans le pool de threads """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.decode_executor, fn, *args)
+
+    def shutdown(self):
+        self.decode_executor.shutdown(wait=False, cancel_futures=True)
+        if self._inference_executor is not None:
+            # Processus : attendus pour qu'ils reçoivent leur signal d'arrêt (sinon orphelins à l'arrêt du worker)
+            self._inference_executor.shutdown(wait=self.inference_kind == "process", cancel_futures=True)
+
+    def _update_metric(self):
+        if self.queue_depth_metric is not None:
+            self.queue_depth_metric.set(self._pending)
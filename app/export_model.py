@@ -0,0 +1,186 @@
+"""
+Export des backends d'inférence optimisés et vérification de parité.
+
+    # Produit les artefacts TorchScript / ONNX / int8 à partir du state_dict entraîné
+    python export_model.py export --weights model_v1_1761836094.pt --calib-dir ../FishImgDataset/train
+
+    # Compare chaque backend au modèle fp32 sur le split de test et choisit
+    # le plus rapide qui reste dans la tolérance d'accuracy (hors int8_dynamic, tête fc seule)
+    python export_model.py parity --weights model_v1_1761836094.pt --test-dir ../FishImgDataset/test
+
+Le backend retenu s'active dans l'API avec INFERENCE_BACKEND=<backend>.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import torch
+from torch.utils.data import DataLoader
+from torchvision import datasets
+
+from architectures import build_model
+from backends import (
+    ARTIFACT_SUFFIXES, HEAD_ONLY_BACKENDS, artifact_path, load_backend,
+    export_torchscript, export_onnx, export_int8_dynamic, export_int8_static,
+)
+from model import CLASSES, MINIO_BUCKET, LOCAL_MODEL_PATH, get_minio_client, get_transform, model_architecture
+
+
+def load_fp32_model(weights_path):
+    """ Reconstruit le modèle fp32 (architecture enregistrée avec les poids) à partir du state_dict entraîné """
+    model = build_model(model_architecture(os.path.basename(weights_path), weights_path), len(CLASSES))
+    model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+    return model.eval()
+
+
+def image_loader(directory, batch_size, max_batches=None):
+    """ Batchs (images, labels) d'un dossier label/fichier, avec le préprocessing de l'API """
+    dataset = datasets.ImageFolder(root=directory, transform=get_transform())
+    if len(dataset.classes) != len(CLASSES):
+        raise ValueError(f"{directory} contient {len(dataset.classes)} classes, {len(CLASSES)} attendues")
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=max_batches is not None)
+    for i, batch in enumerate(loader):
+        if max_batches is not None and i >= max_batches:
+            break
+        yield batch
+
+
+# ---------------------------
+# Export
+# ---------------------------
+def export(args):
+    model = load_fp32_model(args.weights)
+    for backend in args.backends:
+        path = artifact_path(args.weights, backend)
+        start = time.perf_counter()
+        if backend == "torchscript":
+            export_torchscript(model, path)
+        elif backend == "onnx":
+            export_onnx(model, path)
+        elif backend == "int8_dynamic":
+            print("ℹ️  int8_dynamic : tête fc seule quantifiée, convolutions en fp32 (pas de gain attendu)")
+            export_int8_dynamic(model, path)
+        elif backend == "int8_static":
+            if not args.calib_dir:
+                print("⚠️  int8_static ignoré : --calib-dir requis pour la calibration")
+                continue
+            calibration = (images for images, _ in image_loader(args.calib_dir, 16, args.calib_batches))
+            export_int8_static(model, path, calibration)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"✅ {backend:<13} → {path} ({size_mb:.1f} MB, {time.perf_counter() - start:.1f}s)")
+
+        if args.upload:
+            get_minio_client().fput_object(MINIO_BUCKET, os.path.basename(path), path)
+            print(f"   📤 Envoyé sur MinIO : bucket='{MINIO_BUCKET}', objet='{os.path.basename(path)}'")
+
+
+# ---------------------------
+# Parité et latence
+# ---------------------------
+def measure_latency(model, batch_size, repeats):
+    """ Latence médiane (ms) d'un forward sur un batch aléatoire """
+    batch = torch.randn(batch_size, 3, 224, 224)
+    timings = []
+    with torch.no_grad():
+        model(batch)  # warmup
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def evaluate(model, batches):
+    """ Prédictions top-1 du modèle sur les batchs de test """
+    predictions = []
+    with torch.no_grad():
+        for images in batches:
+            predictions.append(model(images).argmax(dim=1))
+    return torch.cat(predictions)
+
+
+def parity(args):
+    # Le split de test est chargé une seule fois et réutilisé pour chaque backend
+    batches, labels = [], []
+    for images, targets in image_loader(args.test_dir, args.batch_size):
+        batches.append(images)
+        labels.append(targets)
+    labels = torch.cat(labels)
+    print(f"📊 {len(labels)} images de test chargées depuis {args.test_dir}")
+
+    reference = load_fp32_model(args.weights)
+    ref_predictions = evaluate(reference, batches)
+    ref_accuracy = 100 * (ref_predictions == labels).float().mean().item()
+
+    report = []
+    for backend in ["eager"] + args.backends:
+        try:
+            model = reference if backend == "eager" else load_backend(backend, args.weights)
+        except FileNotFoundError as e:
+            print(f"⚠️  {e}")
+            continue
+        predictions = ref_predictions if backend == "eager" else evaluate(model, batches)
+        accuracy = 100 * (predictions == labels).float().mean().item()
+        entry = {
+            "backend": backend,
+            "accuracy": round(accuracy, 2),
+            "accuracy_delta": round(accuracy - ref_accuracy, 2),
+            "agreement_with_fp32": round(100 * (predictions == ref_predictions).float().mean().item(), 2),
+            "latency_ms_batch1": round(measure_latency(model, 1, args.repeats), 2),
+            f"latency_ms_batch{args.batch_size}": round(measure_latency(model, args.batch_size, args.repeats), 2),
+        }
+        entry["ms_per_image"] = round(entry[f"latency_ms_batch{args.batch_size}"] / args.batch_size, 2)
+        entry["within_tolerance"] = ref_accuracy - accuracy <= args.tolerance
+        entry["head_only"] = backend in HEAD_ONLY_BACKENDS
+        report.append(entry)
+
+    print(f"\n{'Backend':<14} {'Acc':>7} {'ΔAcc':>7} {'Accord':>7} {'ms(b=1)':>9} {'ms/img':>8}  OK")
+    print("=" * 64)
+    for e in report:
+        print(f"{e['backend']:<14} {e['accuracy']:>6.2f}% {e['accuracy_delta']:>+6.2f} {e['agreement_with_fp32']:>6.2f}% "
+              f"{e['latency_ms_batch1']:>9.2f} {e['ms_per_image']:>8.2f}  {'✅' if e['within_tolerance'] else '❌'}"
+              f"{'  (tête fc seule, non retenu)' if e['head_only'] else ''}")
+
+    # Les backends qui ne quantifient que la tête ne sont pas des candidats : leur écart de latence au fp32 est du bruit
+    eligible = [e for e in report if e["within_tolerance"] and not e["head_only"]]
+    best = min(eligible, key=lambda e: e["ms_per_image"])
+    print(f"\n🏆 Backend retenu (tolérance {args.tolerance} pt) : {best['backend']} → INFERENCE_BACKEND={best['backend']}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"fp32_accuracy": round(ref_accuracy, 2), "tolerance": args.tolerance,
+                       "selected": best["backend"], "backends": report}, f, indent=2)
+        print(f"📝 Rapport écrit dans {args.report}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Export et parité des backends d'inférence CPU")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Produire les artefacts optimisés depuis le state_dict")
+    p_export.add_argument("--weights", default=LOCAL_MODEL_PATH, help="State_dict entraîné (.pt)")
+    p_export.add_argument("--backends", nargs="+", default=list(ARTIFACT_SUFFIXES), choices=list(ARTIFACT_SUFFIXES),
+                          help="int8_dynamic ne quantifie que la tête fc (convolutions fp32, pas de gain attendu)")
+    p_export.add_argument("--calib-dir", help="Dossier d'images (label/fichier) pour calibrer int8_static")
+    p_export.add_argument("--calib-batches", type=int, default=8)
+    p_export.add_argument("--upload", action="store_true", help="Envoyer les artefacts dans le bucket MinIO des modèles")
+    p_export.set_defaults(func=export)
+
+    p_parity = sub.add_parser("parity", help="Comparer les backends au modèle fp32 sur le split de test")
+    p_parity.add_argument("--weights", default=LOCAL_MODEL_PATH, help="State_dict entraîné (.pt)")
+    p_parity.add_argument("--test-dir", required=True, help="Dossier de test (label/fichier)")
+    p_parity.add_argument("--backends", nargs="+", default=list(ARTIFACT_SUFFIXES), choices=list(ARTIFACT_SUFFIXES))
+    p_parity.add_argument("--tolerance", type=float, default=1.0, help="Perte d'accuracy max tolérée (points)")
+    p_parity.add_argument("--batch-size", type=int, default=32)
+    p_parity.add_argument("--repeats", type=int, default=20)
+    p_parity.add_argument("--report", help="Fichier JSON du rapport de parité")
+    p_parity.set_defaults(func=parity)
+
+    args = p.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Configuration gunicorn du mode multi-workers de l'API (workers uvicorn) :
+
+    gunicorn main:app -c gunicorn_conf.py
+
+- WEB_WORKERS process servent les requêtes ; les poids du modèle sont lus en mmap depuis le même
+  fichier .safetensors (model.py) : les pages sont partagées entre workers via le cache de pages
+  au lieu d'être copiées dans chaque process (voir benchmarks/bench_workers.py). En channels_last
+  (INFERENCE_CHANNELS_LAST), ils sont lus depuis la variante .cl.safetensors déjà dans ce format :
+  convertir le modèle dans chaque worker en ferait une copie privée.
+- GUNICORN_PRELOAD=1 (défaut) importe l'application (torch, FastAPI...) une fois dans le master avant
+  le fork : le code et les objets Python importés sont partagés en copy-on-write au lieu d'être
+  reconstruits par chaque worker. Le modèle lui-même est toujours chargé après le fork, dans chaque
+  worker (/ready par worker), et torch.set_num_threads (qui démarre les threads intra-op) n'est appelé
+  qu'au démarrage du worker (ExecutionPools.start) : le master ne lance aucun thread torch avant le fork.
+- Les métriques Prometheus de chaque worker sont écrites dans PROMETHEUS_MULTIPROC_DIR
+  et agrégées par /metrics, quel que soit le worker qui répond.
+"""
+import os
+import shutil
+import tempfile
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = WEB_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Le chargement du modèle est asynchrone (/ready) : le timeout ne couvre que le démarrage d'uvicorn
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Répertoire des métriques multiprocess : défini, vidé (fichiers d'anciens workers) et créé ici,
+# avant le preload : l'import de main.py y ouvre déjà les fichiers des histogrammes et gauges
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "fish_metrics"))
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Threads torch par worker : les cœurs sont partagés entre les workers (sinon sur-souscription)
+os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+
+
+def child_exit(server, worker):
+    """ Les gauges `live*` d'un worker arrêté ne sont plus comptées """
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
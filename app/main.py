@@ -1,15 +1,66 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, Response
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
+import asyncio
+import json
+import os
+import threading
+import weakref
 import time
-from model import predict
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from typing import List, Optional
+import torch
+from PIL import Image
+from pydantic import BaseModel
+from model import (
+    CLASSES, MODEL_POLL_INTERVAL, decode_image, get_minio_client, get_model_version,
+    activate_version, predict_topk, rank_classes, registry, warm_start,
+)
+from registry import ModelNotFoundError
+from bulk import MinioSource, ScoringStats, score_stream, BULK_BATCH_SIZE, DATASET_BUCKET
+from batching import MicroBatcher
+from executor import ExecutionPools, QueueFullError
+from cache import PredictionCache, RedisCacheBackend
+from decode import ImageTooLargeError, check_upload_size, warmup_jpeg
+from tensor_io import (
+    TensorFormatError, UnsupportedFormatError, encode_response, expected_bytes, parse_shape, pixels_to_tensor,
+    response_type,
+)
+from similarity import IndexUnavailableError, SimilaritySearch, SIMILAR_MAX_K, SIMILAR_NPROBE, describe_key, load_embedder
+from tracing import LATENCY_BUCKETS, RequestTimer, make_tracer, timed_call
+from profiling import PROFILING_ENABLED, Profiler, ProfilerBusyError, ProfilerUnavailableError
+from utils import extract_images_from_archive
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
 
 app = FastAPI(title="🐟 Fish Species Classifier API")
 
-# Métriques Prometheus
+# Configuration du micro-batching (regroupement des requêtes concurrentes)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Configuration des pools d'exécution (décodage et inférence hors boucle asyncio)
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "2"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_POOL = os.getenv("INFERENCE_POOL", "thread")  # "thread" ou "process"
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "64"))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0")) or None
+
+# Configuration de l'endpoint /predict/batch
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "256"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "32"))
+
+# Configuration du cache des prédictions (0 entrée = cache désactivé)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+
+# Nombre de jobs de scoring en masse (/score/bulk) autorisés en parallèle
+BULK_MAX_JOBS = int(os.getenv("BULK_MAX_JOBS", "1"))
+
+# Métriques Prometheus. En multi-workers (gunicorn_conf.py), chaque process écrit ses valeurs
+# dans PROMETHEUS_MULTIPROC_DIR et /metrics les agrège ; `multiprocess_mode` dit comment
+# combiner les gauges des workers (ignoré avec un seul process).
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
 PREDICTIONS_TOTAL = Counter(
     'fish_predictions_total',
     'Total number of predictions made',
@@ -18,17 +69,94 @@ PREDICTIONS_TOTAL = Counter(
 PREDICTION_DURATION = Histogram(
     'fish_prediction_duration_seconds',
     'Time spent processing prediction',
-    buckets=[0.1, 0.5, 1.0, 2.0, 5.0, 10.0]
+    buckets=LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    'fish_stage_duration_seconds',
+    'Time spent in each stage of a request (read, decode, batch_wait, inference...)',
+    ['endpoint', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    'fish_batch_size',
+    'Number of images per model forward pass',
+    buckets=[1, 2, 4, 8, 16, 32, 64]
+)
+BATCH_QUEUE_WAIT = Histogram(
+    'fish_batch_queue_wait_seconds',
+    'Time spent by a request waiting in the batching queue',
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5]
+)
+CACHE_HITS = Counter(
+    'fish_cache_hits_total',
+    'Prediction cache hits',
+    ['source']
+)
+CACHE_MISSES = Counter(
+    'fish_cache_misses_total',
+    'Prediction cache misses'
+)
+CACHE_EVICTIONS = Counter(
+    'fish_cache_evictions_total',
+    'Prediction cache evictions',
+    ['reason']
+)
+CACHE_ENTRIES = Gauge(
+    'fish_cache_entries',
+    'Number of predictions held in the local cache',
+    multiprocess_mode='livesum'
+)
+QUEUE_DEPTH = Gauge(
+    'fish_queue_depth',
+    'Number of admitted requests waiting for decode or inference',
+    multiprocess_mode='livesum'
+)
+IN_FLIGHT = Gauge(
+    'fish_inference_in_flight',
+    'Number of images currently inside a model forward pass',
+    multiprocess_mode='livesum'
 )
 PREDICTION_CONFIDENCE = Gauge(
     'fish_prediction_confidence',
     'Confidence of the last prediction',
-    ['predicted_class']
+    ['predicted_class'],
+    multiprocess_mode='livemostrecent'
 )
 ERRORS_TOTAL = Counter(
     'fish_prediction_errors_total',
     'Total number of prediction errors'
 )
+REJECTED_TOTAL = Counter(
+    'fish_requests_rejected_total',
+    'Total number of requests rejected with 429 because the queue was full'
+)
+STARTUP_DURATION = Gauge(
+    'fish_startup_seconds',
+    'Time from API startup to readiness (model loaded and warmed up)',
+    multiprocess_mode='liveall'
+)
+# Cascade : taux d'escalade = fish_inference_stage_total{stage="full"} / somme des étapes,
+# coût effectif par image = compute_seconds_total (ou gflops_total) / stage_total
+INFERENCE_STAGE = Counter(
+    'fish_inference_stage_total',
+    'Images answered by each inference stage (fast = cascade model, full = served model)',
+    ['stage']
+)
+INFERENCE_COMPUTE = Counter(
+    'fish_inference_compute_seconds_total',
+    'Model compute time spent on answered images, amortized over their batch',
+    ['stage']
+)
+INFERENCE_GFLOPS = Counter(
+    'fish_inference_gflops_total',
+    'Estimated GFLOPs spent on answered images',
+    ['stage']
+)
+SIMILAR_SEARCH_DURATION = Histogram(
+    'fish_similar_search_seconds',
+    'Time spent searching the embedding index (excluding decode and embedding)',
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+)
 
 # Configuration CORS pour permettre les requêtes depuis le frontend
 app.add_middleware(
@@ -37,39 +165,575 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
+)
+
+pools = ExecutionPools(
+    decode_workers=DECODE_WORKERS,
+    inference_workers=INFERENCE_WORKERS,
+    inference_kind=INFERENCE_POOL,
+    max_queue=MAX_QUEUE_SIZE,
+    torch_threads=TORCH_NUM_THREADS,
+    queue_depth_metric=QUEUE_DEPTH,
+    inference_initializer=warm_start,
+)
+
+cache = PredictionCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    shared=RedisCacheBackend(CACHE_REDIS_URL, CACHE_TTL_SECONDS) if CACHE_REDIS_URL else None,
+    hits_metric=CACHE_HITS,
+    misses_metric=CACHE_MISSES,
+    evictions_metric=CACHE_EVICTIONS,
+)
+
+# Spans OpenTelemetry (TRACING_ENABLED=1) et profilage à la demande (PROFILING_ENABLED=1)
+tracer = make_tracer()
+profiler = Profiler()
+
+# Index d'embeddings (similarity.py), chargé au premier appel de /similar puis suivi à chaque mise à jour
+similarity = SimilaritySearch(load_embedder)
+
+# Le modèle renvoie toutes les classes triées : le même résultat (mis en cache)
+# sert à /predict (top-1) et à /predict/batch (top-k).
+# Les batchs sont formés par version de modèle (active ou épinglée).
+# Pool d'inférence attaché au démarrage (start_batcher) : créé après le fork des workers gunicorn.
+batcher = MicroBatcher(
+    rank_classes,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_concurrent_batches=INFERENCE_WORKERS,
+    batch_size_metric=BATCH_SIZE,
+    queue_wait_metric=BATCH_QUEUE_WAIT,
+    in_flight_metric=IN_FLIGHT,
 )
 
+# Démarrage : le modèle est chargé et chauffé en arrière-plan, /ready passe au vert ensuite
+startup_state = {"ready": False, "startup_s": None, "error": None, "task": None}
+
+def require_ready():
+    """ 503 tant que le modèle de démarrage n'est pas chargé et chauffé """
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Modèle en cours de chargement", headers={"Retry-After": "1"})
+
+async def warm_up_service():
+    """
+    Charge et chauffe le modèle (batchs servis, voir WARMUP_BATCH_SIZES), démarre les
+    workers d'inférence et fait un premier décodage par thread de décodage.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        key = await loop.run_in_executor(None, warm_start)
+        if pools.inference_kind == "process":
+            # Lance les processus : chacun charge le modèle dans son initializer
+            await asyncio.gather(*[
+                loop.run_in_executor(pools.inference_executor, warm_start) for _ in range(INFERENCE_WORKERS)
+            ])
+        sample = warmup_jpeg()
+        await asyncio.gather(*[pools.decode(decode_image, sample) for _ in range(DECODE_WORKERS)])
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"❌ Démarrage impossible : {e}")
+        return
+    startup_state["startup_s"] = round(time.perf_counter() - start, 3)
+    startup_state["ready"] = True
+    STARTUP_DURATION.set(startup_state["startup_s"])
+    print(f"✅ API prête en {startup_state['startup_s']:.2f}s (modèle {key})")
+    if pools.inference_kind == "process":
+        registry.prepare_fn = prepare_inference_workers
+    registry.start_polling(MODEL_POLL_INTERVAL)
+
+def prepare_inference_workers(loaded):
+    """
+    Mode processus : la nouvelle version est chargée, chauffée et activée dans chaque processus
+    d'inférence avant la bascule du process web (sinon chargée à froid par la première requête).
+    """
+    try:
+        pools.broadcast(activate_version, loaded.version)
+    except Exception as e:
+        print(f"⚠️ {loaded.version} non préparée dans les processus d'inférence ({e}) : chargée à la première requête")
+
+async def resolve_model(version=None):
+    """
+    Modèle qui servira la requête : l'actif, ou la version épinglée
+    (chargée hors boucle asyncio si elle n'est pas encore en mémoire).
+    """
+    require_ready()
+    if version is None:
+        return registry.active
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, registry.get, version)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def cache_lookup(image_bytes, model_version):
+    """ Cherche une prédiction en cache (hash calculé hors boucle asyncio) → (clé, classement) """
+    if not cache.enabled:
+        return None, None
+    # Purge automatique des entrées d'un ancien modèle dès que le modèle actif change
+    cache.set_model_version(get_model_version())
+    return await pools.decode(cache.get, image_bytes, model_version)
+
+def store_and_count(key, model_version, ranked):
+    # Gauge mise à jour explicitement : set_function n'est pas lue en mode multiprocess
+    cache.set(key, model_version, ranked)
+    CACHE_ENTRIES.set(len(cache))
+
+def cache_store(key, model_version, ranked):
+    """ Enregistre un classement en cache sans bloquer la réponse """
+    if key is not None:
+        pools.decode_executor.submit(store_and_count, key, model_version, ranked)
+
+def observe_inference_cost(ranked):
+    """ Étape qui a répondu et coût d'une image passée dans le modèle (pas d'un résultat en cache) """
+    stage = getattr(ranked, "stage", None)
+    if stage is None:
+        return
+    INFERENCE_STAGE.labels(stage=stage).inc()
+    INFERENCE_COMPUTE.labels(stage=stage).inc(ranked.cost_s)
+    if ranked.gflops is not None:
+        INFERENCE_GFLOPS.labels(stage=stage).inc(ranked.gflops)
+
+async def timed_decode(timer, stage, fn, *args):
+    """ Exécute `fn` dans le pool de décodage : attente du pool et travail chronométrés séparément """
+    submitted = time.perf_counter()
+    result, start, end = await pools.decode(timed_call, fn, *args)
+    timer.add("decode_wait", submitted, start)
+    timer.add(stage, start, end)
+    return result
+
+@app.on_event("startup")
+async def start_batcher():
+    batcher.executor = pools.start()
+    batcher.start()
+    startup_state["task"] = asyncio.get_running_loop().create_task(warm_up_service())
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    if startup_state["task"] is not None:
+        startup_state["task"].cancel()
+    registry.stop_polling()
+    await batcher.stop()
+    pools.shutdown()
+
 @app.get("/")
 def root():
     return {"message": "Bienvenue sur l'API de classification de poissons 🐠"}
 
+@app.get("/ready")
+def ready():
+    """ Readiness (k8s) : 200 seulement une fois le modèle chargé et chauffé, 503 avant """
+    if not startup_state["ready"]:
+        return JSONResponse({"ready": False, "error": startup_state["error"]}, status_code=503)
+    return {"ready": True, "model": registry.active.key, "startup_s": startup_state["startup_s"]}
+
 @app.get("/metrics")
 def metrics():
-    """Endpoint pour exposer les métriques Prometheus"""
+    """Endpoint pour exposer les métriques Prometheus (agrégées sur tous les workers en multi-workers)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return Response(generate_latest(collector_registry), media_type=CONTENT_TYPE_LATEST)
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+@app.get("/model")
+def model_info():
+    """ Version de modèle active, versions en mémoire et versions disponibles dans MinIO """
+    return registry.status()
+
+@app.get("/similar")
+def similar_info():
+    """ État de l'index d'embeddings servi par POST /similar """
+    return similarity.status()
+
 @app.post("/predict")
-async def classify(file: UploadFile = File(...)):
-    start_time = time.time()
+async def classify(
+    file: UploadFile = File(...),
+    model_version: Optional[str] = Query(None, description="Version épinglée, ex: model_v1_1761836094"),
+):
+    timer = RequestTimer("predict", STAGE_DURATION, tracer)
+    loaded = await resolve_model(model_version)
     try:
-        # Lecture de l'image envoyée
-        image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        with pools.admit():
+            # Lecture de l'image envoyée (taille vérifiée avant lecture si connue)
+            with timer.stage("read"):
+                if file.size is not None:
+                    check_upload_size(file.size)
+                image_bytes = await file.read()
 
-        # Prédiction
-        label, confidence = predict(image)
+            # Image déjà vue avec ce modèle : ni décodage ni inférence
+            with timer.stage("cache"):
+                cache_key, ranked = await cache_lookup(image_bytes, loaded.key)
+            cache_hit = ranked is not None
+
+            if ranked is None:
+                # Décodage + préprocessing dans le pool de threads
+                tensor = await timed_decode(timer, "decode", decode_image, image_bytes)
+
+                # Prédiction (regroupée avec les requêtes concurrentes du même modèle)
+                batch_timings = {}
+                ranked = await batcher.submit(tensor, group=loaded.version, timings=batch_timings)
+                for stage, (start, end) in batch_timings.items():
+                    timer.add(stage, start, end)
+                observe_inference_cost(ranked)
+                cache_store(cache_key, loaded.key, ranked)
+
+        label, confidence = ranked[0]
+        # Étape qui a répondu : fast (petit modèle de la cascade), full (modèle servi) ou cache
+        stage = "cache" if cache_hit else ranked.stage
+        with timer.stage("serialize"):
+            response = JSONResponse({
+                "prediction": label,
+                "confidence": round(confidence * 100, 2),
+                "model_version": loaded.version,
+                "stage": stage,
+            })
 
         # Enregistrement des métriques
-        duration = time.time() - start_time
+        duration = timer.finish(response, model_version=loaded.version, cache_hit=cache_hit, stage=stage)
         PREDICTIONS_TOTAL.labels(predicted_class=label).inc()
         PREDICTION_DURATION.observe(duration)
         PREDICTION_CONFIDENCE.labels(predicted_class=label).set(confidence)
+        return response
+
+    except QueueFullError as e:
+        REJECTED_TOTAL.inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except ImageTooLargeError as e:
+        ERRORS_TOTAL.inc()
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        ERRORS_TOTAL.inc()
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la prédiction : {str(e)}")
+    finally:
+        timer.finish()
+
+
+def image_error(error):
+    """ Erreur d'une image d'un batch, avec le statut qu'aurait renvoyé /predict pour elle seule """
+    if isinstance(error, (ImageTooLargeError, Image.DecompressionBombError)):
+        return {"error": str(error), "status": 413}
+    return {"error": f"Image illisible : {error}", "status": 400}
+
+
+async def run_ranked_in_chunks(tensors, version):
+    """ Passe les tenseurs (liste, ou batch déjà empilé) dans le modèle par morceaux de BATCH_CHUNK_SIZE images """
+    loop = asyncio.get_running_loop()
+    results = []
+    for start in range(0, len(tensors), BATCH_CHUNK_SIZE):
+        chunk = tensors[start:start + BATCH_CHUNK_SIZE]
+        if not isinstance(chunk, torch.Tensor):
+            chunk = torch.stack(chunk)
+        BATCH_SIZE.observe(len(chunk))
+        IN_FLIGHT.inc(len(chunk))
+        try:
+            results.extend(await loop.run_in_executor(
+                pools.inference_executor, rank_classes, chunk, version
+            ))
+        finally:
+            IN_FLIGHT.dec(len(chunk))
+    return results
+
+@app.post("/predict/batch")
+async def classify_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    top_k: int = Query(3, ge=1, le=len(CLASSES)),
+    model_version: Optional[str] = Query(None, description="Version épinglée, ex: model_v1_1761836094"),
+):
+    """
+    Prédiction sur plusieurs images en une seule requête : soit N fichiers
+    multipart `files`, soit une archive zip/tar `archive`.
+    """
+    timer = RequestTimer("predict_batch", STAGE_DURATION, tracer)
+    loaded = await resolve_model(model_version)
+    try:
+        with pools.admit():
+            # Lecture des images envoyées
+            images = []
+            with timer.stage("read"):
+                for upload in files or []:
+                    images.append((upload.filename, await upload.read()))
+                if archive is not None:
+                    # Décompression hors boucle asyncio (une grosse archive ne bloque pas les autres requêtes)
+                    images.extend(await pools.decode(
+                        extract_images_from_archive, await archive.read(), BATCH_MAX_FILES
+                    ))
+            if not images:
+                raise HTTPException(status_code=400, detail="Aucune image fournie (champ 'files' ou 'archive')")
+            if len(images) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Trop d'images (max {BATCH_MAX_FILES})")
 
-        return JSONResponse({
-            "prediction": label,
-            "confidence": round(confidence * 100, 2)
-        })
+            # Recherche en cache, puis décodage en parallèle des images manquantes
+            with timer.stage("cache"):
+                cached = await asyncio.gather(*[cache_lookup(data, loaded.key) for _, data in images])
+            missing = [i for i, (_, ranked) in enumerate(cached) if ranked is None]
+            with timer.stage("decode"):
+                decoded = dict(zip(missing, await asyncio.gather(
+                    *[pools.decode(decode_image, images[i][1]) for i in missing],
+                    return_exceptions=True,
+                )))
+            valid = [i for i in missing if not isinstance(decoded[i], Exception)]
 
+            # Inférence par morceaux
+            with timer.stage("inference"):
+                predictions = await run_ranked_in_chunks([decoded[i] for i in valid], loaded.version) if valid else []
+
+        ranking = {i: ranked for i, (_, ranked) in enumerate(cached) if ranked is not None}
+        for i, ranked in zip(valid, predictions):
+            ranking[i] = ranked
+            observe_inference_cost(ranked)
+            cache_store(cached[i][0], loaded.key, ranked)
+
+        results = [{"filename": name, **image_error(decoded.get(i))} for i, (name, _) in enumerate(images)]
+        for i, ranked in ranking.items():
+            top = ranked[:top_k]
+            label, confidence = top[0]
+            PREDICTIONS_TOTAL.labels(predicted_class=label).inc()
+            results[i] = {
+                "filename": images[i][0],
+                "prediction": label,
+                "confidence": round(confidence * 100, 2),
+                "stage": "cache" if cached[i][1] is not None else ranked.stage,
+                "top_k": [
+                    {"label": lbl, "confidence": round(conf * 100, 2)} for lbl, conf in top
+                ],
+            }
+        if len(ranking) < len(images):
+            ERRORS_TOTAL.inc(len(images) - len(ranking))
+
+        with timer.stage("serialize"):
+            response = JSONResponse({"count": len(results), "model_version": loaded.version, "results": results})
+        timer.finish(response, model_version=loaded.version, images=len(images))
+        return response
+
+    except HTTPException:
+        raise
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        REJECTED_TOTAL.inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         ERRORS_TOTAL.inc()
         raise HTTPException(status_code=500, detail=f"Erreur lors de la prédiction : {str(e)}")
+    finally:
+        timer.finish()
+
+
+async def read_tensor_body(request: Request, size: int) -> bytearray:
+    """ Corps brut lu par morceaux dans un bytearray (vu ensuite sans copie), refusé dès qu'il dépasse `size` """
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > size:
+            raise TensorFormatError(f"Corps plus long que les {size} octets annoncés par X-Tensor-Shape")
+    return body
+
+@app.post("/predict/tensor")
+async def classify_tensor(
+    request: Request,
+    x_tensor_shape: str = Header(..., description="Forme uint8, ex: 224,224,3 ou 8,224,224,3"),
+    x_tensor_layout: str = Header("nhwc", description="nhwc (défaut) ou nchw"),
+    accept: Optional[str] = Header(None),
+    model_version: Optional[str] = Query(None, description="Version épinglée, ex: model_v1_1761836094"),
+):
+    """
+    Prédiction sur des pixels uint8 déjà redimensionnés en 224x224 (une image ou un batch), envoyés
+    bruts dans le corps : ni multipart, ni décodage JPEG, ni cache (voir tensor_io.py).
+    """
+    timer = RequestTimer("predict_tensor", STAGE_DURATION, tracer)
+    loaded = await resolve_model(model_version)
+    try:
+        media_type = response_type(accept)
+        shape = parse_shape(x_tensor_shape, x_tensor_layout)
+        if shape[0] > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Trop d'images (max {BATCH_MAX_FILES})")
+        with pools.admit():
+            with timer.stage("read"):
+                body = await read_tensor_body(request, expected_bytes(shape))
+
+            # Conversion float + normalisation dans le pool de décodage (pas de PIL)
+            batch = await timed_decode(timer, "decode", pixels_to_tensor, body, shape, x_tensor_layout)
+
+            if len(batch) == 1:
+                # Une image : regroupée avec les requêtes /predict concurrentes du même modèle
+                batch_timings = {}
+                rankings = [await batcher.submit(batch[0], group=loaded.version, timings=batch_timings)]
+                for stage, (start, end) in batch_timings.items():
+                    timer.add(stage, start, end)
+            else:
+                with timer.stage("inference"):
+                    rankings = await run_ranked_in_chunks(batch, loaded.version)
+
+        stages = [ranked.stage for ranked in rankings]
+        for ranked in rankings:
+            observe_inference_cost(ranked)
+            PREDICTIONS_TOTAL.labels(predicted_class=ranked[0][0]).inc()
+        with timer.stage("serialize"):
+            content, headers = encode_response(media_type, rankings, stages, CLASSES, loaded.version)
+            if isinstance(content, dict):
+                response = JSONResponse(content)
+            else:
+                response = Response(content, media_type=media_type, headers=headers)
+        duration = timer.finish(response, model_version=loaded.version, images=len(rankings))
+        PREDICTION_DURATION.observe(duration)
+        return response
+
+    except HTTPException:
+        raise
+    except TensorFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    except QueueFullError as e:
+        REJECTED_TOTAL.inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        ERRORS_TOTAL.inc()
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la prédiction : {str(e)}")
+    finally:
+        timer.finish()
+
+
+class BulkScoringRequest(BaseModel):
+    bucket: str = DATASET_BUCKET
+    prefix: str = ""
+    split: Optional[str] = None
+    top_k: int = 1
+    batch_size: int = BULK_BATCH_SIZE
+
+bulk_slots = threading.BoundedSemaphore(BULK_MAX_JOBS)
+
+@app.post("/score/bulk")
+def score_bulk(request: BulkScoringRequest):
+    """
+    Score tous les objets d'un bucket/préfixe (ou d'un split de fish_data,
+    stocké sous "<split>/") et renvoie les résultats en NDJSON au fil de l'eau.
+    La dernière ligne contient le résumé (nombre d'images, img/s).
+    """
+    require_ready()
+    if not bulk_slots.acquire(blocking=False):
+        REJECTED_TOTAL.inc()
+        raise HTTPException(status_code=429, detail="Un scoring en masse est déjà en cours",
+                            headers={"Retry-After": "30"})
+
+    release = None
+    try:
+        prefix = f"{request.split}/" if request.split else request.prefix
+        top_k = max(1, min(request.top_k, len(CLASSES)))
+        source = MinioSource(get_minio_client(), request.bucket, prefix)
+        stats = ScoringStats()
+        # Tout le job est scoré avec le modèle actif au démarrage, même en cas de rechargement
+        version = registry.active.version
+        stream = bulk_stream(source, stats, version, top_k, request.batch_size, lambda: release())
+        # Place libérée une seule fois : à la fin du flux, ou quand le générateur est abandonné
+        # sans avoir démarré (client parti avant la première ligne : son `finally` ne s'exécute pas)
+        release = weakref.finalize(stream, bulk_slots.release)
+        return StreamingResponse(stream, media_type="application/x-ndjson")
+    except BaseException:
+        if release is not None:
+            release()
+        else:
+            bulk_slots.release()
+        raise
+
+
+def bulk_stream(source, stats, version, top_k, batch_size, release):
+    """ Lignes NDJSON d'un job /score/bulk, puis le résumé ; `release()` libère la place du job """
+
+    def infer(batch, k):
+        # L'inférence passe par le pool dédié, comme pour /predict
+        BATCH_SIZE.observe(len(batch))
+        IN_FLIGHT.inc(len(batch))
+        try:
+            return pools.inference_executor.submit(predict_topk, batch, k, version).result()
+        finally:
+            IN_FLIGHT.dec(len(batch))
+
+    try:
+        for result in score_stream(source, source.keys(), decode_image, infer,
+                                   batch_size=batch_size, top_k=top_k, stats=stats):
+            if "error" in result:
+                ERRORS_TOTAL.inc()
+            else:
+                PREDICTIONS_TOTAL.labels(predicted_class=result["prediction"]).inc()
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": stats.summary()}) + "\n"
+    finally:
+        release()
+
+
+@app.post("/similar")
+async def similar_images(
+    file: UploadFile = File(...),
+    k: int = Query(10, ge=1, le=SIMILAR_MAX_K),
+    nprobe: int = Query(SIMILAR_NPROBE, ge=1, description="Listes IVF parcourues (rappel vs latence)"),
+):
+    """ Les k images du dataset les plus proches de l'image envoyée (embeddings du modèle de l'index) """
+    require_ready()
+    timer = RequestTimer("similar", STAGE_DURATION, tracer)
+    try:
+        with pools.admit():
+            with timer.stage("read"):
+                if file.size is not None:
+                    check_upload_size(file.size)
+                image_bytes = await file.read()
+            tensor = await timed_decode(timer, "decode", decode_image, image_bytes)
+            index, embedder = await pools.decode(similarity.current)
+
+            # Le modèle d'embedding vit dans ce process : pool d'inférence s'il est en threads
+            executor = pools.inference_executor if pools.inference_kind == "thread" else pools.decode_executor
+            loop = asyncio.get_running_loop()
+            embedding, start, end = await loop.run_in_executor(executor, timed_call, embedder, tensor.unsqueeze(0))
+            timer.add("embed", start, end)
+            results, start, end = await pools.decode(timed_call, index.search, embedding[0], k, nprobe)
+            timer.add("search", start, end)
+        search_s = end - start
+        SIMILAR_SEARCH_DURATION.observe(search_s)
+
+        with timer.stage("serialize"):
+            response = JSONResponse({
+                "model_version": index.model_version,
+                "index_size": len(index),
+                "search_ms": round(search_s * 1000, 3),
+                "results": [dict(describe_key(key), score=round(score, 4)) for key, score in results],
+            })
+        timer.finish(response, model_version=index.model_version)
+        return response
+
+    except IndexUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except QueueFullError as e:
+        REJECTED_TOTAL.inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except ImageTooLargeError as e:
+        ERRORS_TOTAL.inc()
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        ERRORS_TOTAL.inc()
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la recherche : {str(e)}")
+    finally:
+        timer.finish()
+
+
+@app.post("/debug/profile")
+async def profile(
+    seconds: float = Query(10.0, gt=0, description="Durée du profilage (s), l'API continue de servir"),
+    mode: str = Query("sample", description="sample (piles de tous les threads), py-spy ou torch"),
+):
+    """ Profil de l'API sous sa charge réelle pendant `seconds` secondes (PROFILING_ENABLED=1) """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profilage désactivé (PROFILING_ENABLED=0)")
+    try:
+        path, media_type = await asyncio.get_running_loop().run_in_executor(None, profiler.run, mode, seconds)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ProfilerUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
@@ -1,17 +1,59 @@
+import json
 import os
+import re
+import time
+from functools import lru_cache
 import torch
 import torch.nn as nn
-from torchvision import transforms
 from PIL import Image
-from minio import Minio
-from io import BytesIO
+from backends import (
+    BACKENDS, SAFETENSORS_AVAILABLE, PrecisionModel, artifact_path, build_from_state_dict,
+    channels_last_weights_path, load_backend, load_weights, metadata_path, save_channels_last_safetensors,
+    save_safetensors, weights_metadata, weights_path,
+)
+from architectures import DEFAULT_ARCHITECTURE
+from cascade import Cascade, Ranking, count_gflops, timed_probabilities
+from decode import IMAGENET_MEAN, IMAGENET_STD, decode_to_tensor
+from registry import LoadedModel, ModelRegistry, ModelNotFoundError
 
 # ---------------------------
 # Configuration du modèle
 # ---------------------------
-MODEL_FILENAME = "model_v1_1761836094.pt"
-LOCAL_MODEL_PATH = os.path.join(os.getcwd(), MODEL_FILENAME)
+MODEL_FILENAME = os.getenv("MODEL_FILENAME", "model_v1_1761836094.pt")
+MODEL_DIR = os.getenv("MODEL_DIR", os.getcwd())
+LOCAL_MODEL_PATH = os.path.join(MODEL_DIR, MODEL_FILENAME)
 MINIO_BUCKET = "models"
+# Sans accès à MinIO (benchmarks, développement) : modèle local uniquement, DummyModel sinon
+MODEL_OFFLINE = os.getenv("MODEL_OFFLINE", "0") == "1"
+# Poids lus en mmap (partagés entre workers via le cache de pages) ; 0 = copie privée par process
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1") == "1"
+
+# Rechargement à chaud : intervalle (s) de vérification du bucket `models` (0 = désactivé)
+MODEL_POLL_INTERVAL = float(os.getenv("MODEL_POLL_INTERVAL", "0" if MODEL_OFFLINE else "60"))
+# Nombre de versions gardées en mémoire (active + versions épinglées récemment)
+MODELS_KEPT_LOADED = int(os.getenv("MODELS_KEPT_LOADED", "2"))
+# Tailles de batch utilisées pour chauffer un nouveau modèle avant sa mise en service
+# (par défaut : une image seule et un micro-batch complet, comme servis par l'API)
+WARMUP_BATCH_SIZES = [
+    int(b) for b in os.getenv("WARMUP_BATCH_SIZES", f"1,{os.getenv('BATCH_MAX_SIZE', '8')}").split(",") if b
+]
+
+# Fichiers de modèles produits par train_model.py : model_v1_{timestamp}.pt
+MODEL_FILE_PATTERN = re.compile(r"^model_v\d+_(\d+)\.pt$")
+
+# Backend d'inférence : eager, torchscript, onnx, int8_dynamic, int8_static
+# (artefacts produits par export_model.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+# Précision (fp32, bf16) et format channels_last du backend eager ;
+# "auto" = reprend le mode d'entraînement inscrit dans les métadonnées du modèle
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "auto")
+INFERENCE_CHANNELS_LAST = os.getenv("INFERENCE_CHANNELS_LAST", "auto")
+
+# Cascade (cascade.py) : le petit modèle CASCADE_MODEL répond d'abord, le modèle servi seulement
+# sous le seuil de confiance ("auto" = seuil choisi sur la validation par train_model.py)
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_MODEL = os.getenv("CASCADE_MODEL", "")
+CASCADE_THRESHOLD = os.getenv("CASCADE_THRESHOLD", "auto")
 
 # Classes du dataset
 CLASSES = ["Catfish", "Goldfish", "Mudfish", "Mullet", "Snakehead"]
@@ -19,51 +61,101 @@ CLASSES = ["Catfish", "Goldfish", "Mudfish", "Mullet", "Snakehead"]
 # ---------------------------
 # Connexion à MinIO
 # ---------------------------
-minio_client = Minio(
-    "minio:9000",
-    access_key="admin-user",
-    secret_key="admin-password",
-    secure=False
-)
+_minio_client = None
+
+
+def get_minio_client():
+    """ Client MinIO créé à la première utilisation : l'import du module n'attend pas MinIO """
+    global _minio_client
+    if _minio_client is None:
+        from minio import Minio
+
+        _minio_client = Minio(
+            "minio:9000",
+            access_key="admin-user",
+            secret_key="admin-password",
+            secure=False
+        )
+    return _minio_client
 
 # ---------------------------
 # Chargement du modèle
 # ---------------------------
-def load_model():
+def fetch_model_file(filename=MODEL_FILENAME):
     """
-    Tente de charger le modèle depuis MinIO.
-    Si non disponible, utilise le modèle local.
+    Chemin local des poids d'une version : .safetensors de préférence, sinon .pt,
+    téléchargé depuis MinIO s'il n'est pas présent localement. None si introuvable.
     """
+    local_path = os.path.join(MODEL_DIR, filename)
+    candidates = ([weights_path(local_path)] if SAFETENSORS_AVAILABLE else []) + [local_path]
     # 1️⃣ On vérifie d’abord le local
-    if os.path.exists(LOCAL_MODEL_PATH):
-        print(f"✅ Modèle trouvé localement : {LOCAL_MODEL_PATH}")
-        model_bytes = open(LOCAL_MODEL_PATH, "rb").read()
-    else:
-        print("⚠️ Modèle local introuvable, tentative de récupération depuis MinIO...")
+    for path in candidates:
+        if os.path.exists(path):
+            print(f"✅ Modèle trouvé localement : {path}")
+            return path
+    if MODEL_OFFLINE:
+        print(f"⚠️ Modèle local introuvable ({local_path}) en mode hors ligne, utilisation du DummyModel")
+        return None
+
+    print("⚠️ Modèle local introuvable, tentative de récupération depuis MinIO...")
+    error = None
+    for path in candidates:
         try:
-            response = minio_client.get_object(MINIO_BUCKET, MODEL_FILENAME)
-            model_bytes = response.read()
-            with open(LOCAL_MODEL_PATH, "wb") as f:
-                f.write(model_bytes)
-            print("✅ Modèle téléchargé depuis MinIO et sauvegardé localement.")
+            # fget_object écrit dans un fichier temporaire renommé à la fin : pas de fichier tronqué
+            get_minio_client().fget_object(MINIO_BUCKET, os.path.basename(path), path)
+            print(f"✅ Modèle téléchargé depuis MinIO et sauvegardé localement : {path}")
+            return path
         except Exception as e:
-            print(f"❌ Impossible de charger le modèle depuis MinIO : {e}")
-            return DummyModel()  # Fallback
+            error = e
+    print(f"❌ Impossible de charger le modèle depuis MinIO : {error}")
+    return None
+
+
+def model_architecture(filename, path):
+    """ Architecture des poids : en-tête .safetensors, sinon métadonnées d'entraînement, sinon ResNet18 """
+    return (weights_metadata(path).get("architecture")
+            or load_model_metadata(filename).get("architecture")
+            or DEFAULT_ARCHITECTURE)
+
+
+def channels_last_state_dict(state_dict, path, architecture):
+    """
+    Poids relus depuis la variante channels_last (model_v1_123.cl.safetensors, écrite au premier
+    chargement) : la conversion de PrecisionModel ne réalloue plus les convolutions dans chaque
+    worker, les pages mappées restent partagées.
+    """
+    cl_path = channels_last_weights_path(path)
+    if not os.path.exists(cl_path):
+        if not save_channels_last_safetensors(state_dict, cl_path, {"architecture": architecture}):
+            return state_dict
+        print(f"💾 Poids channels_last écrits : {cl_path}")
+    return load_weights(cl_path)
+
+
+def load_model(filename=MODEL_FILENAME, architecture=None, channels_last=False):
+    """
+    Charge les poids d'une version sans les recopier en mémoire : .safetensors memory-mappé,
+    ou .pt lu par torch.load(mmap=True) puis converti en .safetensors pour les démarrages suivants.
+    L'architecture reconstruite est celle enregistrée avec les poids (voir architectures.py).
+    `channels_last` : poids lus depuis leur variante channels_last (voir channels_last_state_dict).
+    DummyModel si le modèle est introuvable ou illisible.
+    """
+    path = fetch_model_file(filename)
+    if path is None:
+        return DummyModel()  # Fallback
 
     try:
-        loaded_obj = torch.load(BytesIO(model_bytes), map_location=torch.device("cpu"))
+        start = time.perf_counter()
+        loaded_obj = load_weights(path, mmap=MODEL_MMAP)
         if isinstance(loaded_obj, dict):
-            print("⚙️ State_dict détecté, reconstruction de l'architecture ResNet18...")
-            from torchvision import models
-            
-            # Créer l'architecture ResNet18 (même que dans train_model.py)
-            model = models.resnet18(weights=None)  # pas de poids pré-entraînés
-            num_features = model.fc.in_features
-            model.fc = nn.Linear(num_features, len(CLASSES))
-            
-            # Charger le state_dict
-            model.load_state_dict(loaded_obj)
-            print("✅ State_dict chargé dans le modèle ResNet18")
+            # Architecture de train_model.py, liée aux poids mappés
+            architecture = architecture or model_architecture(filename, path)
+            if path.endswith(".pt") and save_safetensors(loaded_obj, weights_path(path), {"architecture": architecture}):
+                print(f"💾 Poids convertis en safetensors : {weights_path(path)}")
+            if channels_last and MODEL_MMAP:
+                loaded_obj = channels_last_state_dict(loaded_obj, path, architecture)
+            model = build_from_state_dict(loaded_obj, len(CLASSES), architecture)
+            print(f"✅ State_dict chargé dans le modèle {architecture} en {time.perf_counter() - start:.2f}s")
         elif hasattr(loaded_obj, "eval"):
             model = loaded_obj
             print("✅ Modèle complet chargé")
@@ -90,32 +182,278 @@ class DummyModel(nn.Module):
         return torch.zeros((batch, self.n_classes))
 
 
-# Charger le modèle au démarrage
-model = load_model()
+def load_model_metadata(filename=MODEL_FILENAME):
+    """
+    Métadonnées d'entraînement du modèle (model_v1_123.meta.json, local ou MinIO).
+    Renvoie {} si elles n'existent pas (modèles antérieurs).
+    """
+    path = metadata_path(os.path.join(MODEL_DIR, filename))
+    try:
+        if not os.path.exists(path) and not MODEL_OFFLINE:
+            get_minio_client().fget_object(MINIO_BUCKET, os.path.basename(path), path)
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def eager_mode(filename=MODEL_FILENAME):
+    """ (précision, channels_last) du backend eager : variables d'environnement ou métadonnées """
+    metadata = load_model_metadata(filename) if "auto" in (INFERENCE_PRECISION, INFERENCE_CHANNELS_LAST) else {}
+    precision = metadata.get("precision", "fp32") if INFERENCE_PRECISION == "auto" else INFERENCE_PRECISION
+    if INFERENCE_CHANNELS_LAST == "auto":
+        channels_last = bool(metadata.get("channels_last", False))
+    else:
+        channels_last = INFERENCE_CHANNELS_LAST == "1"
+    return precision, channels_last
+
+
+def with_eager_mode(model, filename=MODEL_FILENAME):
+    """ Applique au modèle eager la précision / le format mémoire demandés """
+    precision, channels_last = eager_mode(filename)
+    if precision == "fp32" and not channels_last:
+        return model, "eager"
+    try:
+        wrapped = PrecisionModel(model, precision, channels_last)
+    except ValueError as e:
+        print(f"⚠️ {e}, utilisation du modèle fp32")
+        return model, "eager"
+    print(f"✅ Modèle eager en {precision}{' channels_last' if channels_last else ''}")
+    return wrapped, "eager" + wrapped.label
+
+
+def load_inference_model(filename=MODEL_FILENAME):
+    """
+    Charge le modèle puis, si INFERENCE_BACKEND le demande, l'artefact optimisé
+    correspondant (local ou depuis MinIO). Repli sur le modèle eager en cas d'échec.
+    """
+    # Backend eager en channels_last : poids chargés directement dans ce format (mémoire partagée)
+    channels_last = INFERENCE_BACKEND == "eager" and eager_mode(filename)[1]
+    eager_model = load_model(filename, channels_last=channels_last)
+    if isinstance(eager_model, DummyModel):
+        return eager_model, "eager"
+    if INFERENCE_BACKEND == "eager":
+        return with_eager_mode(eager_model, filename)
+    if INFERENCE_BACKEND not in BACKENDS:
+        print(f"⚠️ Backend inconnu '{INFERENCE_BACKEND}', utilisation du modèle eager")
+        return with_eager_mode(eager_model, filename)
+
+    local_path = os.path.join(MODEL_DIR, filename)
+    try:
+        path = artifact_path(local_path, INFERENCE_BACKEND)
+        if not os.path.exists(path) and not MODEL_OFFLINE:
+            get_minio_client().fget_object(MINIO_BUCKET, os.path.basename(path), path)
+        optimized = load_backend(INFERENCE_BACKEND, local_path)
+        print(f"✅ Backend d'inférence '{INFERENCE_BACKEND}' chargé : {path}")
+        return optimized, INFERENCE_BACKEND
+    except Exception as e:
+        print(f"⚠️ Backend '{INFERENCE_BACKEND}' indisponible ({e}), utilisation du modèle eager")
+        return with_eager_mode(eager_model, filename)
+
+
+# ---------------------------
+# Versions du modèle (rechargement à chaud)
+# ---------------------------
+def version_of(filename: str) -> str:
+    """ "model_v1_1761836094.pt" → "model_v1_1761836094" """
+    return os.path.splitext(filename)[0]
+
+
+def version_timestamp(version: str) -> int:
+    """ Timestamp d'entraînement contenu dans le nom de version (0 si absent) """
+    match = MODEL_FILE_PATTERN.match(version + ".pt")
+    return int(match.group(1)) if match else 0
+
+
+def list_model_versions():
+    """ Versions présentes dans le bucket MinIO des modèles (hors artefacts exportés) """
+    return [
+        version_of(obj.object_name)
+        for obj in get_minio_client().list_objects(MINIO_BUCKET)
+        if MODEL_FILE_PATTERN.match(obj.object_name)
+    ]
+
+
+@lru_cache(maxsize=1)
+def get_cascade():
+    """
+    Petit modèle de la cascade (CASCADE_MODEL), chargé et chauffé une fois puis partagé par toutes
+    les versions servies. None si la cascade est désactivée ou inutilisable : le modèle complet répond seul.
+    """
+    if not CASCADE_ENABLED:
+        return None
+    if not CASCADE_MODEL:
+        print("⚠️ Cascade désactivée : CASCADE_MODEL n'est pas défini")
+        return None
+    metadata = load_model_metadata(CASCADE_MODEL)
+    if metadata.get("classes", CLASSES) != CLASSES:
+        print(f"⚠️ Cascade désactivée : classes de {CASCADE_MODEL} différentes de celles de l'API")
+        return None
+    if CASCADE_THRESHOLD != "auto":
+        threshold = float(CASCADE_THRESHOLD)
+    elif "threshold" in metadata.get("cascade", {}):
+        threshold = float(metadata["cascade"]["threshold"])
+    else:
+        print(f"⚠️ Cascade désactivée : pas de seuil calibré pour {CASCADE_MODEL} (définir CASCADE_THRESHOLD)")
+        return None
+    model = load_model(CASCADE_MODEL, metadata.get("architecture"))
+    if isinstance(model, DummyModel):
+        print(f"⚠️ Cascade désactivée : petit modèle {CASCADE_MODEL} introuvable")
+        return None
+    warmup(model)
+    cascade = Cascade(version_of(CASCADE_MODEL), model, threshold, count_gflops(model))
+    print(f"✅ Cascade : {cascade.version} répond au-dessus de {threshold:.3f} de confiance ({cascade.gflops} GFLOPs)")
+    return cascade
+
+
+def serving_model(version, model, backend) -> LoadedModel:
+    """ Version prête à servir : coût par image mesuré, cascade attachée si activée """
+    return LoadedModel(version, model, backend, cascade=get_cascade(), gflops=count_gflops(model))
+
+
+def load_version(version: str) -> LoadedModel:
+    """ Charge une version précise ; lève ModelNotFoundError si elle est inutilisable """
+    if not MODEL_FILE_PATTERN.match(version + ".pt"):
+        raise ModelNotFoundError(f"Nom de version invalide : {version}")
+    model, backend = load_inference_model(version + ".pt")
+    if isinstance(model, DummyModel):
+        raise ModelNotFoundError(f"Version de modèle introuvable ou illisible : {version}")
+    return serving_model(version, model, backend)
+
+
+def warmup(model):
+    """ Quelques inférences à vide pour initialiser les noyaux et l'allocateur """
+    with torch.no_grad():
+        for batch_size in WARMUP_BATCH_SIZES:
+            model(torch.zeros(batch_size, 3, 224, 224))
+
+
+def load_initial_model() -> LoadedModel:
+    """ Modèle servi au démarrage (MODEL_FILENAME), DummyModel s'il est introuvable """
+    model, backend = load_inference_model()
+    if isinstance(model, DummyModel):
+        return LoadedModel("dummy", model, "dummy")
+    return serving_model(version_of(MODEL_FILENAME), model, backend)
+
+
+# Le modèle n'est plus chargé à l'import : l'API le charge et le chauffe en arrière-plan
+# au démarrage (voir /ready), les scripts et workers d'inférence à la première prédiction.
+registry = ModelRegistry(
+    load_fn=load_version,
+    list_fn=list_model_versions,
+    sort_key=version_timestamp,
+    warmup_fn=warmup,
+    max_loaded=MODELS_KEPT_LOADED,
+    initial_fn=load_initial_model,
+)
+
+
+def warm_start() -> str:
+    """ Charge et chauffe le modèle servi s'il ne l'est pas encore ; renvoie sa clé """
+    return registry.ensure_active().key
+
+
+def activate_version(version: str) -> str:
+    """
+    Processus d'inférence : charge, chauffe et active `version` (diffusée par le process web avant
+    sa propre bascule, voir ExecutionPools.broadcast) ; renvoie sa clé.
+    """
+    loaded = registry.get(version)
+    if registry.active is not loaded:
+        registry.set_active(loaded)
+        print(f"🔄 Processus d'inférence : modèle actif {loaded.version} ({loaded.backend})")
+    return loaded.key
+
+
+def get_model_version() -> str:
+    """ Identifiant (version + backend) du modèle actif, clé du cache des prédictions """
+    return registry.get().key
+
 
 # ---------------------------
 # Préprocessing pour prédiction
 # ---------------------------
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225])
-])
+@lru_cache(maxsize=1)
+def get_transform():
+    """ Transforms torchvision historiques (import de torchvision différé à la première utilisation) """
+    from torchvision import transforms
+
+    return transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
 
 # ---------------------------
-# Fonction de prédiction
+# Fonctions de prédiction
 # ---------------------------
-def predict(image: Image.Image):
+def preprocess(image: Image.Image) -> torch.Tensor:
     """
-    Prend une image PIL, renvoie (label, confiance)
+    Prend une image PIL, renvoie le tenseur normalisé (3, 224, 224)
     """
-    tensor = transform(image).unsqueeze(0)
+    return get_transform()(image)
 
+
+def decode_image(image_bytes: bytes) -> torch.Tensor:
+    """
+    Décode les bytes d'une image et renvoie le tenseur prêt pour le modèle
+    (décodage JPEG réduit + normalisation fusionnée, voir decode.py)
+    """
+    return decode_to_tensor(image_bytes)
+
+
+def predict_batch(batch: torch.Tensor, version=None):
+    """
+    Prend un batch de tenseurs (N, 3, 224, 224), renvoie une liste de (label, confiance)
+    """
+    with torch.no_grad():
+        outputs = registry.get(version).model(batch)
+        probs = torch.nn.functional.softmax(outputs, dim=1)
+        confidences, pred_idx = probs.max(dim=1)
+
+    return [(CLASSES[idx], conf) for idx, conf in zip(pred_idx.tolist(), confidences.tolist())]
+
+
+def predict_topk(batch: torch.Tensor, k: int = 3, version=None):
+    """
+    Prend un batch de tenseurs (N, 3, 224, 224), renvoie pour chaque image
+    la liste des k meilleures classes [(label, confiance), ...]
+    (modèle actif, ou `version` épinglée)
+    """
+    k = max(1, min(k, len(CLASSES)))
     with torch.no_grad():
-        outputs = model(tensor)
-        probs = torch.nn.functional.softmax(outputs[0], dim=0)
-        pred_idx = probs.argmax().item()
-        confidence = probs[pred_idx].item()
+        outputs = registry.get(version).model(batch)
+        probs = torch.nn.functional.softmax(outputs, dim=1)
+        confidences, indices = probs.topk(k, dim=1)
+
+    return [
+        [(CLASSES[idx], conf) for idx, conf in zip(row_idx, row_conf)]
+        for row_idx, row_conf in zip(indices.tolist(), confidences.tolist())
+    ]
+
+
+def rank_classes(batch: torch.Tensor, version=None):
+    """
+    Classement complet des classes pour chaque image du batch
+    (même résultat mis en cache pour le top-1 de /predict et le top-k de /predict/batch).
+    Chaque classement (Ranking) indique l'étape qui a répondu et le coût de l'image :
+    en mode cascade, le petit modèle d'abord, le modèle servi seulement sous le seuil.
+    """
+    loaded = registry.get(version)
+    if loaded.cascade is not None:
+        probs, stages, costs, gflops = loaded.cascade.run(batch, loaded.model, loaded.gflops)
+    else:
+        probs, seconds = timed_probabilities(loaded.model, batch)
+        stages, costs, gflops = ["full"] * len(batch), [seconds / len(batch)] * len(batch), [loaded.gflops] * len(batch)
+    confidences, indices = probs.sort(dim=1, descending=True)
+    return [
+        Ranking([(CLASSES[idx], conf) for idx, conf in zip(row_idx, row_conf)], stage, cost, flops)
+        for row_idx, row_conf, stage, cost, flops in zip(indices.tolist(), confidences.tolist(), stages, costs, gflops)
+    ]
+
 
-    return CLASSES[pred_idx], confidence
+def predict(image: Image.Image):
+    """
+    Prend une image PIL, renvoie (label, confiance)
+    """
+    return predict_batch(preprocess(image).unsqueeze(0))[0]
@@ -0,0 +1,135 @@
+"""
+Profilage à la demande de l'API en charge (endpoint POST /debug/profile, PROFILING_ENABLED=1).
+
+Trois modes, tous sur N secondes pendant que l'API continue de servir :
+    sample : échantillonneur de piles intégré (sys._current_frames) sur tous les threads — boucle asyncio,
+             pools de décodage et d'inférence — au format « collapsed » (flamegraph.pl, speedscope)
+    py-spy : `py-spy record` sur le process (binaire py-spy installé, capability SYS_PTRACE), format speedscope
+    torch  : torch.profiler sur les opérateurs exécutés par tous les threads, trace Chrome (chrome://tracing, Perfetto)
+
+cProfile n'est pas proposé : il ne voit que le thread qui l'active, alors que le travail tourne dans les pools.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "fish_profiles"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+PROFILE_MODES = {
+    "sample": ("txt", "text/plain"),
+    "py-spy": ("speedscope.json", "application/json"),
+    "torch": ("trace.json", "application/json"),
+}
+
+
+class ProfilerBusyError(Exception):
+    """ Un profilage est déjà en cours (HTTP 409) """
+
+
+class ProfilerUnavailableError(Exception):
+    """ Mode de profilage inutilisable ici (py-spy absent, ptrace refusé...) """
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval_s=0.005):
+    """ Piles de tous les threads (sauf celui-ci) toutes les `interval_s` secondes → texte « collapsed » """
+    names = {}
+    counts = Counter()
+    me = threading.get_ident()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if len(names) != threading.active_count():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval_s)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def pyspy_record(seconds, output):
+    executable = shutil.which("py-spy")
+    if executable is None:
+        raise ProfilerUnavailableError("py-spy n'est pas installé dans l'image")
+    command = [executable, "record", "--pid", str(os.getpid()), "--duration", str(max(int(seconds), 1)),
+               "--format", "speedscope", "--output", output, "--threads", "--nonblocking"]
+    completed = subprocess.run(command, capture_output=True, text=True, timeout=seconds + 30)
+    if completed.returncode != 0 or not os.path.exists(output):
+        raise ProfilerUnavailableError(f"py-spy a échoué : {completed.stderr.strip()[-500:]}")
+
+
+def torch_trace(seconds, output):
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    kwargs = {}
+    try:
+        # Sans cette option, seuls les opérateurs du thread courant (qui dort) seraient enregistrés
+        kwargs["experimental_config"] = torch._C._profiler._ExperimentalConfig(profile_all_threads=True)
+    except (AttributeError, TypeError):
+        print("⚠️ torch.profiler ne sait pas profiler tous les threads dans cette version de PyTorch")
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True, **kwargs) as prof:
+        time.sleep(seconds)
+    prof.export_chrome_trace(output)
+    print(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=15))
+
+
+# ---------------------------
+# Profilage à la demande
+# ---------------------------
+class Profiler:
+    """ Un seul profilage à la fois ; chaque résultat est gardé dans `profile_dir` """
+
+    def __init__(self, profile_dir=PROFILE_DIR, max_seconds=PROFILE_MAX_SECONDS,
+                 sample_interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.profile_dir = profile_dir
+        self.max_seconds = max_seconds
+        self.sample_interval_s = sample_interval_ms / 1000
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self):
+        return self._lock.locked()
+
+    def run(self, mode, seconds):
+        """ Bloquant (à lancer hors boucle asyncio) : renvoie (chemin du fichier, type MIME) """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Mode de profilage inconnu : {mode} ({', '.join(PROFILE_MODES)})")
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"Durée de profilage entre 0 et {self.max_seconds:.0f} s")
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("Un profilage est déjà en cours")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            extension, media_type = PROFILE_MODES[mode]
+            output = os.path.join(self.profile_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}_{mode}.{extension}")
+            print(f"🔬 Profilage '{mode}' pendant {seconds:g} s...")
+            if mode == "sample":
+                with open(output, "w") as f:
+                    f.write(sample_stacks(seconds, self.sample_interval_s))
+            elif mode == "py-spy":
+                pyspy_record(seconds, output)
+            else:
+                torch_trace(seconds, output)
+            print(f"✅ Profil enregistré : {output}")
+            return output, media_type
+        finally:
+            self._lock.release()
@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LoadedModel:
+    """ Une version de modèle chargée en mémoire, prête pour l'inférence """
+
+    def __init__(self, version, model, backend, cascade=None, gflops=None):
+        self.version = version
+        self.model = model
+        self.backend = backend
+        # Petit modèle répondant en premier (cascade.py), None = modèle complet seul
+        self.cascade = cascade
+        # Coût estimé d'une passe avant sur une image (None si non mesurable)
+        self.gflops = gflops
+        self.loaded_at = time.time()
+
+    @property
+    def key(self):
+        """ Identifiant complet du modèle servi (version + backend [+ cascade]), utilisé par le cache """
+        key = f"{self.version}+{self.backend}"
+        return f"{key}+{self.cascade.label}" if self.cascade is not None else key
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "backend": self.backend,
+            "gflops": self.gflops,
+            "cascade": self.cascade.describe() if self.cascade is not None else None,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+        }
+
+
+class ModelNotFoundError(LookupError):
+    """ Version de modèle demandée introuvable (ni chargée, ni dans le bucket) """
+
+
+# ---------------------------
+# Registre des versions de modèle
+# ---------------------------
+class ModelRegistry:
+    """
+    Garde en mémoire les dernières versions de modèle utilisées et la version active.
+
+    - `load_fn(version) -> LoadedModel` charge une version (lève une exception en cas d'échec),
+    - `list_fn() -> [versions]` liste les versions disponibles (bucket MinIO `models`),
+    - `sort_key(version)` ordonne les versions (la plus grande est la plus récente),
+    - `warmup_fn(model)` exécute quelques inférences avant la mise en service,
+    - `initial_fn() -> LoadedModel` charge la version servie au démarrage, à la première
+      utilisation (`ensure_active`, ou `get` tant qu'aucune version n'est active),
+    - `prepare_fn(loaded)` est appelé après le chauffage, juste avant l'activation
+      (ex: chauffer la version dans les processus d'inférence).
+
+    Une nouvelle version est chargée et chauffée en arrière-plan, puis la
+    version active est remplacée par une simple affectation : les requêtes
+    en cours gardent la version qu'elles ont résolue, aucune n'est perdue.
+    Une version épinglée est chargée et chauffée hors verrou : les requêtes
+    simultanées sur la même version attendent le même chargement, les autres
+    ne sont pas bloquées. Une version dont le chargement échoue n'est plus
+    proposée par `check_for_update` (voir `failed`).
+    """
+
+    def __init__(self, load_fn, list_fn, sort_key, warmup_fn=None, max_loaded=2, on_activate=None,
+                 initial_fn=None, prepare_fn=None):
+        self.load_fn = load_fn
+        self.initial_fn = initial_fn
+        self.list_fn = list_fn
+        self.sort_key = sort_key
+        self.warmup_fn = warmup_fn
+        self.max_loaded = max(max_loaded, 1)
+        self.on_activate = on_activate
+        self.prepare_fn = prepare_fn
+        self.active = None
+        self.available = []
+        self.last_poll = None
+        self.last_error = None
+        self.failed = {}  # version → erreur du dernier chargement (ignorée par check_for_update)
+        self._loaded = OrderedDict()  # version → LoadedModel (ordre LRU)
+        self._loading = {}  # version → Future du chargement en cours
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def loaded_versions(self):
+        with self._lock:
+            return list(self._loaded)
+
+    def set_active(self, loaded: LoadedModel):
+        """ Installe un modèle déjà chargé comme version active """
+        with self._lock:
+            self._remember(loaded)
+            self.active = loaded
+        if self.on_activate is not None:
+            self.on_activate(loaded)
+
+    def ensure_active(self) -> LoadedModel:
+        """ Charge, chauffe puis active la version initiale si aucune version n'est encore active """
+        if self.active is None and self.initial_fn is not None:
+            with self._lock:
+                if self.active is None:
+                    loaded = self.initial_fn()
+                    if self.warmup_fn is not None:
+                        self.warmup_fn(loaded.model)
+                    self.set_active(loaded)
+        return self.active
+
+    def get(self, version=None) -> LoadedModel:
+        """ Modèle actif, ou version épinglée (chargée à la demande si nécessaire) """
+        active = self.active or self.ensure_active()
+        if version is None or version == active.version:
+            return active
+        with self._lock:
+            loaded = self._loaded.get(version)
+            if loaded is not None:
+                self._loaded.move_to_end(version)
+                return loaded
+        return self._load(version)
+
+    def activate(self, version) -> LoadedModel:
+        """ Charge, chauffe puis active une version (le modèle précédent reste en cache) """
+        with self._lock:
+            loaded = self._loaded.get(version)
+        if loaded is None:
+            loaded = self._load(version)
+        if self.prepare_fn is not None:
+            self.prepare_fn(loaded)
+        self.set_active(loaded)
+        print(f"🔄 Modèle actif : {loaded.version} ({loaded.backend})")
+        return loaded
+
+    def check_for_update(self):
+        """ Interroge la source des modèles et active la version la plus récente si elle est nouvelle """
+        versions = sorted(self.list_fn(), key=self.sort_key)
+        self.available = versions
+        self.last_poll = time.time()
+        if not versions:
+            return None
+        candidates = [version for version in versions if version not in self.failed]
+        if not candidates:
+            return None
+        newest = candidates[-1]
+        active = self.active
+        if active is not None and self.sort_key(newest) <= self.sort_key(active.version):
+            return None
+        try:
+            return self.activate(newest)
+        except Exception as e:
+            # Version inutilisable (poids corrompus, incompatibles...) : pas de nouvel essai à chaque vérification
+            self.failed[newest] = str(e)
+            raise
+
+    def start_polling(self, interval):
+        """ Vérifie périodiquement la présence de nouvelles versions (thread de fond) """
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll_loop, args=(interval,), name="model-poller", daemon=True)
+        self._thread.start()
+
+    def stop_polling(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        active = self.active
+        return {
+            "active": active.describe() if active else None,
+            "loaded": self.loaded_versions(),
+            "available": self.available,
+            "last_poll": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.last_poll)) if self.last_poll else None,
+            "last_error": self.last_error,
+            "failed": dict(self.failed),
+        }
+
+    def _poll_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.check_for_update()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ Vérification des nouveaux modèles impossible : {e}")
+
+    def _load(self, version) -> LoadedModel:
+        """
+        Charge et chauffe une version hors verrou, puis la garde en mémoire ; un seul chargement
+        par version, partagé par les appels simultanés.
+        """
+        with self._lock:
+            pending = self._loading.get(version)
+            owner = pending is None
+            if owner:
+                pending = self._loading[version] = Future()
+        if not owner:
+            return pending.result()
+        try:
+            loaded = self.load_fn(version)
+            if self.warmup_fn is not None:
+                self.warmup_fn(loaded.model)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[version]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self._remember(loaded)
+            del self._loading[version]
+        pending.set_result(loaded)
+        return loaded
+
+    def _remember(self, loaded):
+        # Appelé sous verrou : garde au plus `max_loaded` versions, sans jamais évincer l'active
+        self._loaded[loaded.version] = loaded
+        self._loaded.move_to_end(loaded.version)
+        while len(self._loaded) > self.max_loaded:
+            oldest = next(iter(self._loaded))
+            if self.active is not None and oldest == self.active.version:
+                self._loaded.move_to_end(oldest)
+                oldest = next(iter(self._loaded))
+                if oldest == self.active.version:
+                    break
+            del self._loaded[oldest]
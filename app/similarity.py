@@ -0,0 +1,525 @@
+"""
+Recherche d'images similaires du dataset (endpoint /similar).
+
+    embeddings : entrée de la tête de classification du modèle servi (512-d pour ResNet18, 1280-d pour
+                 EfficientNet-B0... voir architectures.py), normalisée L2 ; dimension dans meta.json
+    index      : IVF (inverted file) sur disque et memory-mappé — centroïdes k-means en mémoire,
+                 vecteurs float16 regroupés par liste ; seules les `nprobe` listes les plus proches
+                 de la requête sont lues. Les ajouts récents vont dans un segment delta (parcouru
+                 en entier) et les suppressions sont des lignes masquées, jusqu'au compactage.
+
+Arborescence de l'index (EMBEDDING_INDEX_DIR) :
+    CURRENT          nom de la version servie (remplacé atomiquement)
+    v_<horodatage>/  meta.json, centroids.npy, offsets.npy, vectors.npy, keys.npy,
+                     delta_vectors.npy, delta_keys.npy, deleted.npy
+Une mise à jour écrit une nouvelle version (fichiers inchangés liés en dur, sans copie) :
+l'API bascule dessus sans jamais lire un index à moitié écrit.
+
+Exemples :
+    python similarity.py build                  # extraction complète + entraînement des centroïdes
+    python similarity.py update                 # n'extrait que les images ajoutées à fish_data
+    python similarity.py update --watch 300     # ... toutes les 5 minutes
+    python similarity.py info
+"""
+import argparse
+import copy
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+EMBEDDING_INDEX_DIR = os.getenv(
+    "EMBEDDING_INDEX_DIR", os.path.join(os.getenv("MODEL_DIR", os.getcwd()), "embeddings")
+)
+# Listes IVF parcourues par requête (compromis rappel / latence)
+SIMILAR_NPROBE = int(os.getenv("SIMILAR_NPROBE", "8"))
+SIMILAR_MAX_K = int(os.getenv("SIMILAR_MAX_K", "50"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Le segment delta est fusionné dans les listes IVF au-delà de cette fraction de l'index
+DELTA_COMPACT_RATIO = float(os.getenv("DELTA_COMPACT_RATIO", "0.1"))
+KEEP_VERSIONS = 2
+POINTER_NAME = "CURRENT"
+# URL publique du bucket des images (lien `url` des voisins renvoyés par /similar)
+DATASET_URL = os.getenv("DATASET_URL", "http://localhost:9000/dataset-fish/").rstrip("/") + "/"
+
+
+class IndexUnavailableError(RuntimeError):
+    """ Aucun index d'embeddings construit (python similarity.py build) """
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ---------------------------
+# Extraction des embeddings
+# ---------------------------
+def without_head(model, head_path):
+    """
+    Copie légère de `model` dont la tête (`head_path`, ex: "fc", "classifier.3") est remplacée par
+    Identity : mêmes paramètres (partagés, rien n'est recopié), sortie = entrée de la tête.
+    Le modèle servi n'est pas modifié.
+    """
+    root = copy.copy(model)
+    root._modules = dict(model._modules)
+    parent = root
+    *parents, name = head_path.split(".")
+    for part in parents:
+        child = copy.copy(parent._modules[part])
+        child._modules = dict(child._modules)
+        parent._modules[part] = child
+        parent = child
+    parent._modules[name] = nn.Identity()
+    return root
+
+
+class EmbeddingModel:
+    """ Modèle sans sa tête : batch (N, 3, 224, 224) → embeddings (N, dim) float32 normalisés """
+
+    def __init__(self, model, version, head_path="fc"):
+        # Dimension des embeddings : entrées de la couche Linear de tête
+        self.dim = model.get_submodule(head_path).in_features
+        self.features = without_head(model, head_path).eval()
+        self.version = version
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            embeddings = self.features(batch).flatten(1)
+            return nn.functional.normalize(embeddings, dim=1).numpy()
+
+
+def extract_embeddings(embedder, source, keys, decode_fn, batch_size=EMBEDDING_BATCH_SIZE, progress_every=5000,
+                       tmp_dir=None):
+    """
+    (clés, embeddings float16 (N, dim), nombre d'erreurs) pour les images de `source`.
+    Chaque batch est écrit directement dans un memmap alloué pour len(keys) lignes (fichier
+    temporaire anonyme dans `tmp_dir`) : les embeddings ne sont jamais copiés en mémoire.
+    """
+    from bulk import decoded_batches
+
+    keys = list(keys)
+    if not keys:
+        return [], np.empty((0, embedder.dim), dtype=np.float16), 0
+    if tmp_dir:
+        os.makedirs(tmp_dir, exist_ok=True)
+    with tempfile.TemporaryFile(dir=tmp_dir) as f:
+        # Le mapping garde le fichier (supprimé à la fermeture) tant que le tableau est référencé
+        vectors = np.memmap(f, dtype=np.float16, mode="w+", shape=(len(keys), embedder.dim))
+    out_keys, errors = [], 0
+    start = time.perf_counter()
+    next_report = progress_every
+    for keys_batch, batch, batch_errors in decoded_batches(source, keys, decode_fn, batch_size):
+        for key, error in batch_errors:
+            errors += 1
+            if errors <= 10:
+                print(f"⚠️  {key} ignorée : {error}", file=sys.stderr)
+        if batch is None:
+            continue
+        vectors[len(out_keys):len(out_keys) + len(keys_batch)] = embedder(batch)
+        out_keys.extend(keys_batch)
+        if len(out_keys) >= next_report:
+            next_report += progress_every
+            print(f"⏱️  {len(out_keys)} embeddings — {len(out_keys) / (time.perf_counter() - start):.1f} img/s",
+                  file=sys.stderr)
+    # Images en erreur : lignes en fin de memmap jamais écrites, écartées sans copie
+    return out_keys, vectors[:len(out_keys)], errors
+
+
+# ---------------------------
+# Construction de l'index IVF
+# ---------------------------
+def default_nlist(count):
+    """ ~√N listes : ~√N vecteurs par liste, le coût d'une requête croît en √N """
+    return max(1, min(int(math.sqrt(count)), count))
+
+
+def assign_lists(vectors, centroids, chunk=65536):
+    """ Liste (centroïde le plus proche en produit scalaire) de chaque vecteur """
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        assignment[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_per_list=64, seed=0):
+    """ k-means sphérique sur un échantillon (au plus `sample_per_list` vecteurs par liste) """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * sample_per_list)
+    sample = normalize(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        starts = np.cumsum(counts) - counts
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # Liste vide : réamorcée sur un vecteur tiré au hasard
+        sums[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def encode_keys(keys):
+    return np.array([key.encode("utf-8") for key in keys], dtype=bytes) if keys else np.empty(0, dtype="S1")
+
+
+def _ivf_arrays(vectors, keys, centroids):
+    """ Vecteurs et clés triés par liste + offsets (nlist + 1) """
+    assignment = assign_lists(vectors, centroids)
+    order = np.argsort(assignment, kind="stable")
+    counts = np.bincount(assignment, minlength=len(centroids))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return {
+        "vectors.npy": np.asarray(vectors, dtype=np.float16)[order],
+        "keys.npy": encode_keys([keys[i] for i in order]),
+        "offsets.npy": offsets,
+    }
+
+
+def _empty_delta(dim):
+    return {
+        "delta_vectors.npy": np.empty((0, dim), dtype=np.float16),
+        "delta_keys.npy": encode_keys([]),
+        "deleted.npy": np.empty(0, dtype=np.int64),
+    }
+
+
+def write_version(index_dir, arrays, meta, links=None):
+    """
+    Écrit une nouvelle version de l'index puis bascule CURRENT dessus (os.replace atomique).
+    `links` : fichiers inchangés de la version précédente, liés en dur plutôt que copiés.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    name = f"v_{time.time_ns()}"
+    tmp_dir = os.path.join(index_dir, name + ".part")
+    os.makedirs(tmp_dir)
+    for file_name, source in (links or {}).items():
+        try:
+            os.link(source, os.path.join(tmp_dir, file_name))
+        except OSError:
+            shutil.copyfile(source, os.path.join(tmp_dir, file_name))
+    for file_name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, file_name), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    os.rename(tmp_dir, os.path.join(index_dir, name))
+
+    pointer = os.path.join(index_dir, POINTER_NAME)
+    with open(pointer + ".part", "w") as f:
+        f.write(name)
+    os.replace(pointer + ".part", pointer)
+
+    # Les anciennes versions restent lisibles par les process qui les ont ouvertes (memmap)
+    versions = sorted(d for d in os.listdir(index_dir) if d.startswith("v_") and not d.endswith(".part"))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+    return os.path.join(index_dir, name)
+
+
+def build_index(index_dir, keys, vectors, model_version, nlist=None, split=None):
+    """ Index complet : entraînement des centroïdes puis répartition des vecteurs dans les listes """
+    if len(keys) == 0:
+        raise ValueError("Aucun embedding à indexer")
+    nlist = nlist or default_nlist(len(keys))
+    start = time.perf_counter()
+    centroids = train_centroids(vectors, nlist)
+    arrays = {"centroids.npy": centroids, **_ivf_arrays(vectors, keys, centroids), **_empty_delta(vectors.shape[1])}
+    meta = {
+        "model_version": model_version,
+        "split": split,
+        "dim": int(vectors.shape[1]),
+        "nlist": nlist,
+        "count": len(keys),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "build_s": round(time.perf_counter() - start, 2),
+    }
+    return write_version(index_dir, arrays, meta)
+
+
+def update_index(index, added_keys, added_vectors, removed_keys, compact_ratio=DELTA_COMPACT_RATIO):
+    """
+    Nouvelle version de `index` : les clés supprimées (ou ré-extraites) sont masquées,
+    les nouvelles ajoutées au segment delta. Au-delà de `compact_ratio`, delta et
+    suppressions sont fusionnés dans les listes IVF (mêmes centroïdes, sans ré-entraînement).
+    """
+    added_vectors = np.asarray(added_vectors, dtype=np.float16).reshape(len(added_keys), -1)
+    if len(added_keys) and added_vectors.shape[1] != index.dim:
+        raise ValueError(f"Embeddings de dimension {added_vectors.shape[1]}, l'index attend {index.dim} "
+                         f"(modèle {index.model_version}) : reconstruire l'index (python similarity.py build)")
+    replaced = set(removed_keys) | set(added_keys)
+    main_keys = index.key_list()
+    deleted = set(index.deleted.tolist())
+    deleted.update(row for row, key in enumerate(main_keys) if key in replaced)
+
+    delta_keys = [key for key in index.delta_key_list() if key not in replaced]
+    delta_rows = [row for row, key in enumerate(index.delta_key_list()) if key not in replaced]
+    delta_keys += list(added_keys)
+    delta_vectors = np.concatenate([
+        np.asarray(index.delta_vectors[delta_rows], dtype=np.float16),
+        added_vectors.reshape(-1, index.dim),
+    ])
+
+    meta = dict(index.meta, updated_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    alive_main = len(main_keys) - len(deleted)
+    if len(delta_keys) + len(deleted) > compact_ratio * max(alive_main, 1):
+        keep = np.setdiff1d(np.arange(len(main_keys)), np.fromiter(deleted, dtype=np.int64))
+        keys = [main_keys[row] for row in keep] + delta_keys
+        vectors = np.concatenate([np.asarray(index.vectors[keep]), delta_vectors])
+        meta.update(count=len(keys), compacted_at=meta["updated_at"])
+        arrays = {**_ivf_arrays(vectors, keys, index.centroids), **_empty_delta(index.dim)}
+        return write_version(index.index_dir, arrays, meta, links=index.files("centroids.npy"))
+
+    meta["count"] = alive_main + len(delta_keys)
+    arrays = {
+        "delta_vectors.npy": delta_vectors,
+        "delta_keys.npy": encode_keys(delta_keys),
+        "deleted.npy": np.array(sorted(deleted), dtype=np.int64),
+    }
+    links = index.files("centroids.npy", "offsets.npy", "vectors.npy", "keys.npy")
+    return write_version(index.index_dir, arrays, meta, links=links)
+
+
+# ---------------------------
+# Lecture et recherche
+# ---------------------------
+class IVFIndex:
+    """ Une version de l'index, vecteurs et clés memory-mappés (seules les listes sondées sont lues) """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_dir = os.path.dirname(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.delta_vectors = np.load(os.path.join(path, "delta_vectors.npy"))
+        self.delta_keys = np.load(os.path.join(path, "delta_keys.npy"))
+        self.deleted = np.load(os.path.join(path, "deleted.npy"))
+        self.alive = None
+        if len(self.deleted):
+            self.alive = np.ones(len(self.keys), dtype=bool)
+            self.alive[self.deleted] = False
+
+    @property
+    def model_version(self):
+        return self.meta["model_version"]
+
+    @property
+    def dim(self):
+        """ Dimension des embeddings (meta.json ; centroïdes pour les index antérieurs) """
+        return int(self.meta.get("dim") or self.centroids.shape[1])
+
+    def __len__(self):
+        return len(self.keys) - len(self.deleted) + len(self.delta_keys)
+
+    def files(self, *names):
+        return {name: os.path.join(self.path, name) for name in names}
+
+    def key_list(self):
+        return [key.decode("utf-8") for key in self.keys]
+
+    def delta_key_list(self):
+        return [key.decode("utf-8") for key in self.delta_keys]
+
+    def all_keys(self):
+        """ Clés indexées (hors lignes supprimées) """
+        main = self.key_list()
+        if self.alive is not None:
+            main = [key for key, alive in zip(main, self.alive) if alive]
+        return set(main) | set(self.delta_key_list())
+
+    def search(self, query, k=10, nprobe=SIMILAR_NPROBE):
+        """ [(clé, similarité cosinus)] des k plus proches voisins de `query` (dim,) """
+        query = normalize(query).ravel()
+        nprobe = max(1, min(nprobe, len(self.centroids)))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+        ranges = [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in lists]
+        ranges = [(start, end) for start, end in ranges if end > start]
+        if ranges:
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            candidates = np.concatenate([self.vectors[start:end] for start, end in ranges])
+            # Conversion float16 → float32 vectorisée par torch (celle de numpy n'est pas SIMD)
+            scores = (torch.from_numpy(candidates).float() @ torch.from_numpy(query)).numpy()
+        else:
+            rows, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self.alive is not None:
+            keep = self.alive[rows]
+            rows, scores = rows[keep], scores[keep]
+        if len(self.delta_keys):
+            # Lignes du delta numérotées après celles des listes
+            rows = np.concatenate([rows, len(self.keys) + np.arange(len(self.delta_keys))])
+            delta_scores = torch.from_numpy(self.delta_vectors).float() @ torch.from_numpy(query)
+            scores = np.concatenate([scores, delta_scores.numpy()])
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for row, score in zip(rows[top].tolist(), scores[top].tolist()):
+            key = self.keys[row] if row < len(self.keys) else self.delta_keys[row - len(self.keys)]
+            results.append((key.decode("utf-8"), score))
+        return results
+
+
+def current_version_path(index_dir=EMBEDDING_INDEX_DIR):
+    try:
+        with open(os.path.join(index_dir, POINTER_NAME)) as f:
+            return os.path.join(index_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def load_index(index_dir=EMBEDDING_INDEX_DIR):
+    path = current_version_path(index_dir)
+    return IVFIndex(path) if path else None
+
+
+def describe_key(key):
+    """ "train/Catfish/img_001.jpg" → split, label et URL de l'image """
+    parts = key.split("/")
+    return {
+        "key": key,
+        "split": parts[0] if len(parts) >= 3 else None,
+        "label": parts[-2] if len(parts) >= 2 else None,
+        "url": DATASET_URL + key,
+    }
+
+
+class SimilaritySearch:
+    """
+    Index servi par l'API et modèle d'embedding de la même version de modèle.
+    La version courante (fichier CURRENT) est vérifiée à chaque appel : un
+    `update` est pris en compte sans redémarrage.
+    """
+
+    def __init__(self, load_embedder, index_dir=EMBEDDING_INDEX_DIR):
+        self.load_embedder = load_embedder
+        self.index_dir = index_dir
+        self.index = None
+        self.embedder = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """ (index, embedder) à jour ; lève IndexUnavailableError si aucun index n'existe """
+        path = current_version_path(self.index_dir)
+        if path is None:
+            raise IndexUnavailableError(
+                f"Aucun index d'embeddings dans {self.index_dir} (lancer `python similarity.py build`)"
+            )
+        with self._lock:
+            if self.index is None or self.index.path != path:
+                index = IVFIndex(path)
+                if self.embedder is None or self.embedder.version != index.model_version:
+                    self.embedder = self.load_embedder(index.model_version)
+                self.index = index
+                print(f"✅ Index d'embeddings chargé : {len(index)} images ({os.path.basename(path)})")
+            return self.index, self.embedder
+
+    def status(self):
+        if self.index is None:
+            return {"loaded": False, "index_dir": self.index_dir}
+        return {"loaded": True, "images": len(self.index), "delta": len(self.index.delta_keys),
+                **self.index.meta}
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+def load_embedder(version):
+    """
+    Modèle eager fp32 d'une version (même poids que ceux qui ont servi à construire l'index),
+    embeddings pris à l'entrée de la tête de son architecture
+    """
+    from architectures import ARCHITECTURES
+    from model import DummyModel, fetch_model_file, load_model, model_architecture
+
+    filename = version + ".pt"
+    model = load_model(filename)
+    if isinstance(model, DummyModel):
+        raise IndexUnavailableError(f"Poids du modèle {version} introuvables : embeddings impossibles")
+    return EmbeddingModel(model, version, ARCHITECTURES[model_architecture(filename, fetch_model_file(filename))])
+
+
+def main():
+    p = argparse.ArgumentParser(description="Index d'embeddings des images de fish_data (recherche /similar)")
+    p.add_argument("command", choices=["build", "update", "info"])
+    p.add_argument("--index-dir", default=EMBEDDING_INDEX_DIR)
+    p.add_argument("--split", default=None, help="Limiter à un split de fish_data (défaut : tous)")
+    p.add_argument("--model-version", default=None, help="Version du modèle (défaut : modèle actif de l'API)")
+    p.add_argument("--nlist", type=int, default=None, help="Nombre de listes IVF (défaut : √N)")
+    p.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    p.add_argument("--mysql-host", default=os.getenv("MYSQL_HOST", "mysql"))
+    p.add_argument("--watch", type=float, default=0, help="update : relancer toutes les N secondes")
+    args = p.parse_args()
+
+    if args.command == "info":
+        index = load_index(args.index_dir)
+        print(json.dumps({"images": len(index), "delta": len(index.delta_keys), **index.meta}, indent=2)
+              if index else f"Aucun index dans {args.index_dir}")
+        return
+
+    from bulk import DATASET_BUCKET, MinioSource, keys_from_split
+    from model import decode_image, get_minio_client, get_model_version
+
+    mysql_config = dict(host=args.mysql_host, user="root", password="root", database="mlops")
+    source = MinioSource(get_minio_client(), DATASET_BUCKET)
+
+    if args.command == "build":
+        version = args.model_version or get_model_version().split("+")[0]
+        embedder = load_embedder(version)
+        start = time.perf_counter()
+        keys, vectors, errors = extract_embeddings(
+            embedder, source, keys_from_split(args.split, mysql_config), decode_image, args.batch_size,
+            tmp_dir=args.index_dir,
+        )
+        extract_s = time.perf_counter() - start
+        path = build_index(args.index_dir, keys, vectors, version, args.nlist, args.split)
+        print(f"✅ Index construit : {len(keys)} images ({errors} erreurs), extraction {extract_s:.1f}s "
+              f"({len(keys) / max(extract_s, 1e-6):.1f} img/s) → {path}")
+        return
+
+    embedder = None
+    while True:
+        index = load_index(args.index_dir)
+        if index is None:
+            raise SystemExit(f"❌ Aucun index dans {args.index_dir} : lancer d'abord `python similarity.py build`")
+        if embedder is None or embedder.version != index.model_version:
+            embedder = load_embedder(index.model_version)
+        indexed = index.all_keys()
+        # Même périmètre que le build (split enregistré dans meta.json)
+        split = args.split or index.meta.get("split")
+        wanted = set(keys_from_split(split, mysql_config))
+        added = sorted(wanted - indexed)
+        removed = sorted(indexed - wanted)
+        if added or removed:
+            keys, vectors, errors = extract_embeddings(embedder, source, added, decode_image, args.batch_size,
+                                                       tmp_dir=args.index_dir)
+            path = update_index(index, keys, vectors, removed)
+            print(f"✅ Index mis à jour : +{len(keys)} / -{len(removed)} images ({errors} erreurs) → {path}")
+        else:
+            print("♻️  Index à jour")
+        if not args.watch:
+            return
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Entrée / sortie binaires de POST /predict/tensor, pour les services amont qui ont déjà des images
+décodées et redimensionnées : pixels uint8 bruts au lieu d'un JPEG en multipart, ni PIL ni décodage.
+
+Requête : corps = pixels uint8 contigus, forme dans l'en-tête `X-Tensor-Shape`
+(`224,224,3` ou `N,224,224,3` en NHWC ; `3,224,224` ou `N,3,224,224` avec `X-Tensor-Layout: nchw`).
+Les octets reçus sont vus comme un tenseur (torch.frombuffer) puis normalisés en une seule copie.
+
+Réponse selon l'en-tête `Accept` :
+- `application/octet-stream` (défaut) : probabilités float32 little-endian (N, classes), classes dans
+  l'ordre de `X-Classes`, forme dans `X-Tensor-Shape`, étape de chaque image dans `X-Stages`
+- `application/msgpack` : {model_version, classes, shape, probabilities (float32 en bin), stages}
+  (paquet `msgpack`, optionnel)
+- `application/json` : prédiction, confiance (%) et étape de chaque image
+"""
+import numpy as np
+import torch
+
+from decode import INPUT_SIZE, normalize_pixels
+
+LAYOUTS = ("nhwc", "nchw")
+BINARY_TYPE = "application/octet-stream"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+JSON_TYPE = "application/json"
+
+
+class TensorFormatError(ValueError):
+    """ En-têtes ou corps de requête incompatibles avec un tenseur uint8 d'images 224x224 RGB """
+
+
+class UnsupportedFormatError(ValueError):
+    """ Format de réponse demandé indisponible (msgpack non installé) """
+
+
+def parse_shape(header: str, layout: str = "nhwc"):
+    """ `X-Tensor-Shape` → (N, H, W, C) en NHWC ou (N, C, H, W) en NCHW ; N = 1 si absent """
+    layout = layout.lower()
+    if layout not in LAYOUTS:
+        raise TensorFormatError(f"X-Tensor-Layout inconnu : {layout} (attendu : {', '.join(LAYOUTS)})")
+    try:
+        shape = tuple(int(dim) for dim in header.split(","))
+    except ValueError:
+        raise TensorFormatError(f"X-Tensor-Shape illisible : {header!r} (ex: 8,224,224,3)")
+    if len(shape) == 3:
+        shape = (1,) + shape
+    expected = (INPUT_SIZE[1], INPUT_SIZE[0], 3) if layout == "nhwc" else (3, INPUT_SIZE[1], INPUT_SIZE[0])
+    if len(shape) != 4 or shape[0] < 1 or shape[1:] != expected:
+        raise TensorFormatError(
+            f"Forme {header!r} refusée : attendu N,{','.join(map(str, expected))} ({layout}, uint8, déjà redimensionné)"
+        )
+    return shape
+
+
+def expected_bytes(shape) -> int:
+    return int(np.prod(shape))
+
+
+def pixels_to_tensor(body: bytearray, shape, layout: str = "nhwc") -> torch.Tensor:
+    """ Corps uint8 → batch normalisé (N, 3, 224, 224) float32 ; `body` est lu sans copie """
+    if len(body) != expected_bytes(shape):
+        raise TensorFormatError(f"Corps de {len(body)} octets, {expected_bytes(shape)} attendus pour la forme {shape}")
+    # bytearray (modifiable) : torch.frombuffer partage la mémoire sans avertissement ni copie
+    pixels = torch.frombuffer(body, dtype=torch.uint8).view(shape)
+    if layout.lower() == "nhwc":
+        pixels = pixels.permute(0, 3, 1, 2)
+    return normalize_pixels(pixels)
+
+
+def probabilities(rankings, classes):
+    """ Classements [(label, confiance), ...] → matrice (N, classes) float32 dans l'ordre de `classes` """
+    index = {label: i for i, label in enumerate(classes)}
+    probs = np.zeros((len(rankings), len(classes)), dtype="<f4")
+    for row, ranked in enumerate(rankings):
+        for label, confidence in ranked:
+            probs[row, index[label]] = confidence
+    return probs
+
+
+def response_type(accept: str) -> str:
+    """ Format de réponse d'après `Accept` : binaire par défaut """
+    accept = (accept or "").lower()
+    if any(media in accept for media in MSGPACK_TYPES):
+        return MSGPACK_TYPES[0]
+    if JSON_TYPE in accept:
+        return JSON_TYPE
+    return BINARY_TYPE
+
+
+def encode_response(media_type, rankings, stages, classes, model_version):
+    """ Corps et en-têtes de la réponse → (contenu, en-têtes) ; contenu bytes ou dict JSON """
+    if media_type == JSON_TYPE:
+        return {
+            "count": len(rankings),
+            "model_version": model_version,
+            "results": [
+                {"prediction": ranked[0][0], "confidence": round(ranked[0][1] * 100, 2), "stage": stage}
+                for ranked, stage in zip(rankings, stages)
+            ],
+        }, {}
+    probs = probabilities(rankings, classes)
+    if media_type in MSGPACK_TYPES:
+        try:
+            import msgpack
+        except ImportError:
+            raise UnsupportedFormatError("Réponse msgpack indisponible : paquet msgpack non installé")
+        return msgpack.packb({
+            "model_version": model_version,
+            "classes": list(classes),
+            "shape": list(probs.shape),
+            "probabilities": probs.tobytes(),
+            "stages": stages,
+        }, use_bin_type=True), {}
+    return probs.tobytes(), {
+        "X-Tensor-Shape": ",".join(map(str, probs.shape)),
+        "X-Tensor-Dtype": "float32",
+        "X-Classes": ",".join(classes),
+        "X-Stages": ",".join(stages),
+        "X-Model-Version": model_version,
+    }
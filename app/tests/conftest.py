@@ -0,0 +1,12 @@
+"""
+Tests unitaires de l'API (lancés par la CI avec `pytest` depuis ./app) : sans MinIO, MySQL ni modèle.
+Les modules de l'API (app/) et les scripts racine (calibration, index d'images, ingestion) sont importables.
+"""
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(APP_DIR)
+for path in (APP_DIR, ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,104 @@
+import asyncio
+
+import torch
+
+from batching import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class RecordingInfer:
+    """ infer_fn qui note chaque batch reçu (taille, groupe) et renvoie la somme de chaque image """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, batch, group):
+        self.calls.append((batch.shape[0], group))
+        return [float(image.sum()) for image in batch]
+
+
+def test_concurrent_requests_share_one_batch():
+    infer = RecordingInfer()
+
+    async def scenario():
+        batcher = MicroBatcher(infer, max_batch_size=8, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(torch.full((3, 2, 2), float(i))) for i in range(5)))
+        finally:
+            await batcher.stop()
+
+    results = run(scenario())
+    assert results == [12.0 * i for i in range(5)]  # chaque requête reçoit son propre résultat
+    assert infer.calls == [(5, None)]
+
+
+def test_batch_is_capped_at_max_batch_size():
+    infer = RecordingInfer()
+
+    async def scenario():
+        batcher = MicroBatcher(infer, max_batch_size=2, max_wait_ms=50)
+        batcher.start()
+        try:
+            await asyncio.gather(*(batcher.submit(torch.zeros(3, 2, 2)) for _ in range(5)))
+        finally:
+            await batcher.stop()
+
+    run(scenario())
+    assert sorted(size for size, _ in infer.calls) == [1, 2, 2]
+
+
+def test_groups_are_never_mixed_and_deferred_requests_are_served():
+    infer = RecordingInfer()
+
+    async def scenario():
+        batcher = MicroBatcher(infer, max_batch_size=8, max_wait_ms=50)
+        batcher.start()
+        try:
+            groups = ["v1", "v2", "v1", "v2", "v1"]
+            return await asyncio.gather(*(
+                batcher.submit(torch.full((3, 2, 2), float(i)), group=group) for i, group in enumerate(groups)
+            ))
+        finally:
+            await batcher.stop()
+
+    results = run(scenario())
+    assert results == [12.0 * i for i in range(5)]
+    # Les requêtes v2 mises de côté pendant le batch v1 forment le batch suivant
+    assert infer.calls == [(3, "v1"), (2, "v2")]
+
+
+def test_inference_error_fails_every_request_of_the_batch():
+    def failing(batch, group):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        batcher = MicroBatcher(failing, max_batch_size=4, max_wait_ms=20)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(torch.zeros(3, 2, 2)) for _ in range(3)),
+                                        return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_timings_record_queue_wait_and_inference():
+    async def scenario():
+        batcher = MicroBatcher(RecordingInfer(), max_batch_size=1, max_wait_ms=0)
+        batcher.start()
+        timings = {}
+        try:
+            await batcher.submit(torch.zeros(3, 2, 2), timings=timings)
+        finally:
+            await batcher.stop()
+        return timings
+
+    timings = run(scenario())
+    assert set(timings) == {"batch_wait", "inference"}
+    assert timings["batch_wait"][1] <= timings["inference"][0] <= timings["inference"][1]
@@ -0,0 +1,91 @@
+from cache import PredictionCache, content_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DictBackend:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+def test_content_key_depends_on_bytes_and_model_version():
+    assert content_key(b"a", "v1") == content_key(b"a", "v1")
+    assert content_key(b"a", "v1") != content_key(b"b", "v1")
+    assert content_key(b"a", "v1") != content_key(b"a", "v2")
+
+
+def test_miss_then_hit():
+    cache = PredictionCache(max_entries=4)
+    key, value = cache.get(b"image", "v1")
+    assert value is None
+    cache.set(key, "v1", {"prediction": "Gold Fish"})
+    assert cache.get(b"image", "v1") == (key, {"prediction": "Gold Fish"})
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PredictionCache(max_entries=2)
+    for name in (b"a", b"b"):
+        key, _ = cache.get(name, "v1")
+        cache.set(key, "v1", name.decode())
+    cache.get(b"a", "v1")  # "a" redevient la plus récente
+    key, _ = cache.get(b"c", "v1")
+    cache.set(key, "v1", "c")
+    assert len(cache) == 2
+    assert cache.get(b"a", "v1")[1] == "a"
+    assert cache.get(b"b", "v1")[1] is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("cache.time.monotonic", clock)
+    cache = PredictionCache(max_entries=4, ttl_seconds=10)
+    key, _ = cache.get(b"image", "v1")
+    cache.set(key, "v1", "x")
+    clock.now += 10
+    assert cache.get(b"image", "v1")[1] == "x"
+    clock.now += 1
+    assert cache.get(b"image", "v1")[1] is None
+    assert len(cache) == 0
+
+
+def test_model_change_purges_other_versions():
+    cache = PredictionCache(max_entries=8)
+    cache.set_model_version("v1")
+    for name in (b"a", b"b"):
+        key, _ = cache.get(name, "v1")
+        cache.set(key, "v1", "old")
+    key, _ = cache.get(b"a", "v2")
+    cache.set(key, "v2", "new")
+    cache.set_model_version("v2")
+    assert len(cache) == 1
+    assert cache.get(b"a", "v2")[1] == "new"
+
+
+def test_shared_backend_fills_local_cache_on_local_miss():
+    shared = DictBackend()
+    cache = PredictionCache(max_entries=4, shared=shared)
+    key, _ = cache.get(b"image", "v1")
+    shared.set(key, "from-redis")
+    assert cache.get(b"image", "v1") == (key, "from-redis")
+    shared.values.clear()
+    assert cache.get(b"image", "v1")[1] == "from-redis"  # servi localement ensuite
+
+
+def test_disabled_cache_keeps_nothing():
+    cache = PredictionCache(max_entries=0)
+    assert not cache.enabled
+    key, _ = cache.get(b"image", "v1")
+    cache.set(key, "v1", "x")
+    assert len(cache) == 0
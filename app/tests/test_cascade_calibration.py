@@ -0,0 +1,64 @@
+import pytest
+import torch
+
+from cascade_calibration import calibration_split, reference_held_out, tune_threshold
+
+
+def test_lowest_threshold_reaching_target():
+    confidences = torch.tensor([0.95, 0.9, 0.6, 0.4])
+    fast_correct = torch.tensor([True, True, False, False])
+    full_correct = torch.tensor([True, True, True, True])
+    result = tune_threshold(confidences, fast_correct, full_correct, target_accuracy=100.0)
+    # Les deux images confiantes restent au petit modèle, les deux autres sont escaladées
+    assert result["threshold"] == pytest.approx(0.9)
+    assert result["escalation_rate"] == 0.5
+    assert result["accuracy"] == 100.0
+    assert result["reached"]
+    assert result["fast_accuracy"] == 50.0 and result["full_accuracy"] == 100.0
+
+
+def test_tied_confidences_are_not_split():
+    confidences = torch.tensor([0.9, 0.8, 0.8])
+    fast_correct = torch.tensor([True, True, False])
+    full_correct = torch.tensor([True, True, True])
+    result = tune_threshold(confidences, fast_correct, full_correct, target_accuracy=100.0)
+    # Un seuil ne peut pas garder une seule des deux images à 0.8
+    assert result["threshold"] == pytest.approx(0.9)
+    assert result["escalation_rate"] == pytest.approx(2 / 3)
+
+
+def test_unreachable_target_escalates_everything():
+    confidences = torch.tensor([0.9, 0.5])
+    fast_correct = torch.tensor([False, False])
+    full_correct = torch.tensor([True, False])
+    result = tune_threshold(confidences, fast_correct, full_correct, target_accuracy=90.0)
+    assert not result["reached"]
+    assert result["threshold"] > 1.0
+    assert result["escalation_rate"] == 1.0
+    assert result["accuracy"] == 50.0
+
+
+def test_empty_validation_is_refused():
+    empty = torch.empty(0)
+    with pytest.raises(ValueError):
+        tune_threshold(empty, empty.bool(), empty.bool(), target_accuracy=90.0)
+
+
+def test_calibration_split_is_stable_and_nested():
+    files = [f"Catfish/{i}.jpg" for i in range(500)]
+    calibration, rest = calibration_split(files, 10)
+    assert sorted(calibration + rest) == list(range(500))
+    assert 20 < len(calibration) < 80
+    # Même split quel que soit l'ordre ou le contenu du reste du dataset
+    assert [files[i] for i in calibration] == [files[i] for i in calibration_split(files + ["Mullet/x.jpg"], 10)[0]]
+    # Le split à 5 % est inclus dans celui à 10 %
+    assert set(calibration_split(files, 5)[0]) <= set(calibration)
+    assert calibration_split(files, 0) == ([], list(range(500)))
+
+
+def test_reference_held_out_requires_a_covering_split():
+    assert reference_held_out({"split": {"calibration": "crc32", "calibration_percent": 10}}, 10)
+    assert reference_held_out({"split": {"calibration": "crc32", "calibration_percent": 20}}, 10)
+    assert not reference_held_out({"split": {"calibration": "crc32", "calibration_percent": 5}}, 10)
+    assert not reference_held_out({}, 10)
+    assert not reference_held_out({"split": {"calibration": "crc32", "calibration_percent": 10}}, 0)
@@ -0,0 +1,49 @@
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pymysql")  # image_index importe extraction_creation_sql (pymysql, minio)
+from image_index import find_duplicates, near_duplicate_pairs  # noqa: E402
+
+
+def brute_force_pairs(hashes, max_distance):
+    return {
+        (i, j) for i, j in itertools.combinations(range(len(hashes)), 2)
+        if bin(hashes[i] ^ hashes[j]).count("1") <= max_distance
+    }
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 8])
+def test_near_duplicate_pairs_matches_brute_force(max_distance):
+    rng = np.random.default_rng(max_distance)
+    base = [int(value) for value in rng.integers(0, 2**63, 40, dtype=np.int64)]
+    # Variantes à 1..10 bits de distance des hachages de base
+    hashes = list(base)
+    for value in base[:20]:
+        flips = rng.choice(64, size=int(rng.integers(1, 11)), replace=False)
+        hashes.append(value ^ sum(1 << int(bit) for bit in flips))
+    assert near_duplicate_pairs(hashes, max_distance, block=7) == brute_force_pairs(hashes, max_distance)
+
+
+def row(index, sha, phash, dhash, split="train"):
+    return (index, split, "Gold Fish", f"{index}.jpg", sha, phash, dhash)
+
+
+def test_find_duplicates_groups_exact_and_near_copies():
+    rows = [
+        row(1, "sha-a", 0b1111, 0),
+        row(2, "sha-a", 0xFFFF0000, 0xFF),          # même contenu : doublon exact
+        row(3, "sha-b", 0b1110, 0b1),               # pHash et dHash proches de 1
+        row(4, "sha-c", 0b1110, 0xFFFFFFFF),        # pHash proche mais dHash trop loin
+        row(5, "sha-d", 0xFFFFFFFFFFFF0000, 0),     # sans rapport
+    ]
+    groups, near_pairs = find_duplicates(rows, phash_max_distance=2, dhash_max_distance=4)
+    assert sorted(map(sorted, groups)) == [[0, 1, 2]]
+    assert near_pairs == 1
+
+
+def test_find_duplicates_identical_phash_confirmed_by_dhash():
+    rows = [row(1, "a", 42, 0), row(2, "b", 42, 0b11), row(3, "c", 42, 0xFFFF)]
+    groups, _ = find_duplicates(rows, phash_max_distance=0, dhash_max_distance=2)
+    assert sorted(map(sorted, groups)) == [[0, 1]]
@@ -0,0 +1,87 @@
+import pytest
+
+pymysql = pytest.importorskip("pymysql")  # ingestion_service importe extraction_creation_sql (pymysql, minio)
+from ingestion_service import IngestionService, coalesce, parse_record  # noqa: E402
+
+GOLD = ("train", "Gold Fish", "1.jpg")
+SHARK = ("train", "Shark", "2.jpg")
+
+
+def event(action, key, url=None):
+    return action, key, url, "2025-01-01T00:00:00.000Z", "0"
+
+
+def test_coalesce_keeps_last_event_per_image():
+    puts, deletes = coalesce([
+        event("put", GOLD, "u1"),
+        event("delete", GOLD),
+        event("delete", SHARK),
+        event("put", SHARK, "u2"),
+    ])
+    assert puts == {SHARK: "u2"}
+    assert deletes == [GOLD]
+
+
+def test_coalesce_last_upload_wins():
+    puts, deletes = coalesce([event("put", GOLD, "old"), event("put", GOLD, "new")])
+    assert puts == {GOLD: "new"} and deletes == []
+
+
+def test_coalesce_empty_batch():
+    assert coalesce([]) == ({}, [])
+
+
+def test_parse_record_decodes_keys_and_ignores_other_prefixes():
+    record = {"eventName": "s3:ObjectCreated:Put", "eventTime": "2025-01-01T00:00:00.000Z",
+              "s3": {"object": {"key": "train/Gold+Fish/img%201.jpg", "sequencer": "A"}}}
+    action, key, _, event_time, sequencer = parse_record(record)
+    assert action == "put"
+    assert key == ("train", "Gold Fish", "img 1.jpg")
+    assert (event_time, sequencer) == ("2025-01-01T00:00:00.000Z", "A")
+
+    record["s3"]["object"]["key"] = "models/model_v1_1.pt"
+    assert parse_record(record) is None
+    assert parse_record({"eventName": "s3:ObjectAccessed:Get"}) is None
+
+
+class FakeCursor:
+    """ Curseur pymysql minimal : refuse (DataError) toute ligne dont le fichier est "poison.jpg" """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, query, rows):
+        if any(file_name == "poison.jpg" for _, file_name, _, _ in rows):
+            raise pymysql.err.DataError(1406, "Data too long for column 'file_name'")
+        self.conn.pending.extend(rows)
+
+    def execute(self, query, params=None):
+        return 0
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.pending, self.rows = [], []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.rows.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+def test_poison_event_is_skipped_without_losing_the_batch():
+    conn = FakeConnection()
+    service = IngestionService(minio_client=None, conn=conn)
+    poison = ("train", "Shark", "poison.jpg")
+    service.process([event("put", GOLD, "u1"), event("put", poison, "u2"), event("put", SHARK, "u3")])
+    assert [row[:2] for row in conn.rows] == [("Gold Fish", "1.jpg"), ("Shark", "2.jpg")]
+    assert service.stats["applied"] == 2 and service.stats["skipped"] == 1
+    assert service.stats["upserted"] == 2
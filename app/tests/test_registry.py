@@ -0,0 +1,145 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from registry import LoadedModel, ModelRegistry
+
+
+def version_number(version):
+    return int(version.rsplit("_", 1)[1])
+
+
+def make_registry(available, max_loaded=2, activated=None):
+    loads = []
+
+    def load(version):
+        loads.append(version)
+        return LoadedModel(version, model=object(), backend="eager")
+
+    registry = ModelRegistry(load, lambda: list(available), version_number, max_loaded=max_loaded,
+                             on_activate=activated.append if activated is not None else None)
+    return registry, loads
+
+
+def test_remember_keeps_at_most_max_loaded_versions():
+    registry, _ = make_registry([], max_loaded=2)
+    for version in ("model_v1_1", "model_v1_2", "model_v1_3"):
+        registry.set_active(LoadedModel(version, object(), "eager"))
+    assert registry.loaded_versions() == ["model_v1_2", "model_v1_3"]
+
+
+def test_remember_never_evicts_the_active_version():
+    registry, _ = make_registry([], max_loaded=2)
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+    registry.get("model_v1_2")
+    registry.get("model_v1_3")  # version épinglée : l'active reste chargée
+    assert registry.active.version == "model_v1_1"
+    assert sorted(registry.loaded_versions()) == ["model_v1_1", "model_v1_3"]
+
+
+def test_pinned_version_is_loaded_once():
+    registry, loads = make_registry([])
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+    first = registry.get("model_v1_2")
+    assert registry.get("model_v1_2") is first
+    assert loads == ["model_v1_2"]
+
+
+def test_check_for_update_activates_newest_version():
+    activated = []
+    registry, loads = make_registry(["model_v1_10", "model_v1_2"], activated=activated)
+    loaded = registry.check_for_update()
+    assert loaded.version == "model_v1_10"  # ordre numérique, pas alphabétique
+    assert registry.active is loaded
+    assert registry.available == ["model_v1_2", "model_v1_10"]
+    assert [model.version for model in activated] == ["model_v1_10"]
+    assert registry.check_for_update() is None
+    assert loads == ["model_v1_10"]
+
+
+def test_check_for_update_ignores_older_or_missing_versions():
+    registry, loads = make_registry(["model_v1_1"])
+    registry.set_active(LoadedModel("model_v1_5", object(), "eager"))
+    assert registry.check_for_update() is None
+    assert registry.active.version == "model_v1_5"
+    assert loads == []
+
+    empty, _ = make_registry([])
+    assert empty.check_for_update() is None
+    assert empty.last_poll is not None
+
+
+def test_check_for_update_keeps_active_model_when_loading_fails():
+    registry, _ = make_registry(["model_v1_2"])
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+
+    def broken(version):
+        raise RuntimeError("poids corrompus")
+
+    registry.load_fn = broken
+    with pytest.raises(RuntimeError):
+        registry.check_for_update()
+    assert registry.active.version == "model_v1_1"
+
+
+def test_pinned_version_is_warmed_before_being_served():
+    warmed = []
+    registry, _ = make_registry([])
+    registry.warmup_fn = warmed.append
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+    loaded = registry.get("model_v1_2")
+    assert warmed == [loaded.model]
+
+
+def test_concurrent_pinned_requests_share_one_load_without_blocking_others():
+    release = threading.Event()
+    loads = []
+
+    def slow_load(version):
+        loads.append(version)
+        release.wait(5)
+        return LoadedModel(version, object(), "eager")
+
+    registry, _ = make_registry([])
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+    registry.load_fn = slow_load
+    with ThreadPoolExecutor(3) as pool:
+        pinned = [pool.submit(registry.get, "model_v1_2") for _ in range(2)]
+        # Le verrou n'est pas tenu pendant le chargement : l'active et les versions en cache restent servies
+        assert pool.submit(registry.get).result(timeout=1).version == "model_v1_1"
+        assert registry.loaded_versions() == ["model_v1_1"]
+        release.set()
+        first, second = (future.result(timeout=5) for future in pinned)
+    assert first is second
+    assert loads == ["model_v1_2"]
+
+
+def test_version_failing_to_load_is_not_retried_on_every_poll():
+    registry, _ = make_registry(["model_v1_1", "model_v1_2"])
+    attempts = []
+
+    def load(version):
+        attempts.append(version)
+        if version == "model_v1_2":
+            raise RuntimeError("poids corrompus")
+        return LoadedModel(version, object(), "eager")
+
+    registry.load_fn = load
+    with pytest.raises(RuntimeError):
+        registry.check_for_update()
+    assert "model_v1_2" in registry.status()["failed"]
+    # Vérification suivante : la version en échec est ignorée, la précédente est activée
+    assert registry.check_for_update().version == "model_v1_1"
+    assert registry.check_for_update() is None
+    assert attempts == ["model_v1_2", "model_v1_1"]
+
+
+def test_prepare_fn_runs_before_the_swap():
+    seen = []
+    registry, _ = make_registry(["model_v1_2"])
+    registry.set_active(LoadedModel("model_v1_1", object(), "eager"))
+    registry.prepare_fn = lambda loaded: seen.append((loaded.version, registry.active.version))
+    registry.check_for_update()
+    assert seen == [("model_v1_2", "model_v1_1")]
+    assert registry.active.version == "model_v1_2"
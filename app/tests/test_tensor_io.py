@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+
+from decode import IMAGENET_MEAN, IMAGENET_STD
+from tensor_io import TensorFormatError, parse_shape, pixels_to_tensor
+
+
+def test_parse_shape_adds_batch_dimension():
+    assert parse_shape("224,224,3") == (1, 224, 224, 3)
+    assert parse_shape("8,224,224,3") == (8, 224, 224, 3)
+    assert parse_shape("2,3,224,224", "NCHW") == (2, 3, 224, 224)
+
+
+@pytest.mark.parametrize("header, layout", [
+    ("224,224", "nhwc"),
+    ("0,224,224,3", "nhwc"),
+    ("1,256,256,3", "nhwc"),
+    ("1,224,224,3", "nchw"),
+    ("8;224;224;3", "nhwc"),
+    ("224,224,3", "chw"),
+])
+def test_parse_shape_rejects_bad_headers(header, layout):
+    with pytest.raises(TensorFormatError):
+        parse_shape(header, layout)
+
+
+def expected_normalized(pixels_nchw):
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (pixels_nchw.float() / 255 - mean) / std
+
+
+def test_pixels_to_tensor_nhwc_matches_torchvision_normalization():
+    pixels = np.random.default_rng(0).integers(0, 256, (2, 224, 224, 3), dtype=np.uint8)
+    tensor = pixels_to_tensor(bytearray(pixels.tobytes()), (2, 224, 224, 3))
+    assert tensor.shape == (2, 3, 224, 224) and tensor.dtype == torch.float32
+    expected = expected_normalized(torch.from_numpy(pixels).permute(0, 3, 1, 2))
+    torch.testing.assert_close(tensor, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_pixels_to_tensor_nchw():
+    pixels = np.random.default_rng(1).integers(0, 256, (1, 3, 224, 224), dtype=np.uint8)
+    tensor = pixels_to_tensor(bytearray(pixels.tobytes()), (1, 3, 224, 224), "nchw")
+    torch.testing.assert_close(tensor, expected_normalized(torch.from_numpy(pixels)), rtol=1e-5, atol=1e-5)
+
+
+def test_pixels_to_tensor_rejects_wrong_body_size():
+    with pytest.raises(TensorFormatError, match="octets"):
+        pixels_to_tensor(bytearray(224 * 224 * 3 - 1), (1, 224, 224, 3))
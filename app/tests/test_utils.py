@@ -0,0 +1,67 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from decode import ImageTooLargeError
+from utils import extract_images_from_archive, is_image_name
+
+
+def zip_bytes(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_bytes(files, mode="w:gz"):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_is_image_name():
+    assert is_image_name("poissons/Gold_Fish.JPG")
+    assert not is_image_name("poissons/.cache.jpg")
+    assert not is_image_name("notes.txt")
+
+
+@pytest.mark.parametrize("build", [zip_bytes, tar_bytes])
+def test_extracts_only_images(build):
+    files = {"a/one.jpg": b"1", "a/two.png": b"22", "a/readme.txt": b"x", "a/.hidden.jpg": b"h"}
+    assert sorted(extract_images_from_archive(build(files), max_files=10)) == [("a/one.jpg", b"1"), ("a/two.png", b"22")]
+
+
+@pytest.mark.parametrize("build", [zip_bytes, tar_bytes])
+def test_too_many_images(build):
+    files = {f"{i}.jpg": b"x" for i in range(3)}
+    with pytest.raises(ValueError, match="max 2 images"):
+        extract_images_from_archive(build(files), max_files=2)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError, match="Format d'archive non reconnu"):
+        extract_images_from_archive(b"pas une archive", max_files=10)
+
+
+@pytest.mark.parametrize("build", [zip_bytes, tar_bytes])
+def test_member_over_size_limit_is_refused(build):
+    # Quelques Ko compressés, 1 Mo une fois décompressé
+    data = build({"bomb.jpg": b"\0" * (1024 * 1024)})
+    assert len(data) < 64 * 1024
+    with pytest.raises(ImageTooLargeError):
+        extract_images_from_archive(data, max_files=10, max_member_bytes=512 * 1024)
+
+
+@pytest.mark.parametrize("build", [zip_bytes, tar_bytes])
+def test_total_decompressed_size_is_capped(build):
+    data = build({f"{i}.jpg": b"\0" * 1000 for i in range(5)})
+    assert len(extract_images_from_archive(data, max_files=10, max_total_bytes=5000)) == 5
+    with pytest.raises(ImageTooLargeError, match="Archive trop volumineuse"):
+        extract_images_from_archive(data, max_files=10, max_total_bytes=4999)
@@ -0,0 +1,124 @@
+"""
+Décomposition de la latence d'une requête par étape (lecture, décodage, attente du batch, inférence...).
+
+Chaque étape est :
+    - observée dans un histogramme Prometheus à buckets sub-milliseconde (endpoint, étape),
+    - renvoyée au client dans l'en-tête `Server-Timing` (visible dans l'onglet réseau du navigateur),
+    - optionnellement émise comme span OpenTelemetry, enfant du span de la requête (TRACING_ENABLED=1).
+
+Les étapes exécutées dans un pool (décodage, inférence) sont mesurées dans le thread qui fait le travail :
+l'attente du pool apparaît séparément (`decode_wait`, `batch_wait`).
+"""
+import os
+import time
+from contextlib import contextmanager
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "fish_api")
+
+# De 100 µs à 10 s : les étapes rapides (lecture, cache, sérialisation) restent lisibles
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def timed_call(fn, *args):
+    """ Exécute `fn` et renvoie (résultat, début, fin) en secondes perf_counter (à lancer dans un pool) """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, start, time.perf_counter()
+
+
+def make_tracer():
+    """
+    Tracer OpenTelemetry, ou None si le tracing est désactivé ou la librairie absente.
+    Si le SDK et l'exporteur OTLP sont installés et OTEL_EXPORTER_OTLP_ENDPOINT défini, les spans
+    y sont envoyés ; sinon le fournisseur global (ex: `opentelemetry-instrument`) est utilisé tel quel.
+    """
+    if not TRACING_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        print("⚠️ TRACING_ENABLED=1 mais opentelemetry n'est pas installé : spans désactivés")
+        return None
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+            provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+            print(f"✅ Spans OpenTelemetry envoyés à {os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')}")
+        except ImportError:
+            print("⚠️ opentelemetry-sdk / exporteur OTLP absents : fournisseur de spans global utilisé")
+    return trace.get_tracer(TRACING_SERVICE_NAME)
+
+
+# ---------------------------
+# Chronométrage d'une requête
+# ---------------------------
+class RequestTimer:
+    """
+    Durées des étapes d'une requête. Les étapes sont des intervalles perf_counter :
+    mesurées en direct (`with timer.stage("read")`) ou rapportées après coup par le
+    thread qui a fait le travail (`timer.add("decode", start, end)`).
+    Une étape répétée (ex: lecture de plusieurs fichiers) est cumulée.
+    """
+
+    def __init__(self, endpoint, stage_metric=None, tracer=None):
+        self.endpoint = endpoint
+        self.stage_metric = stage_metric
+        self.tracer = tracer
+        self.stages = {}
+        self.start = time.perf_counter()
+        # Correspondance perf_counter → horloge murale (ns) pour dater les spans
+        self._origin_ns = time.time_ns()
+        self._span = tracer.start_span(endpoint, start_time=self._origin_ns) if tracer else None
+
+    def _ns(self, t):
+        return self._origin_ns + int((t - self.start) * 1e9)
+
+    def add(self, name, start, end):
+        seconds = max(end - start, 0.0)
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self.stage_metric is not None:
+            self.stage_metric.labels(endpoint=self.endpoint, stage=name).observe(seconds)
+        if self._span is not None:
+            from opentelemetry import trace
+
+            span = self.tracer.start_span(name, context=trace.set_span_in_context(self._span),
+                                          start_time=self._ns(start))
+            span.end(end_time=self._ns(end))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def header(self):
+        """ Valeur de l'en-tête Server-Timing (durées en ms) """
+        parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.3f}")
+        return ", ".join(parts)
+
+    def finish(self, response=None, **attributes):
+        """ Termine le span de la requête et ajoute Server-Timing à `response` ; renvoie la durée totale """
+        total = self.elapsed()
+        if response is not None and SERVER_TIMING:
+            response.headers["Server-Timing"] = self.header()
+        if self._span is not None:
+            for key, value in attributes.items():
+                self._span.set_attribute(key, value)
+            self._span.end(end_time=self._ns(self.start + total))
+            self._span = None
+        return total
@@ -0,0 +1,76 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from decode import MAX_ARCHIVE_BYTES, MAX_UPLOAD_BYTES, ImageTooLargeError
+
+# Extensions d'images acceptées dans une archive
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def is_image_name(name: str) -> bool:
+    """ Vrai si le nom de fichier ressemble à une image (et n'est pas un fichier caché) """
+    base = os.path.basename(name)
+    return not base.startswith(".") and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class _ExtractionBudget:
+    """ Tailles décompressées annoncées par l'archive, vérifiées avant d'extraire chaque image """
+
+    def __init__(self, max_member_bytes, max_total_bytes):
+        self.max_member_bytes = max_member_bytes
+        self.max_total_bytes = max_total_bytes
+        self.total = 0
+
+    def reserve(self, name, size):
+        if size > self.max_member_bytes:
+            raise ImageTooLargeError(
+                f"{name} : {size / 1024 / 1024:.1f} MB décompressés (max {self.max_member_bytes / 1024 / 1024:.0f} MB)"
+            )
+        self.total += size
+        if self.total > self.max_total_bytes:
+            raise ImageTooLargeError(
+                f"Archive trop volumineuse une fois décompressée (max {self.max_total_bytes / 1024 / 1024:.0f} MB)"
+            )
+
+
+def extract_images_from_archive(data: bytes, max_files: int,
+                                max_member_bytes=MAX_UPLOAD_BYTES, max_total_bytes=MAX_ARCHIVE_BYTES):
+    """
+    Extrait les images d'une archive zip ou tar (éventuellement compressée).
+    Renvoie une liste de (nom, bytes), ou lève ValueError si le format
+    n'est pas reconnu ou si l'archive contient plus de `max_files` images.
+    Lève ImageTooLargeError, avant toute décompression, si une image dépasse `max_member_bytes`
+    ou si l'ensemble dépasse `max_total_bytes` (archive « bombe » : quelques Mo de zéros → des Go).
+    """
+    images = []
+    budget = _ExtractionBudget(max_member_bytes, max_total_bytes)
+    buffer = io.BytesIO(data)
+
+    if zipfile.is_zipfile(buffer):
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                if len(images) >= max_files:
+                    raise ValueError(f"Archive trop volumineuse (max {max_files} images)")
+                # zipfile s'arrête à file_size octets décompressés (taille annoncée, CRC vérifié ensuite)
+                budget.reserve(info.filename, info.file_size)
+                images.append((info.filename, archive.read(info)))
+        return images
+
+    buffer.seek(0)
+    try:
+        archive = tarfile.open(fileobj=buffer, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("Format d'archive non reconnu (zip ou tar attendu)")
+    with archive:
+        for member in archive:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            if len(images) >= max_files:
+                raise ValueError(f"Archive trop volumineuse (max {max_files} images)")
+            budget.reserve(member.name, member.size)
+            images.append((member.name, archive.extractfile(member).read()))
+    return images
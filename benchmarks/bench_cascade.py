@@ -0,0 +1,113 @@
+"""
+Coût par image de la cascade (app/cascade.py) selon le taux d'escalade :
+MobileNetV3-small seul, ResNet18 seul, et cascade avec 0 à 100 % des images escaladées.
+
+Le taux d'escalade est imposé en choisissant le seuil parmi les confiances du petit modèle sur le batch
+(poids aléatoires par défaut : la précision n'a pas de sens ici, seul le coût est mesuré ;
+le seuil réel est calibré sur la validation par train_model.py).
+
+    python benchmarks/bench_cascade.py
+    python benchmarks/bench_cascade.py --fast-weights model_v1_mobilenet_v3_small_123.pt --weights model_v1_123.pt
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+
+def median_ms(fn, repeats):
+    for _ in range(3):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+class SpreadLogits(torch.nn.Module):
+    """
+    MobileNetV3 aléatoire + décalage fixe des logits de chaque image : avec des poids aléatoires ses
+    sorties sont identiques pour toutes les images et aucun seuil ne les sépare (coût inchangé)
+    """
+
+    def __init__(self, model, batch_size):
+        super().__init__()
+        self.model = model
+        self.offsets = 3 * torch.randn(batch_size, 5)
+
+    def forward(self, x):
+        return self.model(x) + self.offsets[:len(x)]
+
+
+def run(weights=None, fast_weights=None, batch_size=8, rates=(0.0, 0.1, 0.25, 0.5, 1.0), repeats=20):
+    from architectures import build_model
+    from cascade import Cascade, count_gflops, timed_probabilities
+
+    torch.manual_seed(0)
+    full, fast = build_model("resnet18", 5).eval(), build_model("mobilenet_v3_small", 5).eval()
+    if weights:
+        full.load_state_dict(torch.load(weights, map_location="cpu"))
+    if fast_weights:
+        fast.load_state_dict(torch.load(fast_weights, map_location="cpu"))
+    else:
+        fast = SpreadLogits(fast, batch_size)
+    batch = torch.randn(batch_size, 3, 224, 224)
+    full_gflops, fast_gflops = count_gflops(full), count_gflops(fast)
+
+    results = {
+        "batch_size": batch_size,
+        "full_ms_per_image": round(median_ms(lambda: timed_probabilities(full, batch), repeats) / batch_size, 2),
+        "fast_ms_per_image": round(median_ms(lambda: timed_probabilities(fast, batch), repeats) / batch_size, 2),
+        "full_gflops": full_gflops,
+        "fast_gflops": fast_gflops,
+        "cascade": [],
+    }
+    confidences, _ = torch.sort(timed_probabilities(fast, batch)[0].max(dim=1).values)
+    for rate in rates:
+        escalated = round(rate * batch_size)
+        # Seuil juste au-dessus de la `escalated`-ième confiance la plus basse
+        threshold = 1.01 if escalated >= batch_size else float(confidences[escalated]) if escalated else 0.0
+        cascade = Cascade("bench", fast, threshold, fast_gflops)
+        _, stages, _, gflops = cascade.run(batch, full, full_gflops)
+        ms = median_ms(lambda: cascade.run(batch, full, full_gflops), repeats) / batch_size
+        results["cascade"].append({
+            "escalation_rate": stages.count("full") / batch_size,
+            "ms_per_image": round(ms, 2),
+            "gflops_per_image": round(sum(gflops) / batch_size, 3),
+            "cost_vs_full": round(ms / results["full_ms_per_image"], 3),
+        })
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Coût par image de la cascade MobileNetV3-small → ResNet18")
+    p.add_argument("--weights", help="state_dict ResNet18 (défaut : poids aléatoires)")
+    p.add_argument("--fast-weights", help="state_dict MobileNetV3-small (défaut : poids aléatoires)")
+    p.add_argument("--batch-size", type=int, default=8)
+    p.add_argument("--rates", type=float, nargs="+", default=[0.0, 0.1, 0.25, 0.5, 1.0])
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+
+    r = run(args.weights, args.fast_weights, args.batch_size, args.rates, args.repeats)
+    print(f"ResNet18 seul          : {r['full_ms_per_image']:.2f} ms/image, {r['full_gflops']} GFLOPs")
+    print(f"MobileNetV3-small seul : {r['fast_ms_per_image']:.2f} ms/image, {r['fast_gflops']} GFLOPs")
+    print(f"\n{'escalade':>9}{'ms/image':>10}{'GFLOPs/image':>14}{'coût vs ResNet18':>18}")
+    for c in r["cascade"]:
+        print(f"{100 * c['escalation_rate']:>8.0f}%{c['ms_per_image']:>10.2f}{c['gflops_per_image']:>14.3f}"
+              f"{c['cost_vs_full']:>17.0%}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(r, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
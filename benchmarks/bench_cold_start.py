@@ -0,0 +1,158 @@
+"""
+Temps de démarrage à froid de l'API : lancement d'uvicorn → `/` (liveness) → `/ready` → première prédiction.
+
+Chaque run démarre un process neuf, hors ligne (MODEL_OFFLINE=1), sur un dossier de modèle neuf :
+    pt          : seul le .pt est présent (premier démarrage d'un pod, conversion safetensors comprise)
+    safetensors : le .safetensors est déjà là (démarrages suivants, ou envoyé par train_model.py)
+
+Pour comparer avant/après une modification, lancer le même benchmark sur un autre arbre :
+    git worktree add /tmp/fish_before <commit>
+    python benchmarks/bench_cold_start.py --app-dir /tmp/fish_before/app --output before.json
+    python benchmarks/bench_cold_start.py --output after.json
+Une API sans `/ready` est considérée prête dès qu'elle répond sur `/`.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+from bench_decode import synthetic_jpeg  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def random_weights(path):
+    import torch
+
+    sys.path.insert(0, APP_DIR)
+    from backends import build_resnet18
+
+    torch.manual_seed(0)
+    torch.save(build_resnet18(5).state_dict(), path)
+
+
+def rss_mb(pid):
+    """ Mémoire résidente du process (Linux), en Mo """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def cold_start(app_dir, model_dir, filename, payload, timeout=300.0):
+    """ Un démarrage : durées (s) depuis le lancement du process jusqu'à chaque étape """
+    import httpx
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, MODEL_OFFLINE="1", MODEL_POLL_INTERVAL="0", CACHE_MAX_ENTRIES="0",
+               MODEL_DIR=model_dir, MODEL_FILENAME=filename)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"live_s": None, "ready_s": None, "first_prediction_s": None}
+    try:
+        with httpx.Client(base_url=base, timeout=60.0) as client:
+            while time.perf_counter() - start < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"L'API s'est arrêtée (code {process.returncode})")
+                try:
+                    if result["live_s"] is None:
+                        if client.get("/").status_code == 200:
+                            result["live_s"] = time.perf_counter() - start
+                    elif result["ready_s"] is None:
+                        status = client.get("/ready").status_code
+                        if status in (200, 404):
+                            result["ready_s"] = time.perf_counter() - start if status == 200 else result["live_s"]
+                    else:
+                        sent = time.perf_counter()
+                        response = client.post("/predict", files={"file": ("bench.jpg", payload, "image/jpeg")})
+                        if response.status_code == 200:
+                            result["first_prediction_s"] = time.perf_counter() - start
+                            result["first_latency_ms"] = (time.perf_counter() - sent) * 1000
+                            break
+                        continue
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            else:
+                raise TimeoutError(f"Pas de prédiction après {timeout:.0f}s")
+
+            sent = time.perf_counter()
+            client.post("/predict", files={"file": ("bench.jpg", payload, "image/jpeg")})
+            result["second_latency_ms"] = (time.perf_counter() - sent) * 1000
+            result["rss_mb"] = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Temps jusqu'à la première prédiction d'un process API neuf")
+    p.add_argument("--app-dir", default=APP_DIR, help="Dossier app/ de l'arbre à mesurer")
+    p.add_argument("--weights", help="state_dict .pt (défaut : ResNet18 à poids aléatoires)")
+    p.add_argument("--formats", nargs="+", choices=["pt", "safetensors"], default=["pt", "safetensors"])
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cold_start_")
+    weights = args.weights
+    if weights is None:
+        weights = os.path.join(workdir, "model_v1_0.pt")
+        random_weights(weights)
+    filename = os.path.basename(weights)
+    payload = synthetic_jpeg(1280, 960)
+
+    results = {}
+    for fmt in args.formats:
+        runs = []
+        for run in range(args.runs):
+            model_dir = os.path.join(workdir, f"{fmt}_{run}")
+            os.makedirs(model_dir)
+            shutil.copy(weights, os.path.join(model_dir, filename))
+            if fmt == "safetensors":
+                sys.path.insert(0, APP_DIR)
+                import torch
+                from backends import save_safetensors, weights_path
+
+                save_safetensors(torch.load(weights, map_location="cpu"), weights_path(os.path.join(model_dir, filename)))
+            runs.append(cold_start(os.path.abspath(args.app_dir), model_dir, filename, payload))
+            print(f"   {fmt:<12} run {run + 1} : {runs[-1]}")
+        results[fmt] = {key: round(statistics.median(r[key] for r in runs), 3)
+                        for key in runs[0] if runs[0][key] is not None}
+
+    print(f"\n{'format':<13}{'live (s)':>10}{'ready (s)':>11}{'1re préd. (s)':>15}{'latence 1re':>13}{'2e (ms)':>9}{'RSS (Mo)':>10}")
+    for fmt, r in results.items():
+        print(f"{fmt:<13}{r['live_s']:>10.2f}{r['ready_s']:>11.2f}{r['first_prediction_s']:>15.2f}"
+              f"{r['first_latency_ms']:>13.1f}{r['second_latency_ms']:>9.1f}{r.get('rss_mb', 0):>10.0f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"app_dir": os.path.abspath(args.app_dir), "results": results}, f, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
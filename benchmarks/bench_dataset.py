@@ -0,0 +1,109 @@
+"""
+Temps d'une epoch : ImageFolder (décodage JPEG + transforms à chaque epoch)
+contre le cache memory-mappé de dataset_cache.py (décodé une seule fois).
+
+    python benchmarks/bench_dataset.py                          # images synthétiques (1000 JPEG 1280x960)
+    python benchmarks/bench_dataset.py --train-dir data/train   # vrai dataset
+    python benchmarks/bench_dataset.py --with-model             # epoch complète avec ResNet18 (forward + backward)
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import torch  # noqa: E402
+from torch import nn  # noqa: E402
+from torch.utils.data import DataLoader  # noqa: E402
+from torchvision import datasets, models, transforms  # noqa: E402
+
+from dataset_cache import IMAGENET_MEAN, IMAGENET_STD, MemmapImageDataset, build_cache  # noqa: E402
+
+
+def synthetic_dataset(root, count, width, height, classes=4):
+    """ Arborescence ImageFolder de JPEG synthétiques (classe_i/img_j.jpg) """
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        class_dir = os.path.join(root, f"class_{i % classes}")
+        os.makedirs(class_dir, exist_ok=True)
+        pixels = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+        Image.fromarray(pixels).resize((width, height)).save(os.path.join(class_dir, f"img_{i}.jpg"), quality=90)
+
+
+def run_epoch(loader, model=None, optimizer=None):
+    criterion = nn.CrossEntropyLoss()
+    start = time.perf_counter()
+    samples = 0
+    for images, labels in loader:
+        if model is not None:
+            optimizer.zero_grad()
+            criterion(model(images), labels).backward()
+            optimizer.step()
+        samples += len(labels)
+    elapsed = time.perf_counter() - start
+    return {"epoch_s": round(elapsed, 2), "samples_per_s": round(samples / elapsed, 1)}
+
+
+def run(train_dir, cache_dir, img_size=224, batch_size=16, epochs=2, with_model=False, workers=8):
+    transform = transforms.Compose([
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+    folder = datasets.ImageFolder(root=train_dir, transform=transform)
+
+    start = time.perf_counter()
+    cached = MemmapImageDataset(build_cache(train_dir, cache_dir, img_size, workers=workers))
+    build_s = time.perf_counter() - start
+
+    model = optimizer = None
+    if with_model:
+        model = models.resnet18(weights=None)
+        model.fc = nn.Linear(model.fc.in_features, len(folder.classes))
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+
+    results = {"images": len(folder), "cache_build_s": round(build_s, 2)}
+    for name, dataset in (("imagefolder", folder), ("memmap", cached)):
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+        runs = [run_epoch(loader, model, optimizer) for _ in range(epochs)]
+        results[name] = min(runs, key=lambda r: r["epoch_s"])
+    results["speedup"] = round(results["imagefolder"]["epoch_s"] / results["memmap"]["epoch_s"], 2)
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark du temps d'epoch (ImageFolder vs cache memmap)")
+    p.add_argument("--train-dir", help="Dossier ImageFolder (sinon dataset synthétique)")
+    p.add_argument("--cache-dir", help="Dossier du cache (défaut : dossier temporaire)")
+    p.add_argument("--count", type=int, default=1000)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=960)
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--epochs", type=int, default=2, help="Epochs mesurées par variante (meilleure gardée)")
+    p.add_argument("--with-model", action="store_true", help="Inclut forward/backward ResNet18")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        train_dir = args.train_dir
+        if train_dir is None:
+            train_dir = os.path.join(tmp, "train")
+            synthetic_dataset(train_dir, args.count, args.width, args.height)
+        cache_dir = args.cache_dir or os.path.join(tmp, "cache")
+        result = run(train_dir, cache_dir, batch_size=args.batch_size, epochs=args.epochs,
+                     with_model=args.with_model)
+
+    print(f"📊 {result['images']} images, cache construit en {result['cache_build_s']}s")
+    print(f"{'Dataset':<12} {'epoch (s)':>10} {'img/s':>10}")
+    for name in ("imagefolder", "memmap"):
+        r = result[name]
+        print(f"{name:<12} {r['epoch_s']:>10.2f} {r['samples_per_s']:>10.1f}")
+    print(f"🚀 Accélération par epoch : x{result['speedup']}")
+
+
+if __name__ == "__main__":
+    main()
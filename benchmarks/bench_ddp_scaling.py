@@ -0,0 +1,127 @@
+"""
+Mise à l'échelle de l'entraînement data-parallel CPU (gloo) : temps d'une epoch
+ResNet18 avec 1, 2, 4, 8 process locaux (mêmes données, même batch par process).
+
+    python benchmarks/bench_ddp_scaling.py                               # dataset synthétique uint8
+    python benchmarks/bench_ddp_scaling.py --cache-index data/cache/<clé>.json
+    python benchmarks/bench_ddp_scaling.py --processes 1 2 4 --threads 2 # threads par process forcés
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import torch  # noqa: E402
+import torch.multiprocessing as mp  # noqa: E402
+from torch import nn  # noqa: E402
+from torch.utils.data import TensorDataset  # noqa: E402
+from torch.utils.data.distributed import DistributedSampler  # noqa: E402
+from torchvision import models  # noqa: E402
+
+from data_loader import BatchPreprocessor, LoaderConfig, make_loader  # noqa: E402
+from dataset_cache import MemmapImageDataset  # noqa: E402
+from distributed_training import (  # noqa: E402
+    available_cpus, cleanup, configure_threads, init_distributed, wrap_model,
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_dataset(args):
+    if args.cache_index:
+        return MemmapImageDataset(args.cache_index, normalize=False)
+    generator = torch.Generator().manual_seed(0)
+    images = torch.randint(0, 256, (args.samples, 3, 224, 224), dtype=torch.uint8, generator=generator)
+    labels = torch.randint(0, 9, (args.samples,), generator=generator)
+    return TensorDataset(images, labels)
+
+
+def worker(rank, world_size, port, args, results):
+    os.environ.update({
+        "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+        "RANK": str(rank), "WORLD_SIZE": str(world_size),
+        "LOCAL_RANK": str(rank), "LOCAL_WORLD_SIZE": str(world_size),
+    })
+    info = init_distributed()
+    threads = configure_threads(world_size, args.threads)
+
+    dataset = build_dataset(args)
+    sampler = DistributedSampler(dataset, shuffle=True) if info.enabled else None
+    loader = make_loader(dataset, args.batch_size, shuffle=True, sampler=sampler,
+                         config=LoaderConfig(num_workers=args.loader_workers))
+    model = models.resnet18(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, 9)
+    model = wrap_model(info, model)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    criterion = nn.CrossEntropyLoss()
+    preprocess = BatchPreprocessor(torch.device("cpu"))
+
+    epoch_times = []
+    for epoch in range(args.epochs + 1):  # epoch 0 = chauffe
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        start = time.perf_counter()
+        for images, labels in loader:
+            images, labels = preprocess(images, labels, train=True)
+            optimizer.zero_grad()
+            criterion(model(images), labels).backward()
+            optimizer.step()
+        if epoch > 0:
+            epoch_times.append(time.perf_counter() - start)
+
+    if info.is_main:
+        results.put({"processes": world_size, "threads_per_process": threads, "epoch_s": min(epoch_times)})
+    cleanup(info)
+
+
+def run(args):
+    ctx = mp.get_context("spawn")
+    report = []
+    for n in args.processes:
+        results = ctx.SimpleQueue()
+        mp.start_processes(worker, args=(n, free_port(), args, results), nprocs=n, join=True,
+                           start_method="spawn")
+        report.append(results.get())
+
+    baseline = report[0]["epoch_s"] * report[0]["processes"]
+    for row in report:
+        row["epoch_s"] = round(row["epoch_s"], 2)
+        row["speedup"] = round(report[0]["epoch_s"] / row["epoch_s"], 2)
+        # Efficacité : accélération obtenue / accélération idéale par rapport à la première ligne
+        row["efficiency"] = round(baseline / (row["epoch_s"] * row["processes"]), 2)
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="Scaling de l'entraînement DDP CPU (gloo)")
+    p.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--threads", type=int, default=None, help="Threads par process (défaut : cœurs / process)")
+    p.add_argument("--samples", type=int, default=512, help="Taille du dataset synthétique")
+    p.add_argument("--cache-index", help="Sidecar JSON d'un cache dataset_cache.py (vraies images)")
+    p.add_argument("--batch-size", type=int, default=16, help="Batch par process")
+    p.add_argument("--loader-workers", type=int, default=0)
+    p.add_argument("--epochs", type=int, default=1, help="Epochs mesurées (après une epoch de chauffe)")
+    p.add_argument("--output", help="Écrit le rapport en JSON")
+    args = p.parse_args()
+
+    report = run(args)
+    print(f"🖥️  {available_cpus()} cœurs disponibles")
+    print(f"{'process':>8} {'threads':>8} {'epoch (s)':>10} {'speedup':>8} {'efficacité':>11}")
+    for row in report:
+        print(f"{row['processes']:>8} {row['threads_per_process']:>8} {row['epoch_s']:>10.2f} "
+              f"{row['speedup']:>8.2f} {row['efficiency']:>11.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
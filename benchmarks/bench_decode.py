@@ -0,0 +1,101 @@
+"""
+Microbenchmark du décodage : chemin historique (PIL plein format + transforms
+torchvision) contre le décodage rapide de app/decode.py (draft JPEG + normalisation fusionnée).
+
+    python benchmarks/bench_decode.py                       # images synthétiques (photo téléphone, 4032x3024)
+    python benchmarks/bench_decode.py --images photos/*.jpg # vraies images
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import decode  # noqa: E402
+from torchvision import transforms  # noqa: E402
+
+legacy_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=decode.IMAGENET_MEAN, std=decode.IMAGENET_STD),
+])
+
+
+def legacy_decode(image_bytes):
+    """ Chemin d'origine de classify() : décodage pleine résolution puis transform """
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    return legacy_transform(image)
+
+
+def synthetic_jpeg(width, height, quality=90):
+    """ JPEG avec du contenu basse fréquence (plus réaliste qu'un bruit blanc) """
+    x = np.linspace(0, 6 * np.pi, width)
+    y = np.linspace(0, 4 * np.pi, height)
+    base = (np.sin(x)[None, :] + np.cos(y)[:, None]) * 60 + 128
+    rgb = np.stack([base, np.roll(base, 50, axis=1), base[::-1]], axis=-1)
+    rgb += np.random.default_rng(0).normal(0, 8, rgb.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def bench(fn, payloads, repeats):
+    timings = []
+    for _ in range(repeats):
+        for payload in payloads:
+            start = time.perf_counter()
+            fn(payload)
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(sorted(timings)[int(0.95 * (len(timings) - 1))], 2),
+    }
+
+
+def run(images=None, width=4032, height=3024, repeats=10):
+    if images:
+        payloads = [open(path, "rb").read() for path in images]
+    else:
+        payloads = [synthetic_jpeg(width, height)]
+
+    # Vérification : écart moyen entre les deux chemins (le mode draft change légèrement les pixels)
+    diff = (legacy_decode(payloads[0]) - decode.decode_to_tensor(payloads[0])).abs().mean().item()
+
+    legacy = bench(legacy_decode, payloads, repeats)
+    fast = bench(decode.decode_to_tensor, payloads, repeats)
+    return {
+        "images": len(payloads),
+        "bytes_mean": int(statistics.mean(len(p) for p in payloads)),
+        "legacy": legacy,
+        "fast": fast,
+        "speedup": round(legacy["mean_ms"] / fast["mean_ms"], 2),
+        "mean_abs_diff": round(diff, 4),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark du décodage d'images")
+    p.add_argument("--images", nargs="*", help="Images à décoder (sinon JPEG synthétique)")
+    p.add_argument("--width", type=int, default=4032)
+    p.add_argument("--height", type=int, default=3024)
+    p.add_argument("--repeats", type=int, default=10)
+    args = p.parse_args()
+
+    result = run(args.images, args.width, args.height, args.repeats)
+    print(f"📷 {result['images']} image(s), {result['bytes_mean'] / 1024:.0f} KB en moyenne")
+    print(f"{'Chemin':<10} {'moy (ms)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for name in ("legacy", "fast"):
+        r = result[name]
+        print(f"{name:<10} {r['mean_ms']:>10.2f} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f}")
+    print(f"🚀 Accélération : x{result['speedup']} (écart moyen des tenseurs : {result['mean_abs_diff']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Latence et mémoire de l'inférence eager ResNet18 selon la précision et le format mémoire :
+fp32 NCHW (historique), fp32 channels_last, bf16, bf16 channels_last (app/backends.PrecisionModel).
+
+Chaque mode tourne dans un process séparé pour mesurer son pic de mémoire (RSS) isolément.
+
+    python benchmarks/bench_precision.py
+    python benchmarks/bench_precision.py --weights model_v1_1761836094.pt --batch-sizes 1 8 32
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+
+def _proc_status_mb(field):
+    """ VmRSS (mémoire résidente) ou VmHWM (pic) du process courant, en MB """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+MODES = {
+    "fp32": ("fp32", False),
+    "fp32_cl": ("fp32", True),
+    "bf16": ("bf16", False),
+    "bf16_cl": ("bf16", True),
+}
+
+
+def measure(mode, weights, batch_sizes, repeats, threads):
+    """ Exécuté dans le process enfant : latences par taille de batch + pic RSS """
+    import torch
+    from backends import PrecisionModel, build_resnet18
+
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)  # mêmes poids aléatoires dans tous les process si --weights est absent
+    model = build_resnet18(5)
+    if weights:
+        model.load_state_dict(torch.load(weights, map_location="cpu"))
+    precision, channels_last = MODES[mode]
+    model = PrecisionModel(model.eval(), precision, channels_last)
+
+    result = {"mode": mode, "latency_ms": {}}
+    rss_before = _proc_status_mb("VmRSS")
+    reference = torch.randn(8, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+    with torch.no_grad():
+        result["logits"] = model(reference).tolist()
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+            for _ in range(3):
+                model(batch)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model(batch)
+                timings.append((time.perf_counter() - start) * 1000)
+            result["latency_ms"][batch_size] = round(statistics.median(timings), 2)
+    result["peak_rss_mb"] = round(_proc_status_mb("VmHWM"), 1)
+    # Mémoire ajoutée par l'inférence (activations, poids convertis) au-delà du modèle chargé
+    result["inference_mb"] = round(_proc_status_mb("VmHWM") - rss_before, 1)
+    return result
+
+
+def run(weights=None, batch_sizes=(1, 8), repeats=20, threads=None, modes=tuple(MODES)):
+    # Le mode fp32 sert toujours de référence (premier résultat)
+    modes = ["fp32"] + [m for m in modes if m != "fp32"]
+    results = []
+    for mode in modes:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", mode, "--repeats", str(repeats),
+               "--batch-sizes", *map(str, batch_sizes)]
+        if weights:
+            cmd += ["--weights", weights]
+        if threads:
+            cmd += ["--threads", str(threads)]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    # Écart aux logits fp32 et accord des prédictions top-1
+    import torch
+
+    reference = torch.tensor(results[0]["logits"])
+    for r in results:
+        logits = torch.tensor(r.pop("logits"))
+        r["max_abs_diff"] = round((logits - reference).abs().max().item(), 4)
+        r["top1_agreement"] = round((logits.argmax(1) == reference.argmax(1)).float().mean().item(), 3)
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark précision / channels_last de l'inférence eager")
+    p.add_argument("--weights", help="state_dict entraîné (sinon poids aléatoires)")
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--threads", type=int, default=None)
+    p.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    p.add_argument("--child", choices=list(MODES), help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.weights, args.batch_sizes, args.repeats, args.threads)))
+        return
+
+    results = run(args.weights, args.batch_sizes, args.repeats, args.threads, args.modes)
+    header = "".join(f"{f'b={b} (ms)':>12}" for b in args.batch_sizes)
+    print(f"{'mode':<10}{header}{'pic RSS':>9}{'inférence':>11}{'écart max':>11}{'accord top1':>13}")
+    for r in results:
+        latencies = "".join(f"{r['latency_ms'][str(b)]:>12.2f}" for b in args.batch_sizes)
+        print(f"{r['mode']:<10}{latencies}{r['peak_rss_mb']:>9.0f}{r['inference_mb']:>11.0f}"
+              f"{r['max_abs_diff']:>11.4f}{r['top1_agreement']:>13.3f}")
+    print("(mémoire en MB ; écart max et accord top-1 mesurés par rapport aux logits fp32)")
+
+
+if __name__ == "__main__":
+    main()
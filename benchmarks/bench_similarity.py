@@ -0,0 +1,93 @@
+"""
+Latence et rappel de la recherche /similar (app/similarity.py) sur des embeddings synthétiques :
+index IVF memory-mappé vs recherche exhaustive, pour plusieurs valeurs de nprobe.
+
+Les vecteurs sont tirés autour de centres aléatoires (comme des espèces / prises de vue proches),
+normalisés, en 512 dimensions. Le rappel@k est mesuré par rapport à la recherche exacte.
+
+    python benchmarks/bench_similarity.py --count 1000000 --nprobe 4 8 16 32
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from similarity import build_index, load_index, normalize  # noqa: E402
+
+# Dimension des embeddings ResNet18 (entrée de `fc`)
+EMBEDDING_DIM = 512
+
+
+def synthetic_embeddings(count, clusters, seed=0, chunk=100_000):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, EMBEDDING_DIM)))
+    vectors = np.empty((count, EMBEDDING_DIM), dtype=np.float16)
+    for start in range(0, count, chunk):
+        size = min(chunk, count - start)
+        noise = rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32) * 0.04
+        vectors[start:start + size] = normalize(centers[rng.integers(0, clusters, size)] + noise)
+    queries = normalize(centers[rng.integers(0, clusters, 200)]
+                        + rng.standard_normal((200, EMBEDDING_DIM)).astype(np.float32) * 0.04)
+    return vectors, queries
+
+
+def exact_search(vectors, query, k, chunk=200_000):
+    scores = np.concatenate([np.asarray(vectors[s:s + chunk], dtype=np.float32) @ query
+                             for s in range(0, len(vectors), chunk)])
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark de l'index IVF de /similar")
+    p.add_argument("--count", type=int, default=200_000)
+    p.add_argument("--clusters", type=int, default=2000)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--index-dir", default=None, help="Dossier de l'index (défaut : dossier temporaire)")
+    args = p.parse_args()
+
+    vectors, queries = synthetic_embeddings(args.count, args.clusters)
+    queries = queries[:args.queries]
+    keys = [f"train/synthetic/{i:08d}.jpg" for i in range(args.count)]
+    index_dir = args.index_dir or tempfile.mkdtemp(prefix="similarity_")
+
+    start = time.perf_counter()
+    build_index(index_dir, keys, vectors, "synthetic")
+    build_s = time.perf_counter() - start
+    index = load_index(index_dir)
+    print(f"📦 {args.count} vecteurs, {len(index.centroids)} listes, construit en {build_s:.1f}s ({index_dir})")
+
+    # Vérité terrain : recherche exhaustive sur les mêmes vecteurs float16
+    truth, exact_ms = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows = exact_search(vectors, query, args.k)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        truth.append({keys[row] for row in rows})
+    print(f"{'mode':<14}{'p50 (ms)':>10}{'p99 (ms)':>10}{f'rappel@{args.k}':>12}")
+    print(f"{'exhaustif':<14}{statistics.median(exact_ms):>10.2f}"
+          f"{np.percentile(exact_ms, 99):>10.2f}{1.0:>12.3f}")
+
+    for nprobe in args.nprobe:
+        for query in queries[:5]:
+            index.search(query, args.k, nprobe)  # pages des listes sondées en cache
+        timings, recall = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = index.search(query, args.k, nprobe)
+            timings.append((time.perf_counter() - start) * 1000)
+            recall.append(len({key for key, _ in found} & expected) / args.k)
+        print(f"{f'ivf nprobe={nprobe}':<14}{statistics.median(timings):>10.2f}"
+              f"{np.percentile(timings, 99):>10.2f}{statistics.mean(recall):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
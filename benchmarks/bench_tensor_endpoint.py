@@ -0,0 +1,180 @@
+"""
+Surcoût par requête de /predict/tensor (pixels uint8 bruts) face à /predict (JPEG en multipart),
+pour un service amont qui tient déjà des images 224x224 décodées.
+
+Par défaut l'API tourne avec le DummyModel (aucun modèle dans le dossier, MODEL_OFFLINE=1) : l'inférence
+est quasi nulle et la latence mesurée est le surcoût du transport (encodage JPEG côté client, multipart,
+décodage, normalisation, sérialisation). `--model resnet18` ajoute l'inférence avec des poids aléatoires.
+Le cache est désactivé (CACHE_MAX_ENTRIES=0) pour que /predict décode à chaque requête.
+
+    python benchmarks/bench_tensor_endpoint.py
+    python benchmarks/bench_tensor_endpoint.py --model resnet18 --batch-sizes 1 8 --requests 50
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_cold_start import APP_DIR, free_port, random_weights  # noqa: E402
+
+
+def synthetic_frame(seed=0, size=224):
+    """ Image 224x224 RGB uint8 (NHWC), telle qu'un service amont la tient après redimensionnement """
+    x = np.linspace(0, 6 * np.pi, size)
+    base = (np.sin(x)[None, :] + np.cos(x)[:, None]) * 60 + 128
+    rgb = np.stack([base, np.roll(base, 50, axis=1), base[::-1]], axis=-1)
+    rgb += np.random.default_rng(seed).normal(0, 8, rgb.shape)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def jpeg_bytes(frame, quality=90):
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def server_timing(response):
+    """ Durées (ms) de l'en-tête Server-Timing """
+    timings = {}
+    for part in response.headers.get("server-timing", "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "p50": round(statistics.median(values), 3),
+        "p95": round(values[int(0.95 * (len(values) - 1))], 3),
+        "mean": round(statistics.mean(values), 3),
+    }
+
+
+def measure(client, requests, send):
+    """ `send()` → (réponse, octets envoyés, ms d'encodage client) ; latences et étapes serveur """
+    for _ in range(3):
+        send()
+    encode_ms, total_ms, server_ms, decode_ms, sent = [], [], [], [], 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response, size, encode = send()
+        total_ms.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} : {response.text[:200]}")
+        timings = server_timing(response)
+        encode_ms.append(encode)
+        server_ms.append(timings.get("total", 0.0))
+        decode_ms.append(timings.get("decode", 0.0) + timings.get("decode_wait", 0.0))
+        sent = size
+    return {
+        "request_bytes": sent,
+        "client_encode_ms": summarize(encode_ms),
+        "server_decode_ms": summarize(decode_ms),
+        "server_total_ms": summarize(server_ms),
+        "round_trip_ms": summarize(total_ms),
+    }
+
+
+def run(batch_sizes=(1, 8), requests=100, model="dummy", quality=90):
+    import httpx
+
+    frames = [synthetic_frame(seed) for seed in range(max(batch_sizes))]
+    model_dir = tempfile.mkdtemp(prefix="bench_tensor_")
+    filename = "model_v1_1.pt"
+    if model == "resnet18":
+        random_weights(os.path.join(model_dir, filename))
+    port = free_port()
+    env = dict(os.environ, MODEL_OFFLINE="1", MODEL_POLL_INTERVAL="0", CACHE_MAX_ENTRIES="0",
+               MODEL_DIR=model_dir, MODEL_FILENAME=filename)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {"model": model, "requests": requests, "jpeg_quality": quality, "batch_sizes": {}}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60.0) as client:
+            deadline = time.perf_counter() + 300
+            while True:
+                try:
+                    if client.get("/ready").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if process.poll() is not None or time.perf_counter() > deadline:
+                    raise RuntimeError("L'API n'est pas prête")
+                time.sleep(0.05)
+
+            for batch_size in batch_sizes:
+                batch = frames[:batch_size]
+
+                def send_multipart():
+                    start = time.perf_counter()
+                    payloads = [jpeg_bytes(frame, quality) for frame in batch]
+                    encode = (time.perf_counter() - start) * 1000
+                    if batch_size == 1:
+                        response = client.post("/predict", files={"file": ("frame.jpg", payloads[0], "image/jpeg")})
+                    else:
+                        response = client.post("/predict/batch", files=[
+                            ("files", (f"frame_{i}.jpg", payload, "image/jpeg")) for i, payload in enumerate(payloads)
+                        ])
+                    return response, sum(map(len, payloads)), encode
+
+                def send_tensor():
+                    start = time.perf_counter()
+                    body = np.stack(batch).tobytes()
+                    encode = (time.perf_counter() - start) * 1000
+                    response = client.post("/predict/tensor", content=body, headers={
+                        "X-Tensor-Shape": f"{batch_size},224,224,3", "Content-Type": "application/octet-stream",
+                    })
+                    return response, len(body), encode
+
+                results["batch_sizes"][batch_size] = {
+                    "multipart_jpeg": measure(client, requests, send_multipart),
+                    "tensor": measure(client, requests, send_tensor),
+                }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Surcoût par requête : /predict/tensor contre /predict (JPEG multipart)")
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--model", choices=["dummy", "resnet18"], default="dummy")
+    p.add_argument("--quality", type=int, default=90, help="Qualité JPEG côté client")
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+
+    r = run(args.batch_sizes, args.requests, args.model, args.quality)
+    print(f"🐟 Modèle : {r['model']}, {r['requests']} requêtes séquentielles par cas (p50, ms)")
+    print(f"\n{'batch':>5} {'chemin':<15}{'octets':>10}{'encodage':>10}{'décodage':>10}{'serveur':>10}{'aller-retour':>14}")
+    for batch_size, paths in r["batch_sizes"].items():
+        for name, m in paths.items():
+            print(f"{batch_size:>5} {name:<15}{m['request_bytes']:>10}{m['client_encode_ms']['p50']:>10.2f}"
+                  f"{m['server_decode_ms']['p50']:>10.2f}{m['server_total_ms']['p50']:>10.2f}{m['round_trip_ms']['p50']:>14.2f}")
+        saved = (paths["multipart_jpeg"]["round_trip_ms"]["p50"] + paths["multipart_jpeg"]["client_encode_ms"]["p50"]
+                 - paths["tensor"]["round_trip_ms"]["p50"] - paths["tensor"]["client_encode_ms"]["p50"])
+        print(f"{'':>5} ⚡ {saved:.2f} ms gagnés par requête (encodage client + aller-retour)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(r, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
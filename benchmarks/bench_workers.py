@@ -0,0 +1,167 @@
+"""
+Mémoire par worker de l'API multi-workers (gunicorn_conf.py) et vérification des métriques agrégées.
+
+Pour chaque configuration (nombre de workers × poids en mmap ou copiés × channels_last), lance gunicorn hors ligne,
+attend que tous les workers soient prêts, envoie des prédictions puis relève pour chaque process
+(/proc/<pid>/smaps_rollup, Linux) :
+    RSS     : pages résidentes, y compris celles partagées avec les autres process
+    PSS     : part proportionnelle (une page partagée par 4 process compte pour 1/4) — la vraie empreinte
+    privé   : pages propres au process
+La somme des PSS est la mémoire réellement consommée par le pod. `/metrics` doit compter toutes
+les prédictions envoyées, quel que soit le worker qui répond.
+
+    python benchmarks/bench_workers.py --workers 1 2 4
+    python benchmarks/bench_workers.py --workers 4 --mmap 1 --preload --weights app/model_v1_1761836094.pt
+    python benchmarks/bench_workers.py --workers 2 4 --mmap 1 --channels-last 0 1   # poids channels_last partagés ?
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_cold_start import APP_DIR, free_port, random_weights  # noqa: E402
+from bench_decode import synthetic_jpeg  # noqa: E402
+
+
+def memory(pid):
+    """ RSS, PSS, partagé et privé (Mo) d'un process """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(values.get("Rss", 0), 1),
+        "pss_mb": round(values.get("Pss", 0), 1),
+        "shared_mb": round(values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0), 1),
+        "private_mb": round(values.get("Private_Clean", 0) + values.get("Private_Dirty", 0), 1),
+    }
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def metric_samples(text, name):
+    """ Échantillons d'une métrique du format texte Prometheus : [(labels, valeur)] """
+    pattern = re.compile(rf"^{name}(?:{{(.*)}})? (\S+)$")
+    return [(m.group(1) or "", float(m.group(2))) for m in map(pattern.match, text.splitlines()) if m]
+
+
+def run_config(app_dir, model_dir, filename, workers, mmap, requests, payload, preload=False, channels_last=False,
+               timeout=300.0):
+    import httpx
+
+    port = free_port()
+    metrics_dir = tempfile.mkdtemp(prefix="fish_metrics_")
+    env = dict(os.environ, MODEL_OFFLINE="1", MODEL_POLL_INTERVAL="0", CACHE_MAX_ENTRIES="0",
+               MODEL_DIR=model_dir, MODEL_FILENAME=filename, MODEL_MMAP="1" if mmap else "0",
+               WEB_WORKERS=str(workers), BIND=f"127.0.0.1:{port}", PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+               GUNICORN_PRELOAD="1" if preload else "0", INFERENCE_CHANNELS_LAST="1" if channels_last else "0")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn_conf.py"],
+                               cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120.0) as client:
+            # Prêt quand chaque worker a publié son fish_startup_seconds (gauge « liveall », label pid ;
+            # 0 tant que le worker n'est pas prêt)
+            deadline = time.perf_counter() + timeout
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"gunicorn s'est arrêté (code {process.returncode})")
+                try:
+                    started = metric_samples(client.get("/metrics").text, "fish_startup_seconds")
+                    if sum(1 for _, value in started if value > 0) >= workers:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("Workers non prêts")
+                time.sleep(0.2)
+
+            def predict(_):
+                return client.post("/predict", files={"file": ("bench.jpg", payload, "image/jpeg")}).status_code
+
+            with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+                statuses = list(pool.map(predict, range(requests)))
+            counted = sum(v for _, v in metric_samples(client.get("/metrics").text, "fish_predictions_total"))
+
+            master = memory(process.pid)
+            worker_memory = [memory(pid) for pid in children(process.pid)]
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    return {
+        "workers": workers,
+        "mmap": mmap,
+        "preload": preload,
+        "channels_last": channels_last,
+        "ok": statuses.count(200),
+        "predictions_counted": counted,
+        "master": master,
+        "per_worker": worker_memory,
+        "total_pss_mb": round(master["pss_mb"] + sum(m["pss_mb"] for m in worker_memory), 1),
+        "total_rss_mb": round(master["rss_mb"] + sum(m["rss_mb"] for m in worker_memory), 1),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Mémoire par worker de l'API multi-workers")
+    p.add_argument("--app-dir", default=APP_DIR)
+    p.add_argument("--weights", help="state_dict .pt (défaut : ResNet18 à poids aléatoires)")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--mmap", type=int, nargs="+", choices=[0, 1], default=[1, 0],
+                   help="1 = poids en mmap partagé (MODEL_MMAP=1), 0 = copie privée par worker")
+    p.add_argument("--channels-last", type=int, nargs="+", choices=[0, 1], default=[0],
+                   help="1 = modèle servi en channels_last (INFERENCE_CHANNELS_LAST=1, poids .cl.safetensors)")
+    p.add_argument("--preload", action="store_true", help="GUNICORN_PRELOAD=1 : imports faits dans le master avant le fork")
+    p.add_argument("--requests", type=int, default=40)
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+
+    model_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    weights = args.weights
+    if weights is None:
+        weights = os.path.join(model_dir, "model_v1_0.pt")
+        random_weights(weights)
+    else:
+        shutil.copy(weights, model_dir)
+    filename = os.path.basename(weights)
+    payload = synthetic_jpeg(1280, 960)
+
+    results = []
+    print(f"{'workers':>7}{'mmap':>6}{'cl':>4}{'préd. ok':>10}{'comptées':>10}{'PSS/worker':>12}{'privé/worker':>14}"
+          f"{'RSS/worker':>12}{'PSS total':>11}{'RSS total':>11}")
+    for mmap in args.mmap:
+        for channels_last in args.channels_last:
+            for workers in args.workers:
+                r = run_config(os.path.abspath(args.app_dir), model_dir, filename, workers, bool(mmap),
+                               args.requests, payload, args.preload, bool(channels_last))
+                results.append(r)
+                n = max(len(r["per_worker"]), 1)
+                avg = {key: sum(m[key] for m in r["per_worker"]) / n for key in ("pss_mb", "private_mb", "rss_mb")}
+                print(f"{workers:>7}{mmap:>6}{channels_last:>4}{r['ok']:>10}{r['predictions_counted']:>10.0f}"
+                      f"{avg['pss_mb']:>12.0f}{avg['private_mb']:>14.0f}{avg['rss_mb']:>12.0f}"
+                      f"{r['total_pss_mb']:>11.0f}{r['total_rss_mb']:>11.0f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    shutil.rmtree(model_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Générateur de charge asynchrone pour /predict : latence p50/p95/p99 et débit selon la concurrence.
+
+Contre une API lancée (uvicorn, docker compose, k8s) :
+    python benchmarks/load_test.py --url http://127.0.0.1:8000/predict --concurrency 1 4 16 32
+
+Hors ligne, l'application FastAPI est chargée dans le process (sans serveur ni MinIO) avec
+un state_dict local ou le DummyModel (mesure alors tout sauf le calcul du modèle) :
+    python benchmarks/load_test.py --in-process --weights app/model_v1_1761836094.pt
+    python benchmarks/load_test.py --in-process --model dummy --output load.json
+
+Les images envoyées sont distinctes et le cache des prédictions est désactivé en mode
+in-process (sinon on mesurerait le cache) ; --images pour utiliser de vraies photos.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+from bench_decode import synthetic_jpeg  # noqa: E402
+
+
+def latency_summary(latencies_ms):
+    if not latencies_ms:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2), "mean_ms": round(float(np.mean(latencies_ms)), 2)}
+
+
+def synthetic_payloads(count, width=1280, height=960):
+    """ JPEG distincts (qualité variable) : aucune requête ne tombe sur une prédiction en cache """
+    return [synthetic_jpeg(width, height, quality=70 + i % 25) for i in range(count)]
+
+
+def serving_env(model="random", weights=None, workdir=None):
+    """
+    Variables d'environnement de l'API hors ligne, à poser avant d'importer app/model.py :
+    `weights` (state_dict local), sinon ResNet18 à poids aléatoires ("random") ou DummyModel ("dummy").
+    """
+    env = {"MODEL_OFFLINE": "1", "MODEL_POLL_INTERVAL": "0", "CACHE_MAX_ENTRIES": "0"}
+    if weights:
+        env.update(MODEL_DIR=os.path.dirname(os.path.abspath(weights)), MODEL_FILENAME=os.path.basename(weights))
+    elif model == "random":
+        import torch
+
+        sys.path.insert(0, APP_DIR)
+        from backends import build_resnet18
+
+        workdir = workdir or tempfile.mkdtemp(prefix="bench_model_")
+        torch.manual_seed(0)
+        torch.save(build_resnet18(5).state_dict(), os.path.join(workdir, "model_v1_0.pt"))
+        env.update(MODEL_DIR=workdir, MODEL_FILENAME="model_v1_0.pt")
+    else:
+        env.update(MODEL_DIR=workdir or tempfile.mkdtemp(prefix="bench_model_"), MODEL_FILENAME="model_v1_0.pt")
+    os.environ.update(env)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    return env
+
+
+async def run_level(client, url, payloads, concurrency, duration_s, warmup_s=1.0):
+    """ `concurrency` clients en boucle fermée pendant `duration_s` secondes """
+    latencies, statuses = [], Counter()
+    counter = iter(range(10 ** 12))
+    deadline = None
+
+    async def worker():
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            payload = payloads[next(counter) % len(payloads)]
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, files={"file": ("bench.jpg", payload, "image/jpeg")})
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if start >= measure_from:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed_ms)
+
+    start = time.perf_counter()
+    measure_from = start + warmup_s
+    deadline = measure_from + duration_s
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - measure_from
+    ok = statuses.get(200, 0)
+    return {
+        "concurrency": concurrency,
+        "requests": sum(statuses.values()),
+        "ok": ok,
+        "errors": sum(statuses.values()) - ok,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "throughput_rps": round(ok / elapsed, 2) if elapsed > 0 else 0.0,
+        **latency_summary(latencies),
+    }
+
+
+async def wait_ready(client, url, timeout=300.0):
+    """ Attend que /ready réponde 200 (modèle chargé et chauffé) ; ignoré si l'API n'a pas de /ready """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code in (200, 404):
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"API non prête après {timeout:.0f}s ({url})")
+
+
+async def run_load(levels, payloads, duration_s, url=None, timeout=60.0):
+    """ Un palier par niveau de concurrence ; en mode in-process l'app est importée depuis app/main.py """
+    import httpx
+
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    if url:
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            await wait_ready(client, str(httpx.URL(url).join("/ready")))
+            return [await run_level(client, url, payloads, c, duration_s) for c in levels]
+
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout,
+                                     limits=limits) as client:
+            await wait_ready(client, "/ready")
+            return [await run_level(client, "/predict", payloads, c, duration_s) for c in levels]
+
+
+def print_table(results):
+    print(f"{'concurrence':>11}{'req/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'erreurs':>9}")
+    for r in results:
+        cells = "".join(f"{r[k]:>10.1f}" if r[k] is not None else f"{'-':>10}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{r['concurrency']:>11}{r['throughput_rps']:>10.1f}{cells}{r['errors']:>9}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Test de charge de /predict")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="URL de /predict d'une API lancée")
+    target.add_argument("--in-process", action="store_true", help="Charger l'app dans le process (hors ligne)")
+    p.add_argument("--model", choices=["random", "dummy"], default="random",
+                   help="In-process sans --weights : ResNet18 aléatoire ou DummyModel")
+    p.add_argument("--weights", help="In-process : state_dict local (ex: app/model_v1_1761836094.pt)")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p.add_argument("--duration", type=float, default=10.0, help="Secondes mesurées par palier")
+    p.add_argument("--images", nargs="*", help="Images à envoyer (sinon JPEG synthétiques 1280x960)")
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+
+    if args.in_process:
+        serving_env(args.model, args.weights)
+    payloads = ([open(path, "rb").read() for path in args.images] if args.images
+                else synthetic_payloads(16))
+    results = asyncio.run(run_load(args.concurrency, payloads, args.duration, url=args.url))
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"load": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Suite de benchmarks du service et de l'entraînement, résultats en JSON pour comparer les commits.
+
+    micro : décodage (app/decode.py), transform (torchvision vs normalisation fusionnée),
+            passe avant de app/model.py (rank_classes) aux tailles de batch 1 à 64
+    load  : charge asynchrone sur /predict, app chargée dans le process (voir load_test.py)
+    train : débit du pipeline d'entrée de l'entraînement (cache memmap + DataLoader) et du calcul seul
+
+Tout tourne hors ligne : state_dict local (--weights), ResNet18 aléatoire ou DummyModel (--model).
+
+    python benchmarks/suite.py                                   # → benchmarks/results/<date>_<commit>.json
+    python benchmarks/suite.py --only micro --quick
+    python benchmarks/suite.py --compare benchmarks/results/baseline.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from load_test import run_load, serving_env, synthetic_payloads  # noqa: E402
+
+SECTIONS = ["micro", "load", "train"]
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+
+def timeit(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3)}
+
+
+def environment():
+    import torch
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = "unknown"
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+    }
+
+
+# ---------------------------
+# Microbenchmarks
+# ---------------------------
+def bench_micro(batch_sizes, repeats):
+    import io
+
+    import torch
+    from PIL import Image
+    from torchvision import transforms
+
+    import decode
+    import model
+    from bench_decode import synthetic_jpeg
+
+    results = {"model": model.get_model_version(), "decode": {}, "transform": {}, "forward": {}}
+    for name, (width, height) in {"1280x960": (1280, 960), "4032x3024": (4032, 3024)}.items():
+        payload = synthetic_jpeg(width, height)
+        results["decode"][name] = timeit(lambda: decode.decode_to_tensor(payload), repeats)
+
+    # Transform seule, sur une image déjà décodée à 224x224
+    image = Image.open(io.BytesIO(synthetic_jpeg(1280, 960))).convert("RGB").resize(decode.INPUT_SIZE)
+    legacy = transforms.Compose([transforms.ToTensor(),
+                                 transforms.Normalize(mean=decode.IMAGENET_MEAN, std=decode.IMAGENET_STD)])
+
+    def fused():
+        tensor = torch.from_numpy(decode.np.array(image)).permute(2, 0, 1).to(torch.float32)
+        return tensor.sub_(decode._MEAN_255).mul_(decode._INV_STD_255)
+
+    results["transform"]["torchvision"] = timeit(lambda: legacy(image), repeats * 5)
+    results["transform"]["fused"] = timeit(fused, repeats * 5)
+
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 224, 224)
+        timing = timeit(lambda: model.rank_classes(batch), repeats)
+        timing["images_per_s"] = round(batch_size * 1000 / timing["p50_ms"], 1)
+        results["forward"][f"b{batch_size}"] = timing
+        print(f"   🧮 batch {batch_size:>2} : {timing['p50_ms']:.1f} ms ({timing['images_per_s']} img/s)")
+    return results
+
+
+# ---------------------------
+# Entraînement : pipeline d'entrée
+# ---------------------------
+def bench_train(count, batch_size, loader_workers, compute_steps):
+    import torch
+    from torch import nn
+
+    from bench_dataset import synthetic_dataset
+    from data_loader import BatchPreprocessor, LoaderConfig, make_loader, measure_compute, measure_loader
+    from dataset_cache import MemmapImageDataset, build_cache
+
+    results = {"images": count, "loader": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        train_dir = os.path.join(tmp, "train")
+        synthetic_dataset(train_dir, count, 640, 480)
+        start = time.perf_counter()
+        dataset = MemmapImageDataset(build_cache(train_dir, os.path.join(tmp, "cache"), 224, workers=4),
+                                     normalize=False)
+        results["cache_build_s"] = round(time.perf_counter() - start, 2)
+        preprocess = BatchPreprocessor(torch.device("cpu"))
+        for workers in loader_workers:
+            config = LoaderConfig(num_workers=workers, pin_memory=False)
+            loader = make_loader(dataset, batch_size, shuffle=True, config=config)
+            results["loader"][f"workers_{workers}"] = measure_loader(loader, preprocess, epochs=2)
+            del loader
+
+    if compute_steps:
+        from backends import build_resnet18
+
+        net = build_resnet18(len(dataset.classes))
+        results["compute"] = measure_compute(
+            net, nn.CrossEntropyLoss(), torch.optim.Adam(net.parameters(), lr=0.001),
+            batch_size, torch.device("cpu"), num_classes=len(dataset.classes), steps=compute_steps,
+        )
+    return results
+
+
+# ---------------------------
+# Comparaison entre deux runs
+# ---------------------------
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def higher_is_better(metric):
+    return metric.endswith(("per_s", "_rps"))
+
+
+def lower_is_better(metric):
+    return metric.endswith(("_ms", "_s")) and not higher_is_better(metric)
+
+
+def compare(baseline, current, threshold):
+    """ Métriques de latence/débit dégradées de plus de `threshold` (fraction) """
+    rows = []
+    base, cur = flatten(baseline), flatten(current)
+    for metric in sorted(set(base) & set(cur)):
+        if metric.startswith("environment.") or not (higher_is_better(metric) or lower_is_better(metric)):
+            continue
+        old, new = base[metric], cur[metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better(metric) else change
+        rows.append((metric, old, new, change, worse > threshold))
+    return rows
+
+
+def print_comparison(rows, baseline_commit):
+    print(f"\n📊 Comparaison avec {baseline_commit}")
+    print(f"{'métrique':<48}{'avant':>12}{'après':>12}{'écart':>10}")
+    for metric, old, new, change, regression in rows:
+        flag = "  ❌" if regression else ""
+        print(f"{metric:<48}{old:>12.2f}{new:>12.2f}{change * 100:>9.1f}%{flag}")
+    regressions = sum(1 for row in rows if row[4])
+    print(f"{'⚠️' if regressions else '✅'}  {regressions} régression(s)")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description="Suite de benchmarks (service + entraînement) avec sortie JSON")
+    p.add_argument("--only", nargs="+", choices=SECTIONS, default=SECTIONS)
+    p.add_argument("--model", choices=["random", "dummy"], default="random",
+                   help="Sans --weights : ResNet18 à poids aléatoires ou DummyModel")
+    p.add_argument("--weights", help="state_dict local servi par app/model.py")
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    p.add_argument("--repeats", type=int, default=10)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--duration", type=float, default=10.0, help="Secondes par palier de charge")
+    p.add_argument("--train-images", type=int, default=256)
+    p.add_argument("--loader-workers", type=int, nargs="+", default=[0, 2])
+    p.add_argument("--compute-steps", type=int, default=3, help="Pas d'entraînement mesurés (0 = ignoré)")
+    p.add_argument("--quick", action="store_true", help="Moins de répétitions et des paliers courts")
+    p.add_argument("--output", help="Fichier JSON (défaut : benchmarks/results/<date>_<commit>.json)")
+    p.add_argument("--compare", help="JSON d'un run précédent à comparer")
+    p.add_argument("--threshold", type=float, default=0.10, help="Dégradation tolérée (0.10 = 10 %%)")
+    p.add_argument("--fail-on-regression", action="store_true", help="Code de sortie 1 en cas de régression")
+    args = p.parse_args()
+
+    if args.quick:
+        args.repeats, args.duration = 3, 3.0
+        args.batch_sizes = [b for b in args.batch_sizes if b <= 16]
+
+    # Avant tout import de app/model.py : API hors ligne, sans cache ni rechargement
+    serving_env(args.model, args.weights)
+    results = {"environment": environment(), "config": vars(args).copy()}
+
+    if "micro" in args.only:
+        print("⏱️  Microbenchmarks (décodage, transform, passe avant)...")
+        results["micro"] = bench_micro(args.batch_sizes, args.repeats)
+    if "load" in args.only:
+        print("⏱️  Charge asynchrone sur /predict...")
+        results["load"] = asyncio.run(run_load(args.concurrency, synthetic_payloads(16), args.duration))
+        for level in results["load"]:
+            print(f"   🚦 concurrence {level['concurrency']:>2} : {level['throughput_rps']} req/s, "
+                  f"p50 {level['p50_ms']} ms, p99 {level['p99_ms']} ms")
+    if "train" in args.only:
+        print("⏱️  Pipeline d'entrée de l'entraînement...")
+        results["train"] = bench_train(args.train_images, 16, args.loader_workers, args.compute_steps)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{time.strftime('%Y%m%d_%H%M%S')}_{results['environment']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📝 Résultats : {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ("model", "weights"):
+            if baseline.get("config", {}).get(key) != results["config"][key]:
+                print(f"⚠️ --{key} différent du run de référence : comparaison non significative")
+        rows = compare(baseline, results, args.threshold)
+        regressions = print_comparison(rows, baseline.get("environment", {}).get("commit", args.compare))
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
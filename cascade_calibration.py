@@ -0,0 +1,118 @@
+# ===============================================
+# Module : cascade_calibration.py
+# Objectif : Seuil de confiance de la cascade (petit modèle → ResNet18)
+#            choisi par train_model.py sur un split de calibration
+#            qu'aucun des deux modèles n'a vu à l'entraînement
+# ===============================================
+
+import json
+import re
+import zlib
+
+import torch
+
+from mixed_precision import autocast
+
+# Modèles ResNet18 servis par l'API (model_v1_{timestamp}.pt), référence de la cascade
+REFERENCE_PATTERN = re.compile(r"^model_v\d+_(\d+)\.pt$")
+
+
+def latest_reference_model(minio_client, bucket):
+    """ Nom du ResNet18 le plus récent du bucket des modèles, None s'il n'y en a pas """
+    names = [obj.object_name for obj in minio_client.list_objects(bucket) if REFERENCE_PATTERN.match(obj.object_name)]
+    return max(names, key=lambda name: int(REFERENCE_PATTERN.match(name).group(1)), default=None)
+
+
+def reference_metadata(minio_client, bucket, name):
+    """ Métadonnées du modèle servi (.meta.json à côté du .pt), {} pour les modèles sans métadonnées """
+    try:
+        response = minio_client.get_object(bucket, name[:-len(".pt")] + ".meta.json")
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return {}
+
+
+def reference_architecture(minio_client, bucket, name):
+    """ Architecture du modèle servi, resnet18 pour les modèles sans métadonnées """
+    return reference_metadata(minio_client, bucket, name).get("architecture", "resnet18")
+
+
+def is_calibration_file(relative_path, percent):
+    """
+    Appartenance au split de calibration : hash stable du chemin relatif (label/fichier),
+    indépendant de la graine et de la taille du dataset. Le split à `percent` % contient
+    celui à tout pourcentage inférieur.
+    """
+    return zlib.crc32(relative_path.replace("\\", "/").encode()) % 100 < percent
+
+
+def calibration_split(files, percent):
+    """ (indices de calibration, indices restants) d'une liste de chemins relatifs """
+    calibration, rest = [], []
+    for idx, relative_path in enumerate(files):
+        (calibration if is_calibration_file(relative_path, percent) else rest).append(idx)
+    return calibration, rest
+
+
+def reference_held_out(metadata, percent):
+    """ True si le modèle de référence a été entraîné sans voir le split de calibration à `percent` % """
+    split = metadata.get("split") or {}
+    return split.get("calibration") == "crc32" and split.get("calibration_percent", 0) >= percent > 0
+
+
+def predict_confidences(model, loader, preprocess, device, precision="fp32"):
+    """ Confiance top-1, prédiction et label de chaque image d'un loader """
+    confidences, predictions, targets = [], [], []
+    model.eval()
+    with torch.no_grad():
+        for images, labels in loader:
+            images, labels = preprocess(images, labels)
+            with autocast(device, precision):
+                outputs = model(images)
+            conf, pred = torch.softmax(outputs.float(), dim=1).max(dim=1)
+            confidences.append(conf.cpu())
+            predictions.append(pred.cpu())
+            targets.append(labels.cpu())
+    if not targets:
+        empty = torch.empty(0)
+        return empty, empty.long(), empty.long()
+    return torch.cat(confidences), torch.cat(predictions), torch.cat(targets)
+
+
+def tune_threshold(confidences, fast_correct, full_correct, target_accuracy):
+    """
+    Seuil le plus bas (le moins d'images escaladées) pour lequel la cascade atteint `target_accuracy` (%) :
+    le petit modèle répond quand sa confiance est >= seuil, le modèle complet sinon.
+    Si la cible est hors d'atteinte, toutes les images sont escaladées.
+    """
+    n = len(confidences)
+    if n == 0:
+        raise ValueError("Validation vide : impossible de calibrer la cascade")
+    order = torch.argsort(confidences, descending=True)
+    sorted_conf = confidences[order]
+    fast_hits = fast_correct[order].float()
+    full_hits = full_correct[order].float()
+    # k premières images (les plus confiantes) au petit modèle, le reste au modèle complet
+    fast_prefix = torch.cat([torch.zeros(1), fast_hits.cumsum(0)])
+    full_prefix = torch.cat([torch.zeros(1), full_hits.cumsum(0)])
+    accuracy = 100 * (fast_prefix + full_hits.sum() - full_prefix) / n
+    # Un seuil ne sépare que des confiances différentes : k valide si la k-ième et la (k+1)-ième diffèrent
+    valid = torch.ones(n + 1, dtype=torch.bool)
+    valid[1:n] = sorted_conf[:-1] > sorted_conf[1:]
+    candidates = (valid & (accuracy >= target_accuracy)).nonzero().flatten()
+    k = int(candidates.max()) if len(candidates) else 0
+    # k = 0 : seuil au-dessus de toute confiance possible, tout est escaladé
+    threshold = float(sorted_conf[k - 1]) if k > 0 else 1.01
+    return {
+        "threshold": threshold,
+        "target_accuracy": target_accuracy,
+        "accuracy": float(accuracy[k]),
+        "escalation_rate": 1 - k / n,
+        "fast_accuracy": 100 * float(fast_hits.mean()),
+        "full_accuracy": 100 * float(full_hits.mean()),
+        "reached": bool(len(candidates)),
+    }
@@ -0,0 +1,174 @@
+# ===============================================
+# Module : checkpointing.py
+# Objectif : Checkpoints complets sur MinIO (reprise après crash/préemption),
+#            early stopping et budget de temps pour train_model.py
+# ===============================================
+
+import os
+import random
+import re
+import time
+
+import numpy as np
+import torch
+
+CHECKPOINT_PATTERN = re.compile(r"epoch_(\d+)\.pt$")
+
+
+def capture_rng_state():
+    """ États des générateurs aléatoires (mélange des données, augmentations, dropout) """
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class CheckpointStore:
+    """
+    Checkpoints `<prefix>epoch_XXXX.pt` écrits localement (écriture atomique) puis
+    envoyés sur MinIO ; seuls les `keep` plus récents sont conservés.
+    Une erreur MinIO n'interrompt jamais l'entraînement : le checkpoint reste en local.
+    """
+
+    def __init__(self, minio_client, bucket, prefix, local_dir, keep=2):
+        self.minio_client = minio_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_dir = local_dir
+        self.keep = max(keep, 1)
+        os.makedirs(local_dir, exist_ok=True)
+
+    def _object_name(self, epoch):
+        return f"{self.prefix}epoch_{epoch:04d}.pt"
+
+    def _local_path(self, object_name):
+        return os.path.join(self.local_dir, os.path.basename(object_name))
+
+    def _remote_checkpoints(self):
+        """ {epoch: nom d'objet} des checkpoints présents sur MinIO """
+        found = {}
+        for obj in self.minio_client.list_objects(self.bucket, prefix=self.prefix, recursive=True):
+            match = CHECKPOINT_PATTERN.search(obj.object_name)
+            if match:
+                found[int(match.group(1))] = obj.object_name
+        return found
+
+    def save(self, state, epoch):
+        object_name = self._object_name(epoch)
+        local_path = self._local_path(object_name)
+        start = time.perf_counter()
+        torch.save(state, local_path + ".part")
+        os.replace(local_path + ".part", local_path)
+        try:
+            self.minio_client.fput_object(self.bucket, object_name, local_path)
+            self._prune()
+            print(f"   💾 Checkpoint epoch {epoch + 1} → {self.bucket}/{object_name} "
+                  f"({time.perf_counter() - start:.1f}s)")
+        except Exception as e:
+            print(f"   ⚠️  Checkpoint gardé en local uniquement ({local_path}) : {e}")
+
+    def _prune(self):
+        remote = self._remote_checkpoints()
+        for epoch in sorted(remote)[:-self.keep]:
+            self.minio_client.remove_object(self.bucket, remote[epoch])
+            local_path = self._local_path(remote[epoch])
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    def latest(self):
+        """ Chemin local du checkpoint le plus récent (téléchargé si besoin), ou None """
+        try:
+            remote = self._remote_checkpoints()
+        except Exception as e:
+            print(f"⚠️  Liste des checkpoints MinIO impossible : {e}")
+            remote = {}
+        local = {
+            int(match.group(1)): name
+            for name in os.listdir(self.local_dir)
+            if (match := CHECKPOINT_PATTERN.search(name))
+        }
+        epochs = sorted(set(remote) | set(local))
+        if not epochs:
+            return None
+        epoch = epochs[-1]
+        if epoch in remote:
+            local_path = self._local_path(remote[epoch])
+            if not os.path.exists(local_path):
+                self.minio_client.fget_object(self.bucket, remote[epoch], local_path)
+            return local_path
+        return os.path.join(self.local_dir, local[epoch])
+
+    def clear(self):
+        """ Supprime les checkpoints une fois l'entraînement terminé (le prochain repart de zéro) """
+        try:
+            for object_name in self._remote_checkpoints().values():
+                self.minio_client.remove_object(self.bucket, object_name)
+        except Exception as e:
+            print(f"⚠️  Suppression des checkpoints MinIO impossible : {e}")
+        for name in os.listdir(self.local_dir):
+            if CHECKPOINT_PATTERN.search(name):
+                os.remove(os.path.join(self.local_dir, name))
+
+
+class EarlyStopping:
+    """ Arrêt quand la métrique surveillée (val_accuracy) ne progresse plus de `min_delta` pendant `patience` epochs """
+
+    def __init__(self, patience=5, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = None
+        self.bad_epochs = 0
+
+    @property
+    def enabled(self):
+        return self.patience > 0
+
+    def update(self, value):
+        """ Enregistre la valeur de l'epoch ; renvoie True si elle améliore le meilleur score """
+        if self.best is None or value > self.best + self.min_delta:
+            self.best = value
+            self.bad_epochs = 0
+            return True
+        self.bad_epochs += 1
+        return False
+
+    @property
+    def should_stop(self):
+        return self.enabled and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {"best": self.best, "bad_epochs": self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best = state["best"]
+        self.bad_epochs = state["bad_epochs"]
+
+
+class TimeBudget:
+    """ Budget de temps réel (0 = illimité) : n'entame pas une epoch qui le dépasserait """
+
+    def __init__(self, budget_s, start=None):
+        self.budget_s = budget_s
+        self.start = time.monotonic() if start is None else start
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def allows_epoch(self, epoch_times):
+        if self.budget_s <= 0 or not epoch_times:
+            return True
+        recent = epoch_times[-3:]
+        return self.elapsed + sum(recent) / len(recent) <= self.budget_s
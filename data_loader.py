@@ -0,0 +1,147 @@
+# ===============================================
+# Module : data_loader.py
+# Objectif : Pipeline d'entrée configurable pour l'entraînement
+#            (workers, pin_memory, prefetch, normalisation par batch)
+#            + mesure du débit du chargement seul
+# ===============================================
+
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from dataset_cache import IMAGENET_MEAN, IMAGENET_STD
+
+
+def _env_bool(name, default):
+    value = os.getenv(name, default).lower()
+    if value == "auto":
+        return None
+    return value in ("1", "true", "yes")
+
+
+class LoaderConfig:
+    """
+    Paramètres du DataLoader, lus depuis l'environnement :
+
+    - LOADER_WORKERS      : process de chargement (0 = dans le process d'entraînement)
+    - PIN_MEMORY          : mémoire épinglée pour les copies vers le GPU ("auto" = si CUDA)
+    - PERSISTENT_WORKERS  : garde les workers vivants d'une epoch à l'autre
+    - PREFETCH_FACTOR     : batchs préparés à l'avance par worker
+    - BATCH_NORMALIZE     : le dataset renvoie de l'uint8, la conversion float + normalisation
+                            est faite une fois par batch (au lieu d'une fois par image)
+    - AUGMENT_FLIP        : flip horizontal aléatoire appliqué au batch (train uniquement)
+    """
+
+    def __init__(self, num_workers=None, pin_memory=None, persistent_workers=None,
+                 prefetch_factor=None, batch_normalize=None, augment_flip=None):
+        # En mode distribué, les cœurs sont partagés entre les process locaux
+        local_processes = int(os.getenv("LOCAL_WORLD_SIZE", "1"))
+        default_workers = str(min(4, max(1, (os.cpu_count() or 1) // local_processes)))
+        self.num_workers = int(os.getenv("LOADER_WORKERS", default_workers)) if num_workers is None else num_workers
+        if pin_memory is None:
+            pin_memory = _env_bool("PIN_MEMORY", "auto")
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.persistent_workers = (_env_bool("PERSISTENT_WORKERS", "1")
+                                   if persistent_workers is None else persistent_workers)
+        self.prefetch_factor = (int(os.getenv("PREFETCH_FACTOR", "2"))
+                                if prefetch_factor is None else prefetch_factor)
+        self.batch_normalize = _env_bool("BATCH_NORMALIZE", "1") if batch_normalize is None else batch_normalize
+        self.augment_flip = _env_bool("AUGMENT_FLIP", "0") if augment_flip is None else augment_flip
+
+    def as_params(self):
+        """ Paramètres à logger dans MLflow """
+        return {
+            "loader_workers": self.num_workers,
+            "pin_memory": self.pin_memory,
+            "persistent_workers": self.persistent_workers,
+            "prefetch_factor": self.prefetch_factor,
+            "batch_normalize": self.batch_normalize,
+            "augment_flip": self.augment_flip,
+        }
+
+
+def make_loader(dataset, batch_size, shuffle, config: LoaderConfig, sampler=None):
+    """ DataLoader construit selon la configuration (les options multi-process exigent num_workers > 0) """
+    kwargs = {}
+    if config.num_workers > 0:
+        kwargs["persistent_workers"] = config.persistent_workers
+        kwargs["prefetch_factor"] = config.prefetch_factor
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle if sampler is None else False,
+        sampler=sampler,
+        num_workers=config.num_workers,
+        pin_memory=config.pin_memory,
+        **kwargs,
+    )
+
+
+class BatchPreprocessor:
+    """
+    Transfert vers le device puis conversion uint8 → float32 normalisé d'un batch
+    entier (N, 3, H, W), en place : une seule allocation par batch.
+    Les batchs déjà en float (BATCH_NORMALIZE=0) sont seulement transférés.
+    Avec `channels_last`, le batch est rendu au format NHWC attendu par le modèle.
+    """
+
+    def __init__(self, device, augment_flip=False, channels_last=False):
+        self.device = device
+        self.augment_flip = augment_flip
+        self.channels_last = channels_last
+        self.mean = torch.tensor(IMAGENET_MEAN, device=device).mul(255).view(1, 3, 1, 1)
+        self.inv_std = torch.tensor(IMAGENET_STD, device=device).mul(255).reciprocal().view(1, 3, 1, 1)
+
+    def __call__(self, images, labels, train=False):
+        non_blocking = images.is_pinned()
+        images = images.to(self.device, non_blocking=non_blocking)
+        labels = labels.to(self.device, non_blocking=non_blocking)
+        if images.dtype == torch.uint8:
+            images = images.float().sub_(self.mean).mul_(self.inv_std)
+        if train and self.augment_flip:
+            flip = torch.rand(images.size(0), device=images.device) < 0.5
+            images[flip] = images[flip].flip(-1)
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return images, labels
+
+
+def measure_loader(loader, preprocess=None, epochs=2, max_batches=None):
+    """
+    Débit du pipeline d'entrée seul (aucun calcul de modèle), en échantillons/s.
+    La première epoch inclut le démarrage des workers ; la meilleure est retenue.
+    """
+    results = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        samples = 0
+        for i, (images, labels) in enumerate(loader):
+            if preprocess is not None:
+                images, labels = preprocess(images, labels, train=True)
+            samples += labels.size(0)
+            if max_batches is not None and i + 1 >= max_batches:
+                break
+        elapsed = time.perf_counter() - start
+        results.append({"samples": samples, "seconds": round(elapsed, 3),
+                        "samples_per_s": round(samples / elapsed, 1) if elapsed > 0 else 0.0})
+    return max(results, key=lambda r: r["samples_per_s"])
+
+
+def measure_compute(model, criterion, optimizer, batch_size, device, img_size=224, num_classes=2, steps=10):
+    """ Débit d'entraînement du modèle seul, sur un batch synthétique déjà en mémoire """
+    images = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+    model.train()
+    for step in range(steps + 2):
+        if step == 2:  # 2 itérations de chauffe
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        criterion(model(images), labels).backward()
+        optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return {"samples": steps * batch_size, "seconds": round(elapsed, 3),
+            "samples_per_s": round(steps * batch_size / elapsed, 1)}
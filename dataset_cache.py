@@ -0,0 +1,207 @@
+# ===============================================
+# Module : dataset_cache.py
+# Objectif : Cache prétraité (uint8, taille fixe) des images d'entraînement
+#            dans un fichier memory-mappé + Dataset PyTorch associé
+#            (utilisé par train_model.py)
+# ===============================================
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from dataset_download import MANIFEST_NAME, load_manifest
+
+# Même extensions que torchvision.datasets.ImageFolder
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".ppm", ".bmp", ".pgm", ".tif", ".tiff", ".webp")
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# À incrémenter si le format du cache ou le prétraitement change
+CACHE_FORMAT_VERSION = 1
+
+
+def scan_image_folder(root):
+    """Classes et échantillons (chemin, label) dans le même ordre qu'ImageFolder"""
+    classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    samples = []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(root, class_name)
+        for dirpath, _, filenames in sorted(os.walk(class_dir, followlinks=True)):
+            for file_name in sorted(filenames):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(dirpath, file_name), label))
+    return classes, samples
+
+
+def cache_key(root, samples, img_size, resample="bilinear", draft=True):
+    """
+    Empreinte des entrées du cache : manifeste de téléchargement (ETag/taille)
+    des fichiers utilisés + paramètres de prétraitement (dont le mode draft JPEG).
+    Un fichier absent du manifeste (dataset local) est identifié par sa taille et sa date de modification.
+    """
+    manifest = load_manifest(os.path.join(root, MANIFEST_NAME))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([CACHE_FORMAT_VERSION, img_size, resample, draft]).encode())
+    for path, label in samples:
+        rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+        entry = manifest.get(f"train/{rel_path}")
+        if entry is not None:
+            fingerprint = f"{entry['etag']}:{entry['size']}"
+        else:
+            stat = os.stat(path)
+            fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+        digest.update(f"{rel_path}|{label}|{fingerprint}\n".encode())
+    return digest.hexdigest()
+
+
+def load_rgb(path, img_size=224, draft=True):
+    """
+    Image RGB, décodée comme par l'API (app/decode.py, DECODE_DRAFT) : avec `draft`, libjpeg décode
+    directement à l'échelle 1/2, 1/4 ou 1/8 la plus proche de `img_size` (jamais en dessous).
+    Loader d'ImageFolder sans cache (functools.partial) : même entrée du Resize que le cache.
+    """
+    with Image.open(path) as image:
+        if draft:
+            image.draft("RGB", (img_size, img_size))
+        return image.convert("RGB")
+
+
+def _decode(path, img_size, draft=True):
+    # load_rgb puis Resize bilinéaire, comme le chemin ImageFolder
+    image = load_rgb(path, img_size, draft)
+    if image.size != (img_size, img_size):
+        image = image.resize((img_size, img_size), Image.BILINEAR)
+    return np.asarray(image)
+
+
+def build_cache(root, cache_dir, img_size=224, workers=8, draft=True):
+    """
+    Décode une fois toutes les images de `root` vers `cache_dir/<clé>.u8`
+    (tableau memmap N x H x W x 3 uint8) + `<clé>.json` (classes, labels, fichiers).
+    Ne reconstruit que si la clé (manifeste + paramètres, dont `draft`) a changé.
+    Renvoie le chemin du sidecar JSON.
+    """
+    classes, samples = scan_image_folder(root)
+    key = cache_key(root, samples, img_size, draft=draft)
+    data_path = os.path.join(cache_dir, f"{key}.u8")
+    index_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(index_path) and os.path.exists(data_path):
+        print(f"♻️  Cache du dataset à jour : {index_path}")
+        return index_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    shape = (len(samples), img_size, img_size, 3)
+    tmp_path = data_path + ".part"
+    start = time.perf_counter()
+    print(f"🧱 Construction du cache du dataset ({len(samples)} images, {img_size}x{img_size})...")
+
+    array = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=shape) if samples else None
+    valid = []
+
+    def task(row):
+        path, _ = samples[row]
+        array[row] = _decode(path, img_size, draft)
+        return row
+
+    # PIL relâche le GIL pendant le décodage et le redimensionnement : des threads suffisent
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {row: pool.submit(task, row) for row in range(len(samples))}
+        for row, future in tqdm(futures.items(), desc="Preprocessing images", unit="img"):
+            try:
+                future.result()
+                valid.append(row)
+            except Exception as e:
+                print(f"⚠️  Image illisible ignorée : {samples[row][0]} ({e})")
+
+    if array is not None:
+        array.flush()
+        del array
+    else:
+        open(tmp_path, "wb").close()
+    os.replace(tmp_path, data_path)
+
+    index = {
+        "version": CACHE_FORMAT_VERSION,
+        "key": key,
+        "data_file": os.path.basename(data_path),
+        "shape": list(shape),
+        "draft": draft,
+        "classes": classes,
+        "rows": valid,
+        "labels": [samples[row][1] for row in valid],
+        "files": [os.path.relpath(samples[row][0], root) for row in valid],
+    }
+    # Le sidecar est écrit en dernier : sa présence garantit un cache complet
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+    _remove_stale(cache_dir, keep=key)
+
+    elapsed = time.perf_counter() - start
+    size_mb = os.path.getsize(data_path) / 1e6
+    print(f"✅ Cache construit en {elapsed:.1f}s ({size_mb:.0f} MB) : {data_path}")
+    return index_path
+
+
+def _remove_stale(cache_dir, keep):
+    """Supprime les caches d'anciennes versions du dataset"""
+    for name in os.listdir(cache_dir):
+        stem = name.split(".", 1)[0]
+        if stem != keep and (name.endswith(".u8") or name.endswith(".json")):
+            os.remove(os.path.join(cache_dir, name))
+
+
+class MemmapImageDataset(Dataset):
+    """
+    Dataset lu depuis le cache memory-mappé : chaque échantillon est une
+    tranche du fichier, sans décodage JPEG ni redimensionnement.
+
+    Le fichier est ouvert paresseusement (une fois par process de DataLoader)
+    en copy-on-write : `torch.from_numpy` ne copie pas la tranche, seule la
+    conversion en float32 normalisé alloue un nouveau tenseur.
+    Expose `classes` et `targets` comme ImageFolder.
+    """
+
+    def __init__(self, index_path, normalize=True):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        self.data_path = os.path.join(os.path.dirname(index_path), index["data_file"])
+        self.shape = tuple(index["shape"])
+        self.classes = index["classes"]
+        self.rows = index["rows"]
+        self.targets = index["labels"]
+        self.files = index["files"]
+        self.normalize = normalize
+        self._array = None
+        self._mean = torch.tensor(IMAGENET_MEAN).mul(255).view(3, 1, 1)
+        self._inv_std = torch.tensor(IMAGENET_STD).mul(255).reciprocal().view(3, 1, 1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getstate__(self):
+        # Le memmap n'est pas transmis aux workers : chacun rouvre le fichier
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    def _data(self):
+        if self._array is None:
+            self._array = np.memmap(self.data_path, dtype=np.uint8, mode="c", shape=self.shape)
+        return self._array
+
+    def __getitem__(self, idx):
+        pixels = torch.from_numpy(self._data()[self.rows[idx]])  # (H, W, 3) uint8, vue sans copie
+        image = pixels.permute(2, 0, 1)
+        if self.normalize:
+            image = image.to(torch.float32, memory_format=torch.contiguous_format)
+            image = image.sub_(self._mean).mul_(self._inv_std)
+        return image, self.targets[idx]
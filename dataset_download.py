@@ -0,0 +1,167 @@
+# ===============================================
+# Module : dataset_download.py
+# Objectif : Téléchargement concurrent et reprenable des images MinIO
+#            (utilisé par train_model.py)
+# ===============================================
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def load_manifest(path):
+    """Manifeste local : clé MinIO → {etag, size} des fichiers déjà téléchargés et vérifiés"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️  Manifeste illisible ({path}), tout sera re-vérifié")
+        return {}
+
+
+def save_manifest(manifest, path):
+    """Écriture atomique du manifeste (jamais de fichier à moitié écrit)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def list_remote_objects(minio_client, bucket, prefix):
+    """ETag et taille de tous les objets d'un préfixe, en un seul listing paginé"""
+    return {
+        obj.object_name: {"etag": obj.etag, "size": obj.size}
+        for obj in minio_client.list_objects(bucket, prefix=prefix, recursive=True)
+        if not obj.is_dir
+    }
+
+
+def is_up_to_date(local_path, remote, entry):
+    """Le fichier local correspond-il à l'objet distant (même ETag, taille complète) ?"""
+    return (
+        entry is not None
+        and entry.get("etag") == remote["etag"]
+        and os.path.exists(local_path)
+        and os.path.getsize(local_path) == remote["size"]
+    )
+
+
+def download_with_retry(minio_client, bucket, key, local_path, expected, retries, backoff):
+    """
+    Télécharge un objet dans un fichier temporaire puis le renomme.
+    Réessaie avec un backoff exponentiel (+ jitter) ; vérifie la taille obtenue.
+    """
+    tmp_path = local_path + ".part"
+    for attempt in range(retries + 1):
+        try:
+            minio_client.fget_object(bucket, key, tmp_path)
+            size = os.path.getsize(tmp_path)
+            if size != expected["size"]:
+                raise IOError(f"taille {size} au lieu de {expected['size']}")
+            os.replace(tmp_path, local_path)
+            return size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+
+def sync_objects(minio_client, bucket, items, dest_dir, prefix="", workers=8, retries=3,
+                 backoff=0.5, manifest_path=None, checkpoint_every=200):
+    """
+    Synchronise une liste d'objets MinIO vers un dossier local.
+
+    `items` : liste de (clé MinIO, chemin local). Seuls les objets absents,
+    incomplets ou modifiés (ETag/taille) sont téléchargés, en parallèle.
+    Le manifeste est sauvegardé régulièrement : une reprise après crash ne
+    refait que ce qui manque. Renvoie un dict de statistiques (dont MB/s).
+    """
+    manifest_path = manifest_path or os.path.join(dest_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    remote_objects = list_remote_objects(minio_client, bucket, prefix)
+
+    to_download, missing_remote = [], []
+    for key, local_path in items:
+        remote = remote_objects.get(key)
+        if remote is None:
+            missing_remote.append(key)
+        elif not is_up_to_date(local_path, remote, manifest.get(key)):
+            to_download.append((key, local_path, remote))
+
+    stats = {
+        "total": len(items),
+        "up_to_date": len(items) - len(to_download) - len(missing_remote),
+        "downloaded": 0,
+        "failed": 0,
+        "missing": len(missing_remote),
+        "bytes": 0,
+    }
+    for key in missing_remote[:10]:
+        print(f"⚠️  Objet absent de MinIO : {key}")
+    print(f"🔎 {stats['up_to_date']} images à jour, {len(to_download)} à télécharger ({workers} workers)")
+
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def task(key, local_path, remote):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        return download_with_retry(minio_client, bucket, key, local_path, remote, retries, backoff)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(task, key, path, remote): (key, remote) for key, path, remote in to_download}
+        with tqdm(total=len(futures), desc="Downloading images", unit="img") as progress:
+            for future in as_completed(futures):
+                key, remote = futures[future]
+                try:
+                    size = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"⚠️  Erreur pour {key}: {e}")
+                else:
+                    with lock:
+                        manifest[key] = {"etag": remote["etag"], "size": remote["size"]}
+                        stats["downloaded"] += 1
+                        stats["bytes"] += size
+                        if stats["downloaded"] % checkpoint_every == 0:
+                            save_manifest(manifest, manifest_path)
+                elapsed = time.perf_counter() - start
+                progress.set_postfix(MBps=f"{stats['bytes'] / 1e6 / max(elapsed, 1e-6):.1f}")
+                progress.update(1)
+
+    save_manifest(manifest, manifest_path)
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["mb_per_s"] = round(stats["bytes"] / 1e6 / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def prune_local_files(dest_dir, keep_paths):
+    """
+    Supprime les images locales qui ne font plus partie du dataset (retirées de MinIO,
+    écartées comme invalides ou doublons) : ImageFolder et le cache ne les verraient sinon jamais partir.
+    """
+    keep = {os.path.abspath(path) for path in keep_paths}
+    removed = 0
+    for dirpath, _, filenames in os.walk(dest_dir, topdown=False):
+        for file_name in filenames:
+            if file_name.startswith(MANIFEST_NAME) or file_name.endswith(".part"):
+                continue
+            path = os.path.abspath(os.path.join(dirpath, file_name))
+            if path not in keep:
+                os.remove(path)
+                removed += 1
+        # Une classe vidée ne doit pas rester visible pour ImageFolder
+        if os.path.abspath(dirpath) != os.path.abspath(dest_dir) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
@@ -0,0 +1,131 @@
+# ===============================================
+# Module : distributed_training.py
+# Objectif : Entraînement data-parallel multi-process sur CPU
+#            (torch.distributed, backend gloo) pour train_model.py
+# ===============================================
+#
+# Lancement (N process locaux, chacun voit 1/N des données) :
+#   torchrun --standalone --nproc_per_node=4 train_model.py
+#
+# Sans torchrun (variables RANK/WORLD_SIZE absentes), tout fonctionne en mono-process.
+
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+
+DIST_TIMEOUT_MIN = int(os.getenv("DIST_TIMEOUT_MIN", "60"))
+
+
+class DistInfo:
+    """ Position du process courant dans le groupe (rank 0 = process principal) """
+
+    def __init__(self, rank=0, world_size=1, local_rank=0, local_world_size=1):
+        self.rank = rank
+        self.world_size = world_size
+        self.local_rank = local_rank
+        self.local_world_size = local_world_size
+
+    @property
+    def enabled(self):
+        return self.world_size > 1
+
+    @property
+    def is_main(self):
+        return self.rank == 0
+
+
+def available_cpus():
+    """ Cœurs réellement utilisables (affinité CPU / limites du conteneur) """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def configure_threads(local_world_size, threads=None):
+    """
+    Répartit les cœurs entre les process locaux : sans cela chaque process
+    lance autant de threads OpenMP que de cœurs et ils se concurrencent
+    (sur-souscription), ce qui casse la mise à l'échelle.
+    TRAIN_THREADS force le nombre de threads intra-op par process.
+    """
+    if threads is None:
+        threads = int(os.getenv("TRAIN_THREADS", "0")) or max(1, available_cpus() // local_world_size)
+    torch.set_num_threads(threads)
+    try:
+        # Les opérateurs d'un pas d'entraînement sont séquentiels : 1 thread inter-op suffit
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # déjà fixé (ne peut l'être qu'une fois par process)
+    return threads
+
+
+def init_distributed():
+    """ Initialise le groupe gloo si le script est lancé par torchrun, sinon mode mono-process """
+    world_size = int(os.getenv("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return DistInfo()
+    info = DistInfo(
+        rank=int(os.environ["RANK"]),
+        world_size=world_size,
+        local_rank=int(os.getenv("LOCAL_RANK", "0")),
+        local_world_size=int(os.getenv("LOCAL_WORLD_SIZE", str(world_size))),
+    )
+    dist.init_process_group("gloo", rank=info.rank, world_size=info.world_size,
+                            timeout=timedelta(minutes=DIST_TIMEOUT_MIN))
+    return info
+
+
+def barrier(info):
+    if info.enabled:
+        dist.barrier()
+
+
+def broadcast_object(info, obj):
+    """ Valeur du rank 0 transmise à tous les process (ex: chemin du cache du dataset) """
+    if not info.enabled:
+        return obj
+    holder = [obj]
+    dist.broadcast_object_list(holder, src=0)
+    return holder[0]
+
+
+def all_reduce_sum(info, *values):
+    """ Somme de scalaires sur tous les process (pertes, nombre de bonnes prédictions...) """
+    if not info.enabled:
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tuple(tensor.tolist())
+
+
+def wrap_model(info, model):
+    """ DistributedDataParallel sur CPU : les gradients sont moyennés par all-reduce pendant backward() """
+    if not info.enabled:
+        return model
+    from torch.nn.parallel import DistributedDataParallel
+
+    return DistributedDataParallel(model)
+
+
+def shard_indices(info, length):
+    """ Indices d'évaluation du process courant (partition exacte, sans doublons) """
+    return list(range(info.rank, length, info.world_size))
+
+
+@contextmanager
+def main_process_first(info):
+    """ Le rank 0 exécute le bloc (téléchargement, cache...) pendant que les autres attendent """
+    if not info.is_main:
+        barrier(info)
+    yield
+    if info.is_main:
+        barrier(info)
+
+
+def cleanup(info):
+    if info.enabled and dist.is_initialized():
+        dist.destroy_process_group()
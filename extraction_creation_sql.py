@@ -2,9 +2,14 @@
 # Script : generate_fish_data_table.py
 # Objectif : Créer automatiquement une table SQL "fish_data"
 #            à partir des images stockées sur MinIO
+#            (synchronisation incrémentale, insertions par lots)
 # Auteur : Mathieu + Kirsten
 # ===============================================
 
+import argparse
+import os
+import time
+
 import pymysql
 from minio import Minio
 from urllib.parse import urljoin
@@ -13,104 +18,237 @@ from urllib.parse import urljoin
 # ---------------------------------------
 
 # MinIO configuration
-MINIO_ENDPOINT = "minio:9000"   # ⚠️ utilise le nom du conteneur dans Docker, pas localhost
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")   # ⚠️ nom du conteneur dans Docker, localhost:9000 en local
 MINIO_ACCESS_KEY = "admin-user"
 MINIO_SECRET_KEY = "admin-password"
 BUCKET_NAME = "dataset-fish"
 
 # MySQL configuration
-MYSQL_HOST = "mysql"  # ⚠️ idem, nom du conteneur Docker
+MYSQL_HOST = os.getenv("MYSQL_HOST", "mysql")  # ⚠️ idem, nom du conteneur Docker
 MYSQL_USER = "root"
 MYSQL_PASSWORD = "root"
 MYSQL_DB = "mlops"
 
-# === 2. Connexion à MinIO ===
-# ----------------------------
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False  # car on est en local sans HTTPS
-)
-
-# Vérification du bucket
-if not minio_client.bucket_exists(BUCKET_NAME):
-    raise ValueError(f"❌ Le bucket '{BUCKET_NAME}' n’existe pas sur MinIO !")
-
-# === 3. Connexion MySQL ===
-# --------------------------
-conn = pymysql.connect(
-    host=MYSQL_HOST,
-    user=MYSQL_USER,
-    password=MYSQL_PASSWORD,
-    database=MYSQL_DB
-)
-cursor = conn.cursor()
-
-# === 4. Création de la table fish_data ===
-# -----------------------------------------
-create_table_query = """
+# Synchronisation : "incremental" (diff MinIO ↔ table) ou "full" (réécriture complète)
+SYNC_MODE = os.getenv("SYNC_MODE", "incremental")
+# Lignes par requête INSERT multi-lignes / DELETE ... IN (...)
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "1000"))
+
+# On ne garde que train et test
+SPLITS = ["train", "test"]
+
+# Clé naturelle d'une image : un seul enregistrement par (split, espèce, fichier).
+# L'index unique sert aussi les requêtes `WHERE split = ...` (préfixe de l'index)
+UNIQUE_KEY_NAME = "uq_fish_split_label_file"
+
+create_table_query = f"""
 CREATE TABLE IF NOT EXISTS fish_data (
     id INT AUTO_INCREMENT PRIMARY KEY,
     species_label VARCHAR(100) NOT NULL,
     file_name VARCHAR(255) NOT NULL,
     url_s3 TEXT NOT NULL,
     split VARCHAR(10) NOT NULL,
-    insert_date DATETIME DEFAULT CURRENT_TIMESTAMP
+    insert_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY {UNIQUE_KEY_NAME} (split, species_label, file_name)
 );
 """
-cursor.execute(create_table_query)
-conn.commit()
-print("✅ Table 'fish_data' vérifiée ou créée avec succès.")
-
-# Vérifier si la colonne 'split' existe, sinon l'ajouter
-cursor.execute("SHOW COLUMNS FROM fish_data LIKE 'split'")
-if cursor.fetchone() is None:
-    print("⚙️  Ajout de la colonne 'split' à la table...")
-    cursor.execute("ALTER TABLE fish_data ADD COLUMN split VARCHAR(10) NOT NULL DEFAULT 'train'")
-    conn.commit()
-    print("✅ Colonne 'split' ajoutée.")
-
-# Nettoyer la table avant insertion (éviter les doublons)
-cursor.execute("DELETE FROM fish_data")
-conn.commit()
-print("🧹 Table nettoyée, prête pour l'insertion.")
-
-# === 5. Parcours des objets MinIO ===
-# ------------------------------------
-objects = minio_client.list_objects(BUCKET_NAME, recursive=True)
 
 insert_query = """
 INSERT INTO fish_data (species_label, file_name, url_s3, split)
 VALUES (%s, %s, %s, %s)
 """
 
-added = 0
-for obj in objects:
-    key = obj.object_name  # Ex: "train/Catfish/img_001.jpg" ou "test/Catfish/img_002.jpg"
-    parts = key.split("/")
 
+# === 2. Connexions ===
+# ---------------------
+def connect_minio():
+    minio_client = Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        secure=False  # car on est en local sans HTTPS
+    )
+    # Vérification du bucket
+    if not minio_client.bucket_exists(BUCKET_NAME):
+        raise ValueError(f"❌ Le bucket '{BUCKET_NAME}' n’existe pas sur MinIO !")
+    return minio_client
+
+
+def connect_mysql():
+    # autocommit désactivé (défaut pymysql) : chaque synchronisation est une transaction
+    return pymysql.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DB
+    )
+
+
+# === 3. Schéma de la table fish_data ===
+# ---------------------------------------
+def ensure_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute(create_table_query)
+    conn.commit()
+    print("✅ Table 'fish_data' vérifiée ou créée avec succès.")
+
+    # Vérifier si la colonne 'split' existe, sinon l'ajouter
+    cursor.execute("SHOW COLUMNS FROM fish_data LIKE 'split'")
+    if cursor.fetchone() is None:
+        print("⚙️  Ajout de la colonne 'split' à la table...")
+        cursor.execute("ALTER TABLE fish_data ADD COLUMN split VARCHAR(10) NOT NULL DEFAULT 'train'")
+        conn.commit()
+        print("✅ Colonne 'split' ajoutée.")
+
+    # Tables créées par les anciennes versions du script : dédoublonnage puis index unique
+    cursor.execute("SHOW INDEX FROM fish_data WHERE Key_name = %s", (UNIQUE_KEY_NAME,))
+    if cursor.fetchone() is None:
+        print("⚙️  Ajout de l'index unique (split, species_label, file_name)...")
+        removed = cursor.execute("""
+            DELETE newer FROM fish_data newer
+            JOIN fish_data older
+              ON newer.split = older.split
+             AND newer.species_label = older.species_label
+             AND newer.file_name = older.file_name
+             AND newer.id > older.id
+        """)
+        cursor.execute(
+            f"ALTER TABLE fish_data ADD UNIQUE KEY {UNIQUE_KEY_NAME} (split, species_label, file_name)"
+        )
+        conn.commit()
+        print(f"✅ Index unique ajouté ({removed} doublons supprimés).")
+    cursor.close()
+
+
+# === 4. Parcours des objets MinIO ===
+# ------------------------------------
+def parse_object_key(key):
+    """
+    "train/Catfish/img_001.jpg" → ("train", "Catfish", "img_001.jpg"),
+    None pour les objets hors de train/ et test/
+    """
+    parts = key.split("/")
     # On cherche les fichiers sous "train/" ou "test/"
     if len(parts) < 3:
-        continue
-    
+        return None
     split = parts[0].lower()  # "train", "test", ou "val"
-    
-    # On ne garde que train et test
-    if split not in ["train", "test"]:
-        continue
-
+    if split not in SPLITS:
+        return None
     label = parts[1]        # ex: "Catfish"
     file_name = parts[-1]   # ex: "img_001.jpg"
+    return split, label, file_name
 
+
+def object_url(key):
     # URL publique (accès via le port 9000)
-    url_s3 = urljoin(f"http://localhost:9000/{BUCKET_NAME}/", key)
+    return urljoin(f"http://localhost:9000/{BUCKET_NAME}/", key)
+
+
+def list_minio_rows(minio_client):
+    """ {(split, label, file_name): url_s3} de toutes les images du bucket """
+    rows = {}
+    for obj in minio_client.list_objects(BUCKET_NAME, recursive=True):
+        parsed = parse_object_key(obj.object_name)
+        if parsed is None:
+            continue
+        rows[parsed] = object_url(obj.object_name)
+    return rows
 
-    cursor.execute(insert_query, (label, file_name, url_s3, split))
-    added += 1
 
-conn.commit()
-cursor.close()
-conn.close()
+def fetch_existing_rows(cursor):
+    """ {(split, label, file_name): id} des lignes déjà présentes dans fish_data """
+    cursor.execute("SELECT id, split, species_label, file_name FROM fish_data")
+    return {(split, label, file_name): row_id for row_id, split, label, file_name in cursor.fetchall()}
 
-print(f"✅ Insertion terminée : {added} images ajoutées dans fish_data.")
+
+# === 5. Écriture par lots ===
+# ----------------------------
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_rows(cursor, rows, batch_size=INSERT_BATCH_SIZE):
+    """ INSERT multi-lignes : pymysql regroupe les VALUES d'un executemany en une seule requête """
+    values = [(label, file_name, url_s3, split) for (split, label, file_name), url_s3 in rows]
+    for batch in chunks(values, batch_size):
+        cursor.executemany(insert_query, batch)
+    return len(values)
+
+
+def delete_rows(cursor, row_ids, batch_size=INSERT_BATCH_SIZE):
+    for batch in chunks(row_ids, batch_size):
+        placeholders = ", ".join(["%s"] * len(batch))
+        cursor.execute(f"DELETE FROM fish_data WHERE id IN ({placeholders})", batch)
+    return len(row_ids)
+
+
+def sync_incremental(conn, minio_rows):
+    """
+    N'insère que les images absentes de la table et ne supprime que celles
+    disparues de MinIO, dans une seule transaction.
+    """
+    cursor = conn.cursor()
+    existing = fetch_existing_rows(cursor)
+    to_insert = [(key, url) for key, url in minio_rows.items() if key not in existing]
+    to_delete = [row_id for key, row_id in existing.items() if key not in minio_rows]
+    print(f"🔎 {len(minio_rows)} images sur MinIO, {len(existing)} en base : "
+          f"{len(to_insert)} à ajouter, {len(to_delete)} à supprimer")
+    try:
+        deleted = delete_rows(cursor, to_delete)
+        added = insert_rows(cursor, to_insert)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return added, deleted
+
+
+def sync_full(conn, minio_rows):
+    """
+    Réécriture complète, dans une seule transaction : les lecteurs (training, predict)
+    voient l'ancienne table jusqu'au commit, jamais une table vide.
+    """
+    cursor = conn.cursor()
+    try:
+        deleted = cursor.execute("DELETE FROM fish_data")
+        added = insert_rows(cursor, list(minio_rows.items()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return added, deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronise la table fish_data avec le bucket MinIO")
+    parser.add_argument("--mode", choices=["incremental", "full"], default=SYNC_MODE)
+    args = parser.parse_args()
+
+    minio_client = connect_minio()
+    conn = connect_mysql()
+    try:
+        ensure_schema(conn)
+
+        start = time.perf_counter()
+        minio_rows = list_minio_rows(minio_client)
+        listing_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sync = sync_incremental if args.mode == "incremental" else sync_full
+        added, deleted = sync(conn, minio_rows)
+        write_s = time.perf_counter() - start
+    finally:
+        conn.close()
+
+    rows_per_s = (added + deleted) / write_s if write_s > 0 else 0.0
+    print(f"✅ Synchronisation {args.mode} terminée : {added} images ajoutées, {deleted} supprimées "
+          f"(listing MinIO {listing_s:.1f}s, écriture {write_s:.2f}s, {rows_per_s:.0f} lignes/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+# ===============================================
+# Script : image_index.py
+# Objectif : Index d'intégrité et de similarité des images de "fish_data"
+#            (table annexe "fish_image_index") : SHA-256, pHash/dHash,
+#            validité du décodage, dimensions ; détection des doublons
+#            exacts et quasi-doublons (multi-index hashing, sans O(n²))
+# ===============================================
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from extraction_creation_sql import (
+    BUCKET_NAME,
+    INSERT_BATCH_SIZE,
+    chunks,
+    connect_minio,
+    connect_mysql,
+    ensure_schema,
+    parse_object_key,
+)
+
+# Processus de décodage/hachage (le téléchargement et le décodage sont faits dans chaque worker)
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", str(os.cpu_count() or 4)))
+# Distance de Hamming max entre pHash (64 bits) pour deux quasi-doublons, confirmée par le dHash
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+DHASH_MAX_DISTANCE = int(os.getenv("DHASH_MAX_DISTANCE", "10"))
+INDEX_REPORT = os.getenv("INDEX_REPORT", os.path.join("data", "dedup_report.json"))
+
+HASH_BITS = 64
+DCT_SIZE = 32
+
+create_index_query = """
+CREATE TABLE IF NOT EXISTS fish_image_index (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    split VARCHAR(10) NOT NULL,
+    species_label VARCHAR(100) NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    etag VARCHAR(64),
+    size_bytes BIGINT,
+    sha256 CHAR(64),
+    phash BIGINT UNSIGNED,
+    dhash BIGINT UNSIGNED,
+    width INT,
+    height INT,
+    is_valid TINYINT(1) NOT NULL,
+    error VARCHAR(255),
+    duplicate_of INT NULL,
+    duplicate_kind VARCHAR(10) NULL,
+    indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_index_split_label_file (split, species_label, file_name),
+    KEY idx_index_sha256 (sha256)
+);
+"""
+
+upsert_index_query = """
+INSERT INTO fish_image_index
+    (split, species_label, file_name, etag, size_bytes, sha256, phash, dhash, width, height, is_valid, error)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    etag = VALUES(etag), size_bytes = VALUES(size_bytes), sha256 = VALUES(sha256),
+    phash = VALUES(phash), dhash = VALUES(dhash), width = VALUES(width), height = VALUES(height),
+    is_valid = VALUES(is_valid), error = VALUES(error)
+"""
+
+
+# === 1. Empreintes d'une image ===
+# ---------------------------------
+def _dct_matrix(n):
+    """ Matrice de la DCT-II orthonormée : DCT 2D = C @ X @ C.T """
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+DCT_MATRIX = _dct_matrix(DCT_SIZE)
+
+
+def bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(gray):
+    """ pHash : signe des 8x8 basses fréquences de la DCT d'une image 32x32 par rapport à leur médiane """
+    pixels = np.asarray(gray.resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:8, :8].ravel()
+    return bits_to_int(low > np.median(low))
+
+
+def dhash(gray):
+    """ dHash : gradient horizontal d'une image 9x8 """
+    pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return bits_to_int((pixels[:, 1:] > pixels[:, :-1]).ravel())
+
+
+def fingerprint(data):
+    """
+    SHA-256 du contenu, dimensions d'origine, validité du décodage complet
+    (fichier tronqué ou corrompu → is_valid=0 et message d'erreur) et hachages perceptuels.
+    """
+    result = {"sha256": hashlib.sha256(data).hexdigest(), "size_bytes": len(data),
+              "phash": None, "dhash": None, "width": None, "height": None, "is_valid": 0, "error": None}
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            result["width"], result["height"] = image.size
+            # Décodage réduit (draft JPEG) mais complet : un flux tronqué lève une erreur
+            image.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+            gray = image.convert("L")
+        result["phash"] = phash(gray)
+        result["dhash"] = dhash(gray)
+        result["is_valid"] = 1
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"[:255]
+    return result
+
+
+# === 2. Indexation parallèle ===
+# -------------------------------
+_worker_client = None
+
+
+def _init_worker():
+    global _worker_client
+    _worker_client = connect_minio()
+
+
+def index_object(item):
+    """ Exécuté dans un worker : télécharge l'objet et calcule ses empreintes """
+    key, etag = item
+    try:
+        response = _worker_client.get_object(BUCKET_NAME, key)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception as e:
+        return key, etag, {"sha256": None, "size_bytes": None, "phash": None, "dhash": None,
+                           "width": None, "height": None, "is_valid": 0,
+                           "error": f"download: {type(e).__name__}: {e}"[:255]}
+    return key, etag, fingerprint(data)
+
+
+def ensure_index_table(conn):
+    cursor = conn.cursor()
+    cursor.execute(create_index_query)
+    conn.commit()
+    cursor.close()
+
+
+def list_objects_to_index(minio_client, cursor, reindex=False):
+    """
+    Objets MinIO nouveaux ou modifiés (ETag différent) depuis la dernière indexation,
+    et clés indexées dont l'objet a disparu.
+    """
+    cursor.execute("SELECT split, species_label, file_name, etag FROM fish_image_index")
+    indexed = {(split, label, file_name): etag for split, label, file_name, etag in cursor.fetchall()}
+    todo, seen = [], set()
+    for obj in minio_client.list_objects(BUCKET_NAME, recursive=True):
+        parsed = parse_object_key(obj.object_name)
+        if parsed is None:
+            continue
+        seen.add(parsed)
+        etag = (obj.etag or "").strip('"')
+        if reindex or indexed.get(parsed) != etag:
+            todo.append((obj.object_name, etag))
+    removed = [key for key in indexed if key not in seen]
+    return todo, removed, len(seen)
+
+
+def index_objects(conn, todo, workers=INDEX_WORKERS, batch_size=INSERT_BATCH_SIZE):
+    """
+    Calcule les empreintes en parallèle (processus) et les écrit par lots ;
+    chaque lot est commité : une indexation interrompue reprend là où elle s'est arrêtée.
+    """
+    stats = {"indexed": 0, "invalid": 0}
+    cursor = conn.cursor()
+    pending = []
+
+    def flush():
+        cursor.executemany(upsert_index_query, pending)
+        conn.commit()
+        pending.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for key, etag, fp in pool.map(index_object, todo, chunksize=32):
+            split, label, file_name = parse_object_key(key)
+            pending.append((split, label, file_name, etag, fp["size_bytes"], fp["sha256"], fp["phash"],
+                            fp["dhash"], fp["width"], fp["height"], fp["is_valid"], fp["error"]))
+            stats["indexed"] += 1
+            stats["invalid"] += 1 - fp["is_valid"]
+            if len(pending) >= batch_size:
+                flush()
+                print(f"   🔢 {stats['indexed']}/{len(todo)} images indexées")
+    if pending:
+        flush()
+    cursor.close()
+    return stats
+
+
+def remove_index_rows(conn, keys, batch_size=INSERT_BATCH_SIZE):
+    cursor = conn.cursor()
+    for batch in chunks(keys, batch_size):
+        placeholders = ", ".join(["(%s, %s, %s)"] * len(batch))
+        cursor.execute(
+            f"DELETE FROM fish_image_index WHERE (split, species_label, file_name) IN ({placeholders})",
+            [value for key in batch for value in key],
+        )
+    conn.commit()
+    cursor.close()
+
+
+# === 3. Doublons exacts et quasi-doublons ===
+# --------------------------------------------
+if hasattr(np, "bitwise_count"):
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        as_bytes = np.ascontiguousarray(values, dtype=np.uint64).view(np.uint8)
+        return _BYTE_POPCOUNT[as_bytes].reshape(*np.shape(values), 8).sum(axis=-1)
+
+
+def _chunk_layout(max_distance):
+    """ max_distance + 1 sous-chaînes couvrant les 64 bits : (décalage, masque) de chacune """
+    count = max_distance + 1
+    bounds = np.linspace(0, HASH_BITS, count + 1).astype(int)
+    return [(int(low), (1 << int(high - low)) - 1) for low, high in zip(bounds[:-1], bounds[1:])]
+
+
+def near_duplicate_pairs(hashes, max_distance, block=2048):
+    """
+    Paires (i, j), i < j, de hachages 64 bits à distance de Hamming <= max_distance.
+
+    Multi-index hashing : découpés en max_distance + 1 sous-chaînes, deux hachages assez
+    proches en ont au moins une identique (principe des tiroirs). On ne compare donc que
+    les hachages partageant un seau, avec un popcount vectorisé par seau.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    pairs = set()
+    for shift, mask in _chunk_layout(max_distance):
+        keys = (hashes >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            values = hashes[members]
+            # Seaux très peuplés : comparaison par blocs de lignes pour borner la mémoire
+            for row in range(0, len(members), block):
+                distances = popcount(values[row:row + block, None] ^ values[None, :])
+                rows, cols = np.nonzero(distances <= max_distance)
+                rows += row
+                keep = rows < cols
+                pairs.update(zip(members[rows[keep]].tolist(), members[cols[keep]].tolist()))
+    return {(min(a, b), max(a, b)) for a, b in pairs}
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def find_duplicates(rows, phash_max_distance=PHASH_MAX_DISTANCE, dhash_max_distance=DHASH_MAX_DISTANCE):
+    """
+    rows : [(id, split, label, file_name, sha256, phash, dhash)] des images valides.
+    Regroupe doublons exacts (même SHA-256) et quasi-doublons (pHash proche, confirmé par le dHash).
+    Renvoie la liste des groupes (listes d'indices dans `rows`, taille >= 2) et le nombre de paires proches.
+    """
+    union = UnionFind(len(rows))
+    by_sha = {}
+    for index, row in enumerate(rows):
+        first = by_sha.setdefault(row[4], index)
+        if first != index:
+            union.union(first, index)
+
+    # Un seul représentant par pHash distinct : les pHash identiques sont comparés par le dHash
+    by_phash = defaultdict(list)
+    for index, row in enumerate(rows):
+        by_phash[row[5]].append(index)
+    unique_phashes = list(by_phash)
+    candidates = near_duplicate_pairs(unique_phashes, phash_max_distance)
+    candidates |= {(i, i) for i, members in enumerate(by_phash.values()) if len(members) > 1}
+
+    near_pairs = 0
+    for a, b in candidates:
+        group_a, group_b = by_phash[unique_phashes[a]], by_phash[unique_phashes[b]]
+        for i in group_a:
+            for j in group_b:
+                if i >= j and a == b:
+                    continue
+                if bin(rows[i][6] ^ rows[j][6]).count("1") <= dhash_max_distance:
+                    union.union(i, j)
+                    near_pairs += 1
+
+    groups = defaultdict(list)
+    for index in range(len(rows)):
+        groups[union.find(index)].append(index)
+    return [members for members in groups.values() if len(members) > 1], near_pairs
+
+
+def choose_representative(rows, members):
+    """ L'image gardée d'un groupe : celle du split test s'il y en a une (les copies en train sont des fuites) """
+    return min(members, key=lambda index: (rows[index][1] != "test", rows[index][0]))
+
+
+def mark_duplicates(conn, phash_max_distance=PHASH_MAX_DISTANCE, dhash_max_distance=DHASH_MAX_DISTANCE):
+    """ Recalcule `duplicate_of` / `duplicate_kind` pour tout l'index ; renvoie le rapport """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, split, species_label, file_name, sha256, phash, dhash "
+        "FROM fish_image_index WHERE is_valid = 1"
+    )
+    rows = cursor.fetchall()
+    start = time.perf_counter()
+    groups, near_pairs = find_duplicates(rows, phash_max_distance, dhash_max_distance)
+    search_s = time.perf_counter() - start
+
+    updates, report_groups, cross_split = [], [], 0
+    for members in groups:
+        keep = choose_representative(rows, members)
+        splits = {rows[index][1] for index in members}
+        cross_split += len(splits) > 1
+        for index in members:
+            if index != keep:
+                kind = "exact" if rows[index][4] == rows[keep][4] else "near"
+                updates.append((rows[keep][0], kind, rows[index][0]))
+        report_groups.append({
+            "keep": "/".join(rows[keep][1:4]),
+            "duplicates": ["/".join(rows[index][1:4]) for index in members if index != keep],
+            "splits": sorted(splits),
+        })
+
+    try:
+        cursor.execute("UPDATE fish_image_index SET duplicate_of = NULL, duplicate_kind = NULL "
+                       "WHERE duplicate_of IS NOT NULL")
+        for batch in chunks(updates, INSERT_BATCH_SIZE):
+            cursor.executemany(
+                "UPDATE fish_image_index SET duplicate_of = %s, duplicate_kind = %s WHERE id = %s", batch
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return {
+        "valid_images": len(rows),
+        "duplicate_groups": len(groups),
+        "duplicates_flagged": len(updates),
+        "exact_duplicates": sum(1 for _, kind, _ in updates if kind == "exact"),
+        "near_duplicate_pairs": near_pairs,
+        "cross_split_groups": cross_split,
+        "search_s": round(search_s, 2),
+        "groups": report_groups,
+    }
+
+
+def invalid_images(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT split, species_label, file_name, error FROM fish_image_index WHERE is_valid = 0")
+    rows = [{"key": f"{split}/{label}/{file_name}", "error": error} for split, label, file_name, error in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index d'intégrité et doublons des images de fish_data")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS)
+    parser.add_argument("--reindex", action="store_true", help="Recalculer toutes les empreintes")
+    parser.add_argument("--phash-distance", type=int, default=PHASH_MAX_DISTANCE)
+    parser.add_argument("--dhash-distance", type=int, default=DHASH_MAX_DISTANCE)
+    parser.add_argument("--report", default=INDEX_REPORT, help="Rapport JSON des doublons et images invalides")
+    args = parser.parse_args()
+
+    minio_client = connect_minio()
+    conn = connect_mysql()
+    try:
+        ensure_schema(conn)
+        ensure_index_table(conn)
+
+        cursor = conn.cursor()
+        todo, removed, total = list_objects_to_index(minio_client, cursor, args.reindex)
+        cursor.close()
+        print(f"🔎 {total} images sur MinIO : {len(todo)} à indexer, {len(removed)} disparues")
+        if removed:
+            remove_index_rows(conn, removed)
+
+        start = time.perf_counter()
+        stats = index_objects(conn, todo, workers=args.workers) if todo else {"indexed": 0, "invalid": 0}
+        index_s = time.perf_counter() - start
+        if todo:
+            print(f"✅ {stats['indexed']} images indexées en {index_s:.1f}s "
+                  f"({stats['indexed'] / max(index_s, 1e-6):.0f} img/s, {args.workers} workers)")
+
+        report = mark_duplicates(conn, args.phash_distance, args.dhash_distance)
+        report["invalid"] = invalid_images(conn)
+    finally:
+        conn.close()
+
+    print(f"🧬 {report['duplicate_groups']} groupes de doublons ({report['exact_duplicates']} exacts, "
+          f"{report['duplicates_flagged'] - report['exact_duplicates']} quasi-doublons), "
+          f"dont {report['cross_split_groups']} à cheval sur train/test — recherche {report['search_s']}s")
+    print(f"🩹 {len(report['invalid'])} images invalides (non décodables)")
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📝 Rapport : {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+# ===============================================
+# Script : ingestion_service.py
+# Objectif : Service d'ingestion continue : applique à "fish_data" les
+#            ajouts/suppressions d'images du bucket MinIO dès leur
+#            notification (listen_bucket_notification), par micro-lots,
+#            avec un scan de réconciliation périodique en filet de sécurité
+# ===============================================
+
+import argparse
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+
+import pymysql
+
+from extraction_creation_sql import (
+    BUCKET_NAME,
+    chunks,
+    connect_minio,
+    connect_mysql,
+    ensure_schema,
+    list_minio_rows,
+    object_url,
+    parse_object_key,
+    sync_incremental,
+)
+
+# Micro-lots : appliqués dès INGEST_BATCH_SIZE événements ou après INGEST_BATCH_WAIT_S secondes
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_BATCH_WAIT_S = float(os.getenv("INGEST_BATCH_WAIT_S", "1.0"))
+# File d'attente bornée entre l'écoute MinIO et l'écriture MySQL (contre-pression si MySQL ralentit)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "50000"))
+# Scan complet MinIO ↔ table (événements perdus pendant une coupure) : périodique et au démarrage
+RECONCILE_INTERVAL_S = float(os.getenv("RECONCILE_INTERVAL_S", "3600"))
+RECONCILE_ON_START = os.getenv("RECONCILE_ON_START", "1") == "1"
+# Nom du consommateur dans la table de checkpoint (plusieurs services possibles sur la même base)
+INGEST_CONSUMER = os.getenv("INGEST_CONSUMER", "fish_data")
+STATS_INTERVAL_S = float(os.getenv("INGEST_STATS_INTERVAL_S", "60"))
+
+NOTIFICATION_EVENTS = ["s3:ObjectCreated:*", "s3:ObjectRemoved:*"]
+# Connexion MySQL perdue (redémarrage du serveur, 2006 / 2013, connexion déjà fermée) : reconnexion
+MYSQL_CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+# Ligne refusée par MySQL (valeur trop longue, contrainte...) : seul l'événement fautif est écarté
+MYSQL_DATA_ERRORS = (pymysql.err.DataError, pymysql.err.IntegrityError)
+
+create_checkpoint_query = """
+CREATE TABLE IF NOT EXISTS ingestion_checkpoint (
+    consumer VARCHAR(64) PRIMARY KEY,
+    last_event_time VARCHAR(40),
+    last_sequencer VARCHAR(64),
+    events_applied BIGINT NOT NULL DEFAULT 0,
+    last_reconcile DATETIME NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+"""
+
+# Idempotent : un événement rejoué (reconnexion, réconciliation concurrente) ne crée pas de doublon
+upsert_query = """
+INSERT INTO fish_data (species_label, file_name, url_s3, split)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE url_s3 = VALUES(url_s3)
+"""
+
+save_checkpoint_query = """
+INSERT INTO ingestion_checkpoint (consumer, last_event_time, last_sequencer, events_applied)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    last_event_time = VALUES(last_event_time),
+    last_sequencer = VALUES(last_sequencer),
+    events_applied = events_applied + VALUES(events_applied)
+"""
+
+
+# === 1. Événements MinIO ===
+# ---------------------------
+def parse_record(record):
+    """
+    Enregistrement de notification S3 → (action, clé naturelle, url, eventTime, sequencer),
+    None pour les objets hors de train/ et test/. action : "put" ou "delete".
+    """
+    event_name = record.get("eventName", "")
+    if event_name.startswith("s3:ObjectCreated:"):
+        action = "put"
+    elif event_name.startswith("s3:ObjectRemoved:"):
+        action = "delete"
+    else:
+        return None
+    obj = record["s3"]["object"]
+    key = unquote_plus(obj["key"])  # les clés sont encodées dans les notifications ("Gold+Fish/...")
+    parsed = parse_object_key(key)
+    if parsed is None:
+        return None
+    return action, parsed, object_url(key), record.get("eventTime"), obj.get("sequencer")
+
+
+def coalesce(events):
+    """
+    Ne garde que le dernier événement de chaque image du lot (upload puis suppression = suppression) :
+    {clé: url} à insérer et [clés] à supprimer.
+    """
+    latest = {}
+    for action, key, url, _, _ in events:
+        latest[key] = (action, url)
+    puts = {key: url for key, (action, url) in latest.items() if action == "put"}
+    deletes = [key for key, (action, _) in latest.items() if action == "delete"]
+    return puts, deletes
+
+
+def event_lag_s(event_time):
+    """ Délai entre l'événement MinIO ("2025-01-01T12:00:00.123Z") et maintenant """
+    if not event_time:
+        return 0.0
+    try:
+        when = datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    return max((datetime.now(timezone.utc) - when).total_seconds(), 0.0)
+
+
+# === 2. Écriture MySQL ===
+# -------------------------
+def ensure_checkpoint_table(conn):
+    cursor = conn.cursor()
+    cursor.execute(create_checkpoint_query)
+    conn.commit()
+    cursor.close()
+
+
+def load_checkpoint(conn, consumer=INGEST_CONSUMER):
+    """ (last_event_time, last_sequencer, events_applied, last_reconcile) ou None au premier démarrage """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT last_event_time, last_sequencer, events_applied, last_reconcile "
+        "FROM ingestion_checkpoint WHERE consumer = %s",
+        (consumer,),
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+
+def upsert_rows(cursor, rows, batch_size=INGEST_BATCH_SIZE):
+    values = [(label, file_name, url_s3, split) for (split, label, file_name), url_s3 in rows]
+    for batch in chunks(values, batch_size):
+        cursor.executemany(upsert_query, batch)
+    return len(values)
+
+
+def delete_keys(cursor, keys, batch_size=INGEST_BATCH_SIZE):
+    """ Suppression par clé naturelle : l'index unique évite de relire les ids """
+    deleted = 0
+    for batch in chunks(keys, batch_size):
+        placeholders = ", ".join(["(%s, %s, %s)"] * len(batch))
+        params = [value for key in batch for value in key]
+        deleted += cursor.execute(
+            f"DELETE FROM fish_data WHERE (split, species_label, file_name) IN ({placeholders})", params
+        )
+    return deleted
+
+
+def apply_batch(conn, events, consumer=INGEST_CONSUMER):
+    """
+    Applique un micro-lot et avance le checkpoint dans la même transaction :
+    après un crash, la table et la position enregistrée restent cohérentes.
+    """
+    puts, deletes = coalesce(events)
+    _, _, _, event_time, sequencer = events[-1]
+    cursor = conn.cursor()
+    try:
+        deleted = delete_keys(cursor, deletes)
+        upserted = upsert_rows(cursor, list(puts.items()))
+        cursor.execute(save_checkpoint_query, (consumer, event_time, sequencer, len(events)))
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except pymysql.err.Error:
+            pass  # connexion coupée : MySQL annule lui-même la transaction, l'erreur d'origine remonte
+        raise
+    finally:
+        cursor.close()
+    return upserted, deleted
+
+
+def reconcile(conn, minio_client, consumer=INGEST_CONSUMER):
+    """ Scan complet (extraction_creation_sql.sync_incremental) puis horodatage dans le checkpoint """
+    start = time.perf_counter()
+    added, deleted = sync_incremental(conn, list_minio_rows(minio_client))
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO ingestion_checkpoint (consumer, last_reconcile) VALUES (%s, UTC_TIMESTAMP()) "
+        "ON DUPLICATE KEY UPDATE last_reconcile = UTC_TIMESTAMP()",
+        (consumer,),
+    )
+    conn.commit()
+    cursor.close()
+    print(f"🔁 Réconciliation : {added} ajoutées, {deleted} supprimées ({time.perf_counter() - start:.1f}s)")
+    return added, deleted
+
+
+# === 3. Service ===
+# ------------------
+class IngestionService:
+    """
+    Un thread écoute les notifications MinIO et remplit une file bornée ;
+    la boucle principale la vide par micro-lots vers MySQL et déclenche les réconciliations.
+    """
+
+    def __init__(self, minio_client, conn, batch_size=INGEST_BATCH_SIZE, batch_wait_s=INGEST_BATCH_WAIT_S,
+                 reconcile_interval_s=RECONCILE_INTERVAL_S, queue_size=INGEST_QUEUE_SIZE,
+                 consumer=INGEST_CONSUMER, connect=connect_mysql):
+        self.minio_client = minio_client
+        self.conn = conn
+        self.connect = connect
+        self.batch_size = batch_size
+        self.batch_wait_s = batch_wait_s
+        self.reconcile_interval_s = reconcile_interval_s
+        self.consumer = consumer
+        self.events = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        # Levé quand l'écoute a été interrompue : des événements ont pu être perdus
+        self.gap_event = threading.Event()
+        self.last_reconcile = 0.0
+        # Compteurs mis à jour par le thread d'écoute (received) et par la boucle principale
+        self.stats_lock = threading.Lock()
+        self.stats = {"received": 0, "applied": 0, "batches": 0, "upserted": 0, "deleted": 0, "skipped": 0}
+        self.last_lag_s = 0.0
+
+    # --- Écoute MinIO ---
+    def listen(self):
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            try:
+                with self.minio_client.listen_bucket_notification(BUCKET_NAME, events=NOTIFICATION_EVENTS) as stream:
+                    print(f"👂 Écoute des notifications du bucket '{BUCKET_NAME}'")
+                    backoff = 1.0
+                    for notification in stream:
+                        for record in notification.get("Records") or []:
+                            parsed = parse_record(record)
+                            if parsed is not None:
+                                self.events.put(parsed)
+                                with self.stats_lock:
+                                    self.stats["received"] += 1
+                        if self.stop_event.is_set():
+                            return
+            except Exception as e:
+                if self.stop_event.is_set():
+                    return
+                print(f"⚠️  Écoute MinIO interrompue ({e}), reconnexion dans {backoff:.0f}s")
+            # Les événements émis pendant la coupure ne seront pas rejoués par MinIO
+            self.gap_event.set()
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    # --- Écriture par micro-lots ---
+    def next_batch(self):
+        """ Jusqu'à batch_size événements, en attendant au plus batch_wait_s après le premier """
+        try:
+            batch = [self.events.get(timeout=self.batch_wait_s)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def reconcile_due(self):
+        if self.gap_event.is_set():
+            return True
+        return self.reconcile_interval_s > 0 and time.monotonic() - self.last_reconcile >= self.reconcile_interval_s
+
+    def run_reconcile(self):
+        # Effacé avant le scan : une coupure pendant le listing déclenchera un nouveau scan
+        self.gap_event.clear()
+        reconcile(self.conn, self.minio_client, self.consumer)
+        self.last_reconcile = time.monotonic()
+
+    def process(self, batch):
+        skipped = 0
+        try:
+            upserted, deleted = apply_batch(self.conn, batch, self.consumer)
+        except MYSQL_DATA_ERRORS:
+            # Lot annulé : rejoué événement par événement (dans l'ordre, même résultat que le lot)
+            # pour n'écarter que l'image refusée au lieu d'arrêter le service
+            upserted = deleted = 0
+            for event in batch:
+                try:
+                    event_upserted, event_deleted = apply_batch(self.conn, [event], self.consumer)
+                except MYSQL_DATA_ERRORS as e:
+                    action, (split, label, file_name), _, _, _ = event
+                    print(f"⚠️  Événement ignoré ({action} {split}/{label}/{file_name}) : {e}")
+                    skipped += 1
+                    continue
+                upserted += event_upserted
+                deleted += event_deleted
+        with self.stats_lock:
+            self.stats["applied"] += len(batch) - skipped
+            self.stats["skipped"] += skipped
+            self.stats["batches"] += 1
+            self.stats["upserted"] += upserted
+            self.stats["deleted"] += deleted
+        self.last_lag_s = event_lag_s(batch[-1][3])
+
+    def reconnect(self, error):
+        """ Nouvelle connexion MySQL après une coupure, avec backoff, puis réconciliation demandée """
+        print(f"⚠️  Connexion MySQL perdue ({error}), reconnexion")
+        try:
+            self.conn.close()
+        except pymysql.err.Error:
+            pass
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            try:
+                self.conn = self.connect()
+                print("🔌 Reconnecté à MySQL")
+                break
+            except MYSQL_CONNECTION_ERRORS as e:
+                print(f"⚠️  MySQL indisponible ({e}), nouvel essai dans {backoff:.0f}s")
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+        # Écriture interrompue en plein lot : un scan complet vérifie la table au prochain tour
+        self.gap_event.set()
+
+    def report(self, elapsed_s):
+        with self.stats_lock:
+            s = dict(self.stats)
+        rate = s["applied"] / elapsed_s if elapsed_s > 0 else 0.0
+        print(f"📊 {s['received']} événements reçus, {s['applied']} appliqués en {s['batches']} lots "
+              f"({s['upserted']} ajouts, {s['deleted']} suppressions, {s['skipped']} ignorés, {rate:.0f} évts/s, "
+              f"file {self.events.qsize()}, retard {self.last_lag_s:.1f}s)")
+
+    def run(self, reconcile_on_start=RECONCILE_ON_START):
+        ensure_checkpoint_table(self.conn)
+        checkpoint = load_checkpoint(self.conn, self.consumer)
+        if checkpoint is not None:
+            last_event_time, last_sequencer, events_applied, last_reconcile = checkpoint
+            print(f"📍 Reprise : {events_applied} événements appliqués, dernier {last_event_time} "
+                  f"(sequencer {last_sequencer}), dernière réconciliation {last_reconcile}")
+
+        listener = threading.Thread(target=self.listen, name="minio-listener", daemon=True)
+        listener.start()
+        # Écoute démarrée avant le scan : rien n'est perdu entre le listing et les premières notifications
+        if reconcile_on_start or checkpoint is None:
+            self.run_reconcile()
+        else:
+            self.last_reconcile = time.monotonic()
+
+        start = last_report = time.monotonic()
+        # Lot non appliqué à cause d'une coupure MySQL : rejoué après reconnexion (écritures idempotentes)
+        retry = []
+        try:
+            while not self.stop_event.is_set():
+                batch = retry = retry or self.next_batch()
+                try:
+                    if batch:
+                        self.process(batch)
+                    retry = []
+                    if self.reconcile_due():
+                        self.run_reconcile()
+                except MYSQL_CONNECTION_ERRORS as e:
+                    self.reconnect(e)
+                if STATS_INTERVAL_S > 0 and time.monotonic() - last_report >= STATS_INTERVAL_S:
+                    self.report(time.monotonic() - start)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            print("🛑 Arrêt demandé")
+        finally:
+            self.stop_event.set()
+            # Vide la file avant de s'arrêter : les événements reçus ne sont pas perdus
+            pending = list(retry)
+            while not self.events.empty():
+                pending.append(self.events.get_nowait())
+            applied = 0
+            try:
+                for batch in chunks(pending, self.batch_size):
+                    self.process(batch)
+                    applied += len(batch)
+            except Exception as e:
+                # Sans masquer l'erreur qui a arrêté la boucle : la réconciliation au démarrage rattrapera
+                print(f"⚠️  {len(pending) - applied} événements non appliqués à l'arrêt ({e})")
+            self.report(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion continue des images MinIO dans fish_data")
+    parser.add_argument("--reconcile-only", action="store_true",
+                        help="Un seul scan de réconciliation puis arrêt")
+    parser.add_argument("--no-reconcile-on-start", action="store_true",
+                        help="Reprendre sans scan initial (seulement si aucune coupure n'est à rattraper)")
+    args = parser.parse_args()
+
+    minio_client = connect_minio()
+    conn = connect_mysql()
+    try:
+        ensure_schema(conn)
+        if args.reconcile_only:
+            ensure_checkpoint_table(conn)
+            reconcile(conn, minio_client)
+            return
+        service = IngestionService(minio_client, conn)
+        try:
+            service.run(reconcile_on_start=RECONCILE_ON_START and not args.no_reconcile_on_start)
+        finally:
+            conn = service.conn  # remplacée après une reconnexion
+    finally:
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# ===============================================
+# Module : mixed_precision.py
+# Objectif : Précision mixte (bfloat16 autocast) et format mémoire
+#            channels_last pour l'entraînement sur CPU (train_model.py)
+# ===============================================
+
+from contextlib import nullcontext
+
+import torch
+
+PRECISIONS = ["fp32", "bf16"]
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Précision inconnue : {precision} (attendu : {', '.join(PRECISIONS)})")
+    return precision
+
+
+def autocast(device, precision):
+    """
+    Contexte d'autocast : en bf16, convolutions et matmuls sont calculées en bfloat16
+    (poids et gradients restent en fp32, pas de GradScaler nécessaire contrairement au fp16).
+    """
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def memory_format(channels_last):
+    return torch.channels_last if channels_last else torch.contiguous_format
+
+
+def predict_labels(model, loader, preprocess, device, precision):
+    """ Prédictions (top-1) et labels d'un loader, dans une précision donnée (format mémoire : `preprocess`) """
+    predictions, targets = [], []
+    model.eval()
+    with torch.no_grad():
+        for images, labels in loader:
+            images, labels = preprocess(images, labels)
+            with autocast(device, precision):
+                outputs = model(images)
+            predictions.append(outputs.float().argmax(dim=1).cpu())
+            targets.append(labels.cpu())
+    if not predictions:
+        return torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)
+    return torch.cat(predictions), torch.cat(targets)
@@ -0,0 +1,88 @@
+"""
+Test de bout en bout de ingestion_service.py contre un MinIO / MySQL locaux
+(docker compose up -d minio mysql, puis le service lancé avec MINIO_ENDPOINT=localhost:9000 MYSQL_HOST=127.0.0.1) :
+envoie N images factices sous train/<label>/, attend leur apparition dans fish_data,
+les supprime puis attend leur disparition. Affiche le débit et le délai de bout en bout.
+
+    python scripts/test_ingestion.py --count 2000
+"""
+import argparse
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+from minio import Minio
+
+
+def count_rows(conn, label):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM fish_data WHERE split = 'train' AND species_label = %s", (label,))
+        return cursor.fetchone()[0]
+
+
+def wait_for(conn, label, expected, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        conn.commit()  # nouvelle transaction : voir les lignes commitées par le service
+        current = count_rows(conn, label)
+        if current == expected:
+            return time.perf_counter() - start
+        time.sleep(0.2)
+    print(f"❌ {current} lignes au lieu de {expected} après {timeout:.0f}s")
+    sys.exit(1)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Test de charge du service d'ingestion")
+    p.add_argument("--count", type=int, default=500, help="Nombre d'objets à envoyer")
+    p.add_argument("--workers", type=int, default=16, help="Uploads parallèles")
+    p.add_argument("--minio", default="localhost:9000")
+    p.add_argument("--mysql-host", default="127.0.0.1")
+    p.add_argument("--bucket", default="dataset-fish")
+    p.add_argument("--label", default="_ingestion_test", help="Pseudo-espèce utilisée pour le test (nettoyée à la fin)")
+    p.add_argument("--timeout", type=float, default=120.0)
+    args = p.parse_args()
+
+    minio_client = Minio(args.minio, access_key="admin-user", secret_key="admin-password", secure=False)
+    conn = pymysql.connect(host=args.mysql_host, user="root", password="root", database="mlops")
+    keys = [f"train/{args.label}/img_{i:06d}.jpg" for i in range(args.count)]
+    payload = b"\xff\xd8\xff\xe0" + b"\0" * 1020
+
+    def upload(key):
+        minio_client.put_object(args.bucket, key, io.BytesIO(payload), len(payload), content_type="image/jpeg")
+
+    def remove(key):
+        minio_client.remove_object(args.bucket, key)
+
+    removed = False
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.workers) as pool:
+            list(pool.map(upload, keys))
+        upload_s = time.perf_counter() - start
+        visible_s = wait_for(conn, args.label, args.count, args.timeout)
+        total_s = upload_s + visible_s
+        print(f"✅ {args.count} uploads en {upload_s:.1f}s ({args.count / upload_s:.0f}/s), "
+              f"tous visibles dans fish_data {visible_s:.1f}s après le dernier upload "
+              f"({args.count / total_s:.0f} lignes/s de bout en bout)")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.workers) as pool:
+            list(pool.map(remove, keys))
+        removed = True
+        remove_s = time.perf_counter() - start
+        gone_s = wait_for(conn, args.label, 0, args.timeout)
+        print(f"✅ {args.count} suppressions en {remove_s:.1f}s, répercutées {gone_s:.1f}s après la dernière")
+    finally:
+        if not removed:
+            # Échec ou délai dépassé avant la suppression : le bucket ne garde pas les objets de test
+            print(f"🧹 Suppression des objets de test sous train/{args.label}/")
+            with ThreadPoolExecutor(args.workers) as pool:
+                list(pool.map(remove, keys))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
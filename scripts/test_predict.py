@@ -8,8 +8,14 @@ def main():
     p = argparse.ArgumentParser(description="Envoyer une image au endpoint /predict")
     p.add_argument("--image", "-i", required=False, help="Chemin vers l'image à envoyer")
     p.add_argument("--url", "-u", default="http://127.0.0.1:8000/predict", help="URL du endpoint")
+    p.add_argument("--batch-dir", "-b", help="Dossier d'images à envoyer en une seule requête à /predict/batch")
+    p.add_argument("--top-k", type=int, default=3, help="Nombre de classes renvoyées par image (mode batch)")
     args = p.parse_args()
 
+    if args.batch_dir:
+        predict_batch_dir(args)
+        return
+
     img_path = args.image
     if not img_path:
         # tenter de trouver une image de test dans le repo
@@ -45,5 +51,37 @@ def main():
         sys.exit(1)
 
 
+def predict_batch_dir(args):
+    """Envoie toutes les images d'un dossier en une seule requête à /predict/batch"""
+    paths = sorted(
+        p for p in Path(args.batch_dir).rglob("*")
+        if p.suffix.lower() in (".jpg", ".jpeg", ".png")
+    )
+    if not paths:
+        print(f"❌ Aucune image trouvée dans {args.batch_dir}")
+        sys.exit(1)
+
+    url = args.url.rstrip("/")
+    if not url.endswith("/batch"):
+        url += "/batch"
+
+    try:
+        files = [("files", (p.name, p.read_bytes(), "image/jpeg")) for p in paths]
+        resp = requests.post(url, files=files, params={"top_k": args.top_k}, timeout=120)
+
+        print(f"📡 Status HTTP: {resp.status_code}")
+        if resp.status_code != 200:
+            print(f"❌ Erreur: {resp.text}")
+            sys.exit(1)
+        for result in resp.json()["results"]:
+            if "error" in result:
+                print(f"❌ {result['filename']}: {result['error']}")
+            else:
+                print(f"🐟 {result['filename']}: {result['prediction']} ({result['confidence']}%)")
+    except requests.exceptions.ConnectionError:
+        print("❌ Impossible de se connecter au serveur. Vérifiez qu'il tourne sur http://127.0.0.1:8000")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
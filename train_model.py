@@ -7,17 +7,36 @@
 
 import os
 import io
+import sys
 import pymysql
 from minio import Minio
 from PIL import Image
 from tqdm import tqdm
 import torch
 from torch import nn, optim
-from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader, random_split
+from torchvision import datasets, transforms
+from torch.utils.data import random_split, Subset
+from torch.utils.data.distributed import DistributedSampler
 from urllib.parse import urljoin
+import json
 import shutil
 import time
+from functools import partial
+from contextlib import nullcontext
+from dataset_download import sync_objects, prune_local_files
+from dataset_cache import build_cache, load_rgb, MemmapImageDataset
+from data_loader import LoaderConfig, make_loader, BatchPreprocessor, measure_loader, measure_compute
+from checkpointing import CheckpointStore, EarlyStopping, TimeBudget, capture_rng_state, restore_rng_state
+from mixed_precision import check_precision, autocast, memory_format, predict_labels
+from cascade_calibration import (calibration_split, latest_reference_model, predict_confidences, reference_held_out,
+                                 reference_metadata, tune_threshold)
+# Registre des architectures partagé avec l'API (app/architectures.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from architectures import build_model, check_architecture, count_parameters
+from distributed_training import (
+    init_distributed, configure_threads, barrier, broadcast_object, all_reduce_sum,
+    wrap_model, shard_indices, main_process_first, cleanup,
+)
 
 # === 🔹 MLflow ===
 import mlflow
@@ -47,6 +66,7 @@ MINIO_ACCESS_KEY = "admin-user"
 MINIO_SECRET_KEY = "admin-password"
 BUCKET_NAME = "dataset-fish"
 MODEL_BUCKET = "models"
+CHECKPOINT_BUCKET = "checkpoints"
 
 # MySQL configuration
 MYSQL_HOST = "mysql" if IN_DOCKER else "localhost"
@@ -54,204 +74,595 @@ MYSQL_USER = "root"
 MYSQL_PASSWORD = "root"
 MYSQL_DB = "mlops"
 
+# MLflow configuration
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://mlflow:5000" if IN_DOCKER else "http://localhost:5000")
+MLFLOW_EXPERIMENT_NAME = os.getenv("MLFLOW_EXPERIMENT_NAME", "Fishy_Model_Tracking")
+
+# Architecture entraînée (voir app/architectures.py) : resnet18 = modèle servi (model_v1_{timestamp}.pt),
+# les autres sont publiées sous model_v1_{architecture}_{timestamp}.pt (ex: petit modèle de la cascade).
+# MODEL_PREFIX=model_v1 publie une autre architecture comme modèle servi (choix de train_sweep.py)
+MODEL_ARCH = check_architecture(os.getenv("MODEL_ARCH", "resnet18"))
+MODEL_PREFIX = os.getenv("MODEL_PREFIX", "model_v1" if MODEL_ARCH == "resnet18" else f"model_v1_{MODEL_ARCH}")
+
+# Cascade (MODEL_ARCH=mobilenet_v3_small) : seuil de confiance choisi sur le split de calibration pour que
+# petit modèle + ResNet18 de référence (le plus récent du bucket, ou CASCADE_REFERENCE) atteignent
+# CASCADE_TARGET_ACCURACY (%), par défaut la précision du ResNet18 moins CASCADE_MAX_ACCURACY_DROP points
+CASCADE_REFERENCE = os.getenv("CASCADE_REFERENCE", "")
+# Pourcentage des images mis de côté pour la calibration (hash du chemin, même split pour toutes
+# les architectures) : ni entraîné ni utilisé pour choisir le meilleur epoch. 0 = calibration sur la validation
+CASCADE_CALIBRATION_PERCENT = int(os.getenv("CASCADE_CALIBRATION_PERCENT", "10"))
+CASCADE_TARGET_ACCURACY = os.getenv("CASCADE_TARGET_ACCURACY", "")
+CASCADE_MAX_ACCURACY_DROP = float(os.getenv("CASCADE_MAX_ACCURACY_DROP", "0.5"))
+
 # Dossiers locaux
 DATA_DIR = "data"
 TRAIN_DIR = os.path.join(DATA_DIR, "train")
 
+# Téléchargement des images (parallèle, reprenable)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+
+# Cache prétraité du dataset (images décodées une seule fois, fichier memory-mappé)
+DATASET_CACHE = os.getenv("DATASET_CACHE", "1") == "1"
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "8"))
+# Décodage JPEG réduit (mode draft), même variable et même défaut que l'API (app/decode.py) :
+# appliqué avec ou sans cache, enregistré dans la clé du cache et dans MLflow
+DECODE_DRAFT = os.getenv("DECODE_DRAFT", "1") == "1"
+
+# Écarte les images marquées invalides ou doublons par image_index.py (table fish_image_index)
+DATASET_FILTER = os.getenv("DATASET_FILTER", "1") == "1"
+
+# Pipeline d'entrée (LOADER_WORKERS, PIN_MEMORY, PERSISTENT_WORKERS, PREFETCH_FACTOR,
+# BATCH_NORMALIZE, AUGMENT_FLIP : voir data_loader.py)
+LOADER_CONFIG = LoaderConfig()
+# `python train_model.py --loader-benchmark` : mesure le débit du chargement seul puis s'arrête
+LOADER_BENCHMARK = "--loader-benchmark" in sys.argv[1:]
+
+# Checkpoints complets (modèle, optimiseur, epoch, RNG) sur MinIO et reprise automatique
+# (un jeu de checkpoints par architecture : un ResNet18 ne reprend pas un checkpoint MobileNet)
+ARCH_SUFFIX = "" if MODEL_ARCH == "resnet18" else f"-{MODEL_ARCH}"
+CHECKPOINT_PREFIX = os.getenv("CHECKPOINT_PREFIX", f"fish-classifier{ARCH_SUFFIX}/")
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(DATA_DIR, f"checkpoints{ARCH_SUFFIX}"))
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "1"))  # en epochs
+CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP", "2"))
+RESUME = os.getenv("RESUME", "1") == "1"
+
+# Early stopping sur val_accuracy (0 = désactivé) et budget de temps réel (minutes, 0 = illimité)
+EARLY_STOPPING_PATIENCE = int(os.getenv("EARLY_STOPPING_PATIENCE", "5"))
+EARLY_STOPPING_MIN_DELTA = float(os.getenv("EARLY_STOPPING_MIN_DELTA", "0.0"))
+TRAIN_TIME_BUDGET_MIN = float(os.getenv("TRAIN_TIME_BUDGET_MIN", "0"))
+TIME_BUDGET = TimeBudget(TRAIN_TIME_BUDGET_MIN * 60)
+
+# Publication du modèle dans le bucket `models` (0 : candidats d'un balayage, gardés dans MLflow seulement)
+PUBLISH_MODEL = os.getenv("PUBLISH_MODEL", "1") == "1"
+# Résumé JSON du run (architecture, précision, run MLflow, poids), lu par train_sweep.py
+TRAIN_SUMMARY_PATH = os.getenv("TRAIN_SUMMARY_PATH", "")
+# Dossier des poids produits (best_model.pt, model_v1.pt...) : un dossier par candidat d'un balayage
+TRAIN_OUTPUT_DIR = os.getenv("TRAIN_OUTPUT_DIR", ".")
+os.makedirs(TRAIN_OUTPUT_DIR, exist_ok=True)
+
 # Paramètres d'entraînement
-EPOCHS = 20
+EPOCHS = int(os.getenv("EPOCHS", "20"))
 BATCH_SIZE = 16
 LEARNING_RATE = 0.001
 IMG_SIZE = 224
-
-print(f"🖥️  Environnement détecté: {'Docker' if IN_DOCKER else 'Local'}")
+# Précision de calcul : fp32 ou bf16 (autocast bfloat16 sur CPU), format mémoire channels_last
+# (enregistrés dans les métadonnées du modèle et repris par l'API)
+TRAIN_PRECISION = check_precision(os.getenv("TRAIN_PRECISION", "fp32"))
+CHANNELS_LAST = os.getenv("CHANNELS_LAST", "0") == "1"
+# Graine du split train/validation (identique sur tous les process en mode distribué)
+SPLIT_SEED = int(os.getenv("SPLIT_SEED", "42"))
+
+# Mode distribué : `torchrun --standalone --nproc_per_node=N train_model.py`
+# (gloo sur CPU, gradients moyennés par all-reduce, BATCH_SIZE par process)
+DIST = init_distributed()
+TRAIN_THREADS = configure_threads(DIST.local_world_size)
+
+if DIST.is_main:
+    print(f"🖥️  Environnement détecté: {'Docker' if IN_DOCKER else 'Local'}")
+    print(f"🧵 {DIST.world_size} process x {TRAIN_THREADS} thread(s)")
+
+# Seul le rank 0 interroge MySQL, télécharge les images et configure MLflow ;
+# en mode distribué les autres process attendent le dataset (barrière ci-dessous)
+if DIST.is_main:
+    # ============================================================
+    # 2️⃣ Connexion MySQL, MinIO et MLflow
+    # ============================================================
+    print("🔌 Connexion à MySQL...")
+    conn = pymysql.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DB
+    )
+    cursor = conn.cursor()
+    print("✅ Connecté à MySQL")
+
+    print("🔌 Connexion à MinIO...")
+    minio_client = Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        secure=False
+    )
+
+    # Vérification des buckets
+    if not minio_client.bucket_exists(BUCKET_NAME):
+        raise ValueError(f"Le bucket '{BUCKET_NAME}' n'existe pas sur MinIO.")
+    if not minio_client.bucket_exists(MODEL_BUCKET):
+        minio_client.make_bucket(MODEL_BUCKET)
+        print(f"✅ Bucket '{MODEL_BUCKET}' créé pour stocker les modèles.")
+    if not minio_client.bucket_exists(CHECKPOINT_BUCKET):
+        minio_client.make_bucket(CHECKPOINT_BUCKET)
+        print(f"✅ Bucket '{CHECKPOINT_BUCKET}' créé pour les checkpoints d'entraînement.")
+
+    # Créer le bucket mlflow pour les artifacts MLflow
+    MLFLOW_BUCKET = "mlflow"
+    if not minio_client.bucket_exists(MLFLOW_BUCKET):
+        minio_client.make_bucket(MLFLOW_BUCKET)
+        print(f"✅ Bucket '{MLFLOW_BUCKET}' créé pour les artifacts MLflow.")
+
+    print("✅ Connecté à MinIO")
+
+    # ============================================================
+    # Configuration des credentials S3/MinIO pour MLflow
+    # ============================================================
+    print("🔌 Configuration des credentials MLflow pour MinIO...")
+    os.environ["AWS_ACCESS_KEY_ID"] = MINIO_ACCESS_KEY
+    os.environ["AWS_SECRET_ACCESS_KEY"] = MINIO_SECRET_KEY
+    os.environ["MLFLOW_S3_ENDPOINT_URL"] = f"http://minio:9000" if IN_DOCKER else "http://localhost:9000"
+    print("✅ Credentials configurés pour MLflow")
+
+    print("🔌 Configuration de MLflow...")
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME)
+    print(f"✅ MLflow configuré : {MLFLOW_TRACKING_URI}")
+
+    # ============================================================
+    # 3️⃣ Lecture des images depuis la table SQL
+    # ============================================================
+    print("📊 Lecture des données depuis la table fish_data...")
+    indexed_rows = None
+    if DATASET_FILTER:
+        try:
+            cursor.execute("""
+                SELECT d.species_label, d.file_name, d.url_s3, i.is_valid, i.duplicate_of
+                FROM fish_data d
+                LEFT JOIN fish_image_index i
+                  ON i.split = d.split AND i.species_label = d.species_label AND i.file_name = d.file_name
+                WHERE d.split = 'train'
+            """)
+            indexed_rows = cursor.fetchall()
+        except pymysql.err.ProgrammingError:
+            print("⚠️  Table fish_image_index absente : lancer image_index.py pour écarter invalides et doublons")
+    if indexed_rows is None:
+        cursor.execute("SELECT species_label, file_name, url_s3, NULL, NULL FROM fish_data WHERE split = 'train'")
+        indexed_rows = cursor.fetchall()
+    rows = [(label, file_name, url_s3) for label, file_name, url_s3, is_valid, duplicate_of in indexed_rows
+            if is_valid != 0 and duplicate_of is None]
+    excluded_invalid = sum(1 for row in indexed_rows if row[3] == 0)
+    excluded_duplicates = len(indexed_rows) - len(rows) - excluded_invalid
+    print(f"✅ {len(rows)} images de training trouvées dans la base de données "
+          f"({excluded_invalid} invalides et {excluded_duplicates} doublons écartés)")
+
+    # ============================================================
+    # 4️⃣ Téléchargement des images depuis MinIO
+    # ============================================================
+    print("📦 Téléchargement des images depuis MinIO...")
+    os.makedirs(TRAIN_DIR, exist_ok=True)
+
+    # Seuls les fichiers absents, incomplets ou modifiés (ETag/taille) sont téléchargés ;
+    # le manifeste local (data/train/.manifest.json) permet de reprendre après un crash
+    download_items = [
+        (f"train/{label}/{file_name}", os.path.join(TRAIN_DIR, label, file_name))
+        for label, file_name, url_s3 in rows
+    ]
+    download_stats = sync_objects(
+        minio_client, BUCKET_NAME, download_items, TRAIN_DIR,
+        prefix="train/", workers=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES,
+    )
+    pruned = prune_local_files(TRAIN_DIR, [local_path for _, local_path in download_items])
+    if pruned:
+        print(f"🧹 {pruned} images locales retirées (absentes du dataset, invalides ou doublons)")
+
+    cursor.close()
+    conn.close()
+    print(f"✅ Téléchargement terminé : {download_stats['downloaded']} téléchargées, "
+          f"{download_stats['up_to_date']} déjà à jour, {download_stats['failed']} en erreur "
+          f"({download_stats['bytes'] / 1e6:.1f} MB à {download_stats['mb_per_s']} MB/s)")
+
+barrier(DIST)
 
 # ============================================================
-# 2️⃣ Connexion MySQL, MinIO et MLflow
+# 5️⃣ Préparation des données PyTorch
 # ============================================================
-print("🔌 Connexion à MySQL...")
-conn = pymysql.connect(
-    host=MYSQL_HOST,
-    user=MYSQL_USER,
-    password=MYSQL_PASSWORD,
-    database=MYSQL_DB
+if LOADER_CONFIG.batch_normalize:
+    # uint8 (3, H, W) : la normalisation est faite par batch (BatchPreprocessor)
+    transform = transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.PILToTensor(),
+    ])
+else:
+    transform = transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                             std=[0.229, 0.224, 0.225]),
+    ])
+
+if DATASET_CACHE:
+    # Décodage + redimensionnement faits une fois, reconstruits seulement si le manifeste
+    # ou les paramètres changent ; chaque epoch ne lit que des tranches uint8 du memmap
+    cache_index = build_cache(TRAIN_DIR, DATASET_CACHE_DIR, IMG_SIZE, workers=PREPROCESS_WORKERS,
+                              draft=DECODE_DRAFT) if DIST.is_main else None
+    cache_index = broadcast_object(DIST, cache_index)
+    dataset = MemmapImageDataset(cache_index, normalize=not LOADER_CONFIG.batch_normalize)
+else:
+    dataset = datasets.ImageFolder(root=TRAIN_DIR, transform=transform,
+                                   loader=partial(load_rgb, img_size=IMG_SIZE, draft=DECODE_DRAFT))
+# Split de calibration de la cascade, retiré avant le split train/validation
+dataset_files = dataset.files if DATASET_CACHE else [os.path.relpath(path, TRAIN_DIR) for path, _ in dataset.samples]
+calibration_indices, model_indices = calibration_split(dataset_files, CASCADE_CALIBRATION_PERCENT)
+calibration_dataset = Subset(dataset, calibration_indices)
+model_dataset = Subset(dataset, model_indices)
+split_info = {"seed": SPLIT_SEED, "calibration": "crc32", "calibration_percent": CASCADE_CALIBRATION_PERCENT}
+train_size = int(0.8 * len(model_dataset))
+val_size = len(model_dataset) - train_size
+train_dataset, val_dataset = random_split(
+    model_dataset, [train_size, val_size], generator=torch.Generator().manual_seed(SPLIT_SEED)
 )
-cursor = conn.cursor()
-print("✅ Connecté à MySQL")
-
-print("🔌 Connexion à MinIO...")
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False
-)
-
-# Vérification des buckets
-if not minio_client.bucket_exists(BUCKET_NAME):
-    raise ValueError(f"Le bucket '{BUCKET_NAME}' n'existe pas sur MinIO.")
-if not minio_client.bucket_exists(MODEL_BUCKET):
-    minio_client.make_bucket(MODEL_BUCKET)
-    print(f"✅ Bucket '{MODEL_BUCKET}' créé pour stocker les modèles.")
+full_val_dataset = val_dataset
 
-# Créer le bucket mlflow pour les artifacts MLflow
-MLFLOW_BUCKET = "mlflow"
-if not minio_client.bucket_exists(MLFLOW_BUCKET):
-    minio_client.make_bucket(MLFLOW_BUCKET)
-    print(f"✅ Bucket '{MLFLOW_BUCKET}' créé pour les artifacts MLflow.")
+# En mode distribué, chaque process entraîne sur 1/N du train (DistributedSampler, remélangé
+# à chaque epoch) et évalue une partition disjointe de la validation
+train_sampler = DistributedSampler(train_dataset, shuffle=True, seed=SPLIT_SEED) if DIST.enabled else None
+if DIST.enabled:
+    val_dataset = Subset(val_dataset, shard_indices(DIST, len(val_dataset)))
 
-print("✅ Connecté à MinIO")
-
-# ============================================================
-# Configuration des credentials S3/MinIO pour MLflow
-# ============================================================
-print("🔌 Configuration des credentials MLflow pour MinIO...")
-os.environ["AWS_ACCESS_KEY_ID"] = MINIO_ACCESS_KEY
-os.environ["AWS_SECRET_ACCESS_KEY"] = MINIO_SECRET_KEY
-os.environ["MLFLOW_S3_ENDPOINT_URL"] = f"http://minio:9000" if IN_DOCKER else "http://localhost:9000"
-print("✅ Credentials configurés pour MLflow")
-
-print("🔌 Configuration de MLflow...")
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-mlflow.set_experiment(MLFLOW_EXPERIMENT_NAME)
-print(f"✅ MLflow configuré : {MLFLOW_TRACKING_URI}")
-
-# ============================================================
-# 3️⃣ Lecture des images depuis la table SQL
-# ============================================================
-print("📊 Lecture des données depuis la table fish_data...")
-cursor.execute("SELECT species_label, file_name, url_s3 FROM fish_data WHERE split = 'train'")
-rows = cursor.fetchall()
-print(f"✅ {len(rows)} images de training trouvées dans la base de données")
-
-# ============================================================
-# 4️⃣ Téléchargement des images depuis MinIO
-# ============================================================
-print("📦 Téléchargement des images depuis MinIO...")
-os.makedirs(TRAIN_DIR, exist_ok=True)
-
-for label, file_name, url_s3 in tqdm(rows, desc="Downloading images"):
-    key = f"train/{label}/{file_name}"
-    label_dir = os.path.join(TRAIN_DIR, label)
-    os.makedirs(label_dir, exist_ok=True)
-    local_path = os.path.join(label_dir, file_name)
-    if not os.path.exists(local_path):
-        try:
-            minio_client.fget_object(BUCKET_NAME, key, local_path)
-        except Exception as e:
-            print(f"⚠️  Erreur pour {key}: {e}")
-
-cursor.close()
-conn.close()
-print("✅ Téléchargement terminé.")
-
-# ============================================================
-# 5️⃣ Préparation des données PyTorch
-# ============================================================
-transform = transforms.Compose([
-    transforms.Resize((IMG_SIZE, IMG_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225]),
-])
-
-dataset = datasets.ImageFolder(root=TRAIN_DIR, transform=transform)
-train_size = int(0.8 * len(dataset))
-val_size = len(dataset) - train_size
-train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
-
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
-print(f"📊 Dataset prêt : {len(train_dataset)} train / {len(val_dataset)} val images")
+train_loader = make_loader(train_dataset, BATCH_SIZE, shuffle=True, config=LOADER_CONFIG, sampler=train_sampler)
+val_loader = make_loader(val_dataset, BATCH_SIZE, shuffle=False, config=LOADER_CONFIG)
+if DIST.is_main:
+    print(f"📊 Dataset prêt : {train_size} train / {val_size} val / {len(calibration_dataset)} calibration images")
+    print(f"⚙️  DataLoader : {LOADER_CONFIG.as_params()}")
 
 # ============================================================
 # 6️⃣ Construction du modèle CNN
 # ============================================================
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = models.resnet18(weights="IMAGENET1K_V1")
-num_features = model.fc.in_features
-model.fc = nn.Linear(num_features, len(dataset.classes))
-model = model.to(device)
+with main_process_first(DIST):  # un seul téléchargement des poids pré-entraînés
+    model = build_model(MODEL_ARCH, len(dataset.classes), pretrained=True)
+model = model.to(device, memory_format=memory_format(CHANNELS_LAST))
+base_model = model  # module sans l'enveloppe DDP (sauvegarde, log MLflow)
+model = wrap_model(DIST, model)
 
 criterion = nn.CrossEntropyLoss()
 optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+preprocess = BatchPreprocessor(device, augment_flip=LOADER_CONFIG.augment_flip, channels_last=CHANNELS_LAST)
+
+if LOADER_BENCHMARK:
+    # Chargement seul vs calcul seul : le plus lent des deux limite l'entraînement
+    loader_stats = measure_loader(train_loader, preprocess)
+    compute_stats = measure_compute(model, criterion, optimizer, BATCH_SIZE, device,
+                                    IMG_SIZE, num_classes=len(dataset.classes))
+    bound = "input-bound" if loader_stats["samples_per_s"] < compute_stats["samples_per_s"] else "compute-bound"
+    print(f"📥 Chargement seul : {loader_stats['samples_per_s']} img/s")
+    print(f"🧮 Calcul seul     : {compute_stats['samples_per_s']} img/s")
+    print(f"🔎 Entraînement {bound} avec {LOADER_CONFIG.num_workers} worker(s)")
+    sys.exit(0)
 
 # ============================================================
-# 7️⃣ Intégration MLflow
+# Reprise depuis le dernier checkpoint (crash, préemption, budget de temps atteint)
 # ============================================================
-mlflow.set_tracking_uri("http://mlflow:5000")  # ton service docker-compose
-mlflow.set_experiment("Fishy_Model_Tracking")
-
-with mlflow.start_run(run_name=f"FishClassifier_{int(time.time())}"):
+best_val_acc = 0.0
+best_model_path = os.path.join(TRAIN_OUTPUT_DIR, "best_model.pt")
+epoch_times = []
+start_epoch = 0
+mlflow_run_id = None
+early_stopping = EarlyStopping(EARLY_STOPPING_PATIENCE, EARLY_STOPPING_MIN_DELTA)
+
+checkpoint_store = None
+resume_path = None
+if DIST.is_main:
+    checkpoint_store = CheckpointStore(minio_client, CHECKPOINT_BUCKET, CHECKPOINT_PREFIX, CHECKPOINT_DIR,
+                                       keep=CHECKPOINT_KEEP)
+    resume_path = checkpoint_store.latest() if RESUME else None
+resume_path = broadcast_object(DIST, resume_path)
+
+if resume_path:
+    # weights_only=False : le checkpoint contient aussi les états RNG (numpy, python)
+    checkpoint = torch.load(resume_path, map_location="cpu", weights_only=False)
+    if checkpoint["classes"] != dataset.classes:
+        if DIST.is_main:
+            print(f"⚠️  Checkpoint {resume_path} ignoré : classes différentes du dataset actuel")
+    else:
+        base_model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        early_stopping.load_state_dict(checkpoint["early_stopping"])
+        restore_rng_state(checkpoint["rng"])
+        start_epoch = checkpoint["epoch"] + 1
+        best_val_acc = checkpoint["best_val_acc"]
+        epoch_times = checkpoint["epoch_times"]
+        mlflow_run_id = checkpoint["mlflow_run_id"]
+        if DIST.is_main:
+            if checkpoint["best_model"] is not None:
+                torch.save(checkpoint["best_model"], best_model_path)
+            print(f"♻️  Reprise depuis {resume_path} : epoch {start_epoch + 1}/{EPOCHS}, "
+                  f"meilleure Val Acc {best_val_acc:.2f}%")
+    del checkpoint
+
+
+def save_checkpoint(epoch):
+    """ État complet de l'entraînement après `epoch` (rank 0 uniquement) """
+    checkpoint_store.save({
+        "epoch": epoch,
+        "classes": dataset.classes,
+        "model": base_model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "best_val_acc": best_val_acc,
+        "best_model": torch.load(best_model_path) if os.path.exists(best_model_path) else None,
+        "early_stopping": early_stopping.state_dict(),
+        "epoch_times": epoch_times,
+        "rng": capture_rng_state(),
+        "mlflow_run_id": mlflow_run_id,
+    }, epoch)
 
-    # Log des hyperparamètres
-    mlflow.log_param("epochs", EPOCHS)
-    mlflow.log_param("batch_size", BATCH_SIZE)
-    mlflow.log_param("learning_rate", LEARNING_RATE)
-    mlflow.log_param("img_size", IMG_SIZE)
-    mlflow.log_param("architecture", "resnet18")
 
-    print("🚀 Début de l'entraînement avec MLflow tracking...")
-    best_val_acc = 0.0
-    best_model_path = "best_model.pt"
-
-    for epoch in range(EPOCHS):
+# ============================================================
+# 7️⃣ Intégration MLflow
+# ============================================================
+# Seul le rank 0 crée le run MLflow et logge ; les autres process s'entraînent seulement.
+# Après une reprise, les métriques continuent dans le même run MLflow.
+if not DIST.is_main:
+    run_context = nullcontext()
+elif mlflow_run_id:
+    run_context = mlflow.start_run(run_id=mlflow_run_id)
+else:
+    run_context = mlflow.start_run(run_name=f"FishClassifier_{int(time.time())}")
+
+with run_context:
+
+    if DIST.is_main:
+        mlflow_run_id = mlflow.active_run().info.run_id
+
+    if DIST.is_main and start_epoch == 0:
+        # Log des hyperparamètres
+        mlflow.log_param("epochs", EPOCHS)
+        mlflow.log_param("batch_size", BATCH_SIZE)
+        mlflow.log_param("learning_rate", LEARNING_RATE)
+        mlflow.log_param("img_size", IMG_SIZE)
+        mlflow.log_param("architecture", MODEL_ARCH)
+        mlflow.log_param("precision", TRAIN_PRECISION)
+        mlflow.log_param("channels_last", CHANNELS_LAST)
+        mlflow.log_param("dataset_cache", DATASET_CACHE)
+        mlflow.log_param("decode_draft", DECODE_DRAFT)
+        mlflow.log_param("dataset_filter", DATASET_FILTER)
+        mlflow.log_param("calibration_percent", CASCADE_CALIBRATION_PERCENT)
+        mlflow.log_param("excluded_invalid", excluded_invalid)
+        mlflow.log_param("excluded_duplicates", excluded_duplicates)
+        mlflow.log_params(LOADER_CONFIG.as_params())
+        mlflow.log_param("world_size", DIST.world_size)
+        mlflow.log_param("threads_per_process", TRAIN_THREADS)
+        mlflow.log_param("global_batch_size", BATCH_SIZE * DIST.world_size)
+        mlflow.log_param("early_stopping_patience", EARLY_STOPPING_PATIENCE)
+        mlflow.log_param("time_budget_min", TRAIN_TIME_BUDGET_MIN)
+        print("🚀 Début de l'entraînement avec MLflow tracking...")
+
+    stop_reason = None
+    for epoch in range(start_epoch, EPOCHS):
+        epoch_start = time.perf_counter()
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         model.train()
         running_loss = 0.0
-        for images, labels in tqdm(train_loader, desc=f"Epoch {epoch+1}/{EPOCHS} [Train]", leave=False):
-            images, labels = images.to(device), labels.to(device)
+        for images, labels in tqdm(train_loader, desc=f"Epoch {epoch+1}/{EPOCHS} [Train]", leave=False,
+                                   disable=not DIST.is_main):
+            images, labels = preprocess(images, labels, train=True)
             optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            with autocast(device, TRAIN_PRECISION):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
             loss.backward()
             optimizer.step()
             running_loss += loss.item()
-        train_loss = running_loss / len(train_loader)
+        running_loss, train_batches = all_reduce_sum(DIST, running_loss, len(train_loader))
+        train_loss = running_loss / train_batches
 
         model.eval()
         val_loss = 0.0
         correct = 0
         total = 0
         with torch.no_grad():
-            for images, labels in tqdm(val_loader, desc=f"Epoch {epoch+1}/{EPOCHS} [Val]", leave=False):
-                images, labels = images.to(device), labels.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, labels)
+            for images, labels in tqdm(val_loader, desc=f"Epoch {epoch+1}/{EPOCHS} [Val]", leave=False,
+                                       disable=not DIST.is_main):
+                images, labels = preprocess(images, labels)
+                with autocast(device, TRAIN_PRECISION):
+                    outputs = model(images)
+                    loss = criterion(outputs, labels)
                 val_loss += loss.item()
                 _, predicted = torch.max(outputs.data, 1)
                 total += labels.size(0)
                 correct += (predicted == labels).sum().item()
 
-        val_loss /= len(val_loader)
+        # Somme sur tous les process : tous obtiennent la même précision (et le même meilleur modèle)
+        val_loss, val_batches, correct, total = all_reduce_sum(DIST, val_loss, len(val_loader), correct, total)
+        val_loss /= val_batches
         val_accuracy = 100 * correct / total
-
-        # Log des métriques
-        mlflow.log_metric("train_loss", train_loss, step=epoch)
-        mlflow.log_metric("val_loss", val_loss, step=epoch)
-        mlflow.log_metric("val_accuracy", val_accuracy, step=epoch)
-
-        print(f"📈 Epoch {epoch+1}/{EPOCHS} - Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f} | Val Acc: {val_accuracy:.2f}%")
-
-        if val_accuracy > best_val_acc:
-            best_val_acc = val_accuracy
-            torch.save(model.state_dict(), best_model_path)
-            print(f"   ⭐ Nouveau meilleur modèle sauvegardé (Val Acc: {val_accuracy:.2f}%)")
-
-    # Fin d'entraînement
-    print(f"✅ Entraînement terminé. Meilleure précision validation : {best_val_acc:.2f}%")
-    mlflow.log_metric("best_val_accuracy", best_val_acc)
-
-    # Log du modèle final
-    MODEL_PATH = "model_v1.pt"
-    shutil.copy(best_model_path, MODEL_PATH)
-    mlflow.pytorch.log_model(model, "model")  # log du modèle dans MLflow
+        epoch_time = time.perf_counter() - epoch_start
+        epoch_times.append(epoch_time)
+        # val_accuracy est identique sur tous les process : même décision d'early stopping partout
+        early_stopping.update(val_accuracy)
+
+        if DIST.is_main:
+            # Log des métriques
+            mlflow.log_metric("train_loss", train_loss, step=epoch)
+            mlflow.log_metric("val_loss", val_loss, step=epoch)
+            mlflow.log_metric("val_accuracy", val_accuracy, step=epoch)
+            mlflow.log_metric("epoch_time_s", epoch_time, step=epoch)
+
+            print(f"📈 Epoch {epoch+1}/{EPOCHS} - Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f} | Val Acc: {val_accuracy:.2f}% | {epoch_time:.1f}s")
+
+            if val_accuracy > best_val_acc:
+                best_val_acc = val_accuracy
+                torch.save(base_model.state_dict(), best_model_path)
+                print(f"   ⭐ Nouveau meilleur modèle sauvegardé (Val Acc: {val_accuracy:.2f}%)")
+
+            if early_stopping.should_stop:
+                stop_reason = "early_stopping"
+            elif epoch + 1 < EPOCHS and not TIME_BUDGET.allows_epoch(epoch_times):
+                stop_reason = "time_budget"
+            # Un arrêt sur budget garde un checkpoint : la prochaine exécution reprendra ici
+            if stop_reason != "early_stopping" and epoch + 1 < EPOCHS and (
+                    (epoch + 1) % CHECKPOINT_EVERY == 0 or stop_reason == "time_budget"):
+                save_checkpoint(epoch)
+
+        # Décision prise par le rank 0 (le temps mesuré diffère d'un process à l'autre)
+        stop_reason = broadcast_object(DIST, stop_reason)
+        if stop_reason:
+            break
+
+    if DIST.is_main:
+        # Fin d'entraînement
+        stop_reason = stop_reason or "completed"
+        messages = {
+            "completed": f"{EPOCHS} epochs",
+            "early_stopping": f"early stopping après {EARLY_STOPPING_PATIENCE} epochs sans progrès",
+            "time_budget": f"budget de {TRAIN_TIME_BUDGET_MIN:g} min atteint, reprise possible depuis le checkpoint",
+        }
+        print(f"✅ Entraînement terminé ({messages[stop_reason]}). Meilleure précision validation : {best_val_acc:.2f}%")
+        mlflow.set_tag("stop_reason", stop_reason)
+        mlflow.log_metric("epochs_run", len(epoch_times))
+        mlflow.log_metric("best_val_accuracy", best_val_acc)
+        if stop_reason != "time_budget":
+            checkpoint_store.clear()
+        mlflow.log_metric("mean_epoch_time_s", sum(epoch_times) / len(epoch_times))
+
+        model_metadata = {
+            "architecture": MODEL_ARCH,
+            "num_parameters": count_parameters(base_model),
+            "classes": dataset.classes,
+            "img_size": IMG_SIZE,
+            "precision": TRAIN_PRECISION,
+            "channels_last": CHANNELS_LAST,
+            "val_accuracy": best_val_acc,
+            "split": split_info,
+        }
+        if TRAIN_PRECISION != "fp32":
+            # Accuracy du meilleur modèle en fp32 et dans la précision choisie, sur toute la validation
+            base_model.load_state_dict(torch.load(best_model_path, map_location=device))
+            eval_loader = make_loader(full_val_dataset, BATCH_SIZE, shuffle=False, config=LOADER_CONFIG)
+            preds_fp32, targets = predict_labels(base_model, eval_loader, preprocess, device, "fp32")
+            preds_mixed, _ = predict_labels(base_model, eval_loader, preprocess, device, TRAIN_PRECISION)
+            acc_fp32 = 100 * (preds_fp32 == targets).float().mean().item()
+            acc_mixed = 100 * (preds_mixed == targets).float().mean().item()
+            agreement = 100 * (preds_mixed == preds_fp32).float().mean().item()
+            mlflow.log_metric("val_accuracy_fp32", acc_fp32)
+            mlflow.log_metric(f"val_accuracy_{TRAIN_PRECISION}", acc_mixed)
+            mlflow.log_metric("precision_agreement", agreement)
+            model_metadata["val_accuracy_fp32"] = acc_fp32
+            print(f"🎯 Validation : fp32 {acc_fp32:.2f}% | {TRAIN_PRECISION} {acc_mixed:.2f}% "
+                  f"| prédictions identiques {agreement:.2f}%")
+        if MODEL_ARCH != "resnet18":
+            # Seuil de la cascade : comparé au ResNet18 servi, sur le split de calibration (la validation
+            # a servi à choisir le meilleur epoch des deux modèles : leur précision y est optimiste)
+            reference_name = CASCADE_REFERENCE or latest_reference_model(minio_client, MODEL_BUCKET)
+            if reference_name is None:
+                print("⚠️  Aucun ResNet18 de référence dans le bucket : seuil de cascade non calibré (CASCADE_THRESHOLD côté API)")
+            else:
+                reference_path = os.path.join(TRAIN_OUTPUT_DIR, "cascade_reference.pt")
+                minio_client.fget_object(MODEL_BUCKET, reference_name, reference_path)
+                reference_meta = reference_metadata(minio_client, MODEL_BUCKET, reference_name)
+                reference = build_model(reference_meta.get("architecture", "resnet18"), len(dataset.classes))
+                reference.load_state_dict(torch.load(reference_path, map_location="cpu"))
+                base_model.load_state_dict(torch.load(best_model_path, map_location=device))
+                calibration_on = "calibration" if len(calibration_dataset) else "validation"
+                held_out = calibration_on == "calibration" and reference_held_out(reference_meta, CASCADE_CALIBRATION_PERCENT)
+                if calibration_on == "validation":
+                    print("⚠️  Split de calibration vide (CASCADE_CALIBRATION_PERCENT) : seuil calibré sur la validation, "
+                          "qui a servi à choisir les deux modèles — précision de la cascade optimiste")
+                elif not held_out:
+                    print(f"⚠️  {reference_name} a été entraîné sans mettre de côté ce split de calibration : "
+                          "il a pu voir ces images, sa précision y est optimiste et le seuil trop bas")
+                eval_loader = make_loader(calibration_dataset if calibration_on == "calibration" else full_val_dataset,
+                                          BATCH_SIZE, shuffle=False, config=LOADER_CONFIG)
+                fast_conf, fast_preds, targets = predict_confidences(base_model, eval_loader, preprocess, device,
+                                                                     TRAIN_PRECISION)
+                _, full_preds, _ = predict_confidences(reference.to(device), eval_loader, preprocess, device)
+                full_accuracy = 100 * (full_preds == targets).float().mean().item()
+                target = float(CASCADE_TARGET_ACCURACY) if CASCADE_TARGET_ACCURACY else full_accuracy - CASCADE_MAX_ACCURACY_DROP
+                cascade = tune_threshold(fast_conf, fast_preds == targets, full_preds == targets, target)
+                cascade["reference"] = reference_name
+                cascade["split"] = calibration_on
+                cascade["split_size"] = len(targets)
+                cascade["calibration_percent"] = CASCADE_CALIBRATION_PERCENT
+                cascade["reference_held_out"] = held_out
+                model_metadata["cascade"] = cascade
+                mlflow.log_param("cascade_reference", reference_name)
+                mlflow.log_param("cascade_split", calibration_on)
+                mlflow.log_param("cascade_reference_held_out", held_out)
+                mlflow.log_metric("cascade_threshold", cascade["threshold"])
+                mlflow.log_metric("cascade_accuracy", cascade["accuracy"])
+                mlflow.log_metric("cascade_escalation_rate", cascade["escalation_rate"])
+                print(f"🪜 Cascade : seuil {cascade['threshold']:.3f} → {cascade['accuracy']:.2f}% "
+                      f"(cible {target:.2f}%, ResNet18 seul {full_accuracy:.2f}%), "
+                      f"{100 * cascade['escalation_rate']:.1f}% des images escaladées"
+                      + ("" if cascade["reached"] else " — cible hors d'atteinte, tout est escaladé"))
+        mlflow.log_dict(model_metadata, "model_metadata.json")
+
+        # Log du modèle final
+        MODEL_PATH = os.path.join(TRAIN_OUTPUT_DIR, "model_v1.pt")
+        shutil.copy(best_model_path, MODEL_PATH)
+        mlflow.pytorch.log_model(base_model, "model")  # log du modèle dans MLflow
+
+cleanup(DIST)
+if not DIST.is_main:
+    sys.exit(0)
+
+if TRAIN_SUMMARY_PATH:
+    with open(TRAIN_SUMMARY_PATH, "w") as f:
+        json.dump({
+            "architecture": MODEL_ARCH,
+            "best_val_accuracy": best_val_acc,
+            "epochs_run": len(epoch_times),
+            "mean_epoch_time_s": sum(epoch_times) / len(epoch_times),
+            "stop_reason": stop_reason,
+            "mlflow_run_id": mlflow_run_id,
+            "weights_path": os.path.abspath(MODEL_PATH),
+            "precision": TRAIN_PRECISION,
+            "channels_last": CHANNELS_LAST,
+        }, f, indent=2)
 
 # ============================================================
 # 8️⃣ Upload du modèle vers MinIO
 # ============================================================
+if not PUBLISH_MODEL:
+    print("ℹ️ PUBLISH_MODEL=0 : modèle gardé dans MLflow seulement, rien n'est envoyé dans le bucket des modèles")
+    sys.exit(0)
+if stop_reason == "time_budget":
+    # Le registre de l'API active automatiquement le modèle le plus récent du bucket : un modèle
+    # interrompu n'y est pas envoyé, la reprise depuis le checkpoint publiera le modèle final
+    print("⏸️  Arrêt sur budget de temps : modèle gardé dans MLflow, non publié (relancer pour reprendre)")
+    sys.exit(0)
+
 try:
     timestamp = int(time.time())
-    model_name = f"model_v1_{timestamp}.pt"
+    model_name = f"{MODEL_PREFIX}_{timestamp}.pt"
+    # Métadonnées envoyées avant le modèle : l'API les trouve dès qu'elle détecte la nouvelle version
+    metadata_name = f"{MODEL_PREFIX}_{timestamp}.meta.json"
+    metadata_bytes = json.dumps(model_metadata, indent=2).encode()
+    minio_client.put_object(MODEL_BUCKET, metadata_name, io.BytesIO(metadata_bytes), len(metadata_bytes))
+    # Poids au format safetensors (lus memory-mappés par l'API), eux aussi envoyés avant le .pt
+    try:
+        from safetensors.torch import save_file
+
+        weights_path = os.path.join(TRAIN_OUTPUT_DIR, "model_v1.safetensors")
+        state_dict = torch.load(MODEL_PATH, map_location="cpu")
+        # L'architecture voyage avec les poids : l'API reconstruit le bon modèle même sans .meta.json
+        save_file({name: tensor.contiguous() for name, tensor in state_dict.items()}, weights_path,
+                  metadata={"architecture": MODEL_ARCH})
+        minio_client.fput_object(MODEL_BUCKET, f"{MODEL_PREFIX}_{timestamp}.safetensors", weights_path)
+    except ImportError:
+        print("ℹ️ safetensors non installé : seul le .pt est envoyé (l'API le convertira au premier chargement)")
     with open(MODEL_PATH, 'rb') as file_data:
         file_stat = os.stat(MODEL_PATH)
         minio_client.put_object(MODEL_BUCKET, model_name, file_data, file_stat.st_size)
@@ -0,0 +1,266 @@
+# ===============================================
+# Script : train_sweep.py
+# Objectif : Balayage d'architectures : entraîne chaque candidat avec train_model.py,
+#            mesure la latence et le débit d'inférence CPU par taille de batch
+#            et logge la frontière de Pareto précision / latence dans MLflow
+# ===============================================
+#
+#   python train_sweep.py --architectures resnet18 resnet34 mobilenet_v3_large efficientnet_b0 \
+#       --epochs 5 --latency-slo-ms 40
+#   python train_sweep.py --latency-only            # latence / débit seuls, sans entraînement
+#
+# Les candidats ne touchent jamais au modèle servi : chacun écrit ses poids dans son propre dossier
+# temporaire (TRAIN_OUTPUT_DIR), ses checkpoints sous sweep-<arch>/ et, avec --publish, est publié
+# sous model_v1_<arch>_<timestamp>.pt (jamais sous le préfixe model_v1 servi par l'API).
+# Leurs runs partagent l'expérience MLflow de train_model.py, reliés au run du balayage (tag sweep_run_id).
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from architectures import ARCHITECTURES, build_model, count_parameters  # noqa: E402
+from backends import PRECISIONS, PrecisionModel, artifact_path, export_torchscript, load_backend  # noqa: E402
+from cascade import count_gflops  # noqa: E402
+
+NUM_CLASSES = 5
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_model.py")
+
+
+def serving_model(model, backend, precision, channels_last, work_dir):
+    """ Modèle tel que l'API le sert : eager (PrecisionModel en bf16 / channels_last) ou TorchScript """
+    if backend == "torchscript":
+        model_path = os.path.join(work_dir, "candidate.pt")
+        export_torchscript(model, artifact_path(model_path, "torchscript"))
+        return load_backend("torchscript", model_path)
+    if precision == "fp32" and not channels_last:
+        return model.eval()
+    return PrecisionModel(model, precision, channels_last)
+
+
+def measure_inference(architecture, batch_sizes, repeats=20, weights_path=None, backend="eager",
+                      precision="fp32", channels_last=False, work_dir=None):
+    """
+    Latence médiane / p95 (ms) et débit (images/s) sur CPU, par taille de batch, du candidat entraîné
+    (`weights_path`, poids aléatoires sans entraînement) dans le backend de service
+    """
+    model = build_model(architecture, NUM_CLASSES)
+    if weights_path:
+        model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+    model.eval()
+    label = backend
+    if backend == "eager":
+        # Même nom que le backend de l'API (ex: eager_bf16_cl)
+        label += (f"_{precision}" if precision != "fp32" else "") + ("_cl" if channels_last else "")
+    result = {
+        "num_parameters": count_parameters(model),
+        "gflops": count_gflops(model),
+        "backend": label,
+        "latency_ms": {},
+        "latency_p95_ms": {},
+        "throughput": {},
+    }
+    served = serving_model(model, backend, precision, channels_last, work_dir)
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+            for _ in range(3):
+                served(batch)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                served(batch)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            result["latency_ms"][batch_size] = round(statistics.median(timings), 2)
+            result["latency_p95_ms"][batch_size] = round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 2)
+            result["throughput"][batch_size] = round(batch_size * 1000 / statistics.median(timings), 1)
+    return result
+
+
+def train_candidate(architecture, output_dir, epochs=None, time_budget_min=None, publish=False):
+    """
+    Entraîne une architecture avec train_model.py, poids écrits dans `output_dir` ;
+    résumé du run (précision, run MLflow, poids) ou None
+    """
+    summary_path = os.path.join(output_dir, "summary.json")
+    # Jamais sous le préfixe servi (model_v1), ni sur les checkpoints d'un entraînement normal
+    env = dict(os.environ, MODEL_ARCH=architecture, TRAIN_SUMMARY_PATH=summary_path,
+               PUBLISH_MODEL="1" if publish else "0", MODEL_PREFIX=f"model_v1_{architecture}",
+               TRAIN_OUTPUT_DIR=output_dir, CHECKPOINT_PREFIX=f"sweep-{architecture}/",
+               CHECKPOINT_DIR=os.path.join(output_dir, "checkpoints"))
+    if epochs:
+        env["EPOCHS"] = str(epochs)
+    if time_budget_min:
+        env["TRAIN_TIME_BUDGET_MIN"] = str(time_budget_min)
+    print(f"🏋️  Entraînement de {architecture}...")
+    completed = subprocess.run([sys.executable, TRAIN_SCRIPT], env=env)
+    if completed.returncode != 0 or not os.path.exists(summary_path):
+        print(f"❌ Entraînement de {architecture} en échec (code {completed.returncode})")
+        return None
+    with open(summary_path) as f:
+        return json.load(f)
+
+
+def pareto_frontier(rows, batch_size):
+    """ Candidats non dominés : aucun autre n'est à la fois plus rapide (au batch donné) et plus précis """
+    frontier = []
+    for row in sorted(rows, key=lambda r: (r["latency_ms"][batch_size], -r["val_accuracy"])):
+        if not frontier or row["val_accuracy"] > frontier[-1]["val_accuracy"]:
+            frontier.append(row)
+    return frontier
+
+
+def choose_for_slo(frontier, batch_size, latency_slo_ms):
+    """ Candidat le plus précis dont la latence médiane respecte le SLO (None si aucun) """
+    eligible = [row for row in frontier if row["latency_ms"][batch_size] <= latency_slo_ms]
+    return max(eligible, key=lambda r: r["val_accuracy"]) if eligible else None
+
+
+def markdown_table(rows, batch_sizes, frontier):
+    on_frontier = {row["architecture"] for row in frontier}
+    header = (["architecture", "val acc (%)", "params (M)", "GFLOPs"]
+              + [f"b{b} ms (p50/p95)" for b in batch_sizes] + [f"b{b} img/s" for b in batch_sizes] + ["Pareto"])
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for row in rows:
+        accuracy = row.get("val_accuracy")
+        cells = [
+            row["architecture"],
+            f"{accuracy:.2f}" if accuracy is not None else "-",
+            f"{row['num_parameters'] / 1e6:.1f}",
+            f"{row['gflops']:.2f}" if row["gflops"] else "-",
+        ]
+        cells += [f"{row['latency_ms'][b]:.1f} / {row['latency_p95_ms'][b]:.1f}" for b in batch_sizes]
+        cells += [f"{row['throughput'][b]:.0f}" for b in batch_sizes]
+        cells.append("⭐" if row["architecture"] in on_frontier else "")
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def log_to_mlflow(rows, frontier, choice, table, args):
+    """ Run MLflow du balayage (tableau, frontière, choix) + latences ajoutées au run de chaque candidat """
+    import mlflow
+    from mlflow.tracking import MlflowClient
+
+    # Mêmes accès que train_model.py (artefacts MLflow stockés dans MinIO)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "admin-user")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "admin-password")
+    os.environ.setdefault("MLFLOW_S3_ENDPOINT_URL", "http://localhost:9000")
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000"))
+    mlflow.set_experiment(os.getenv("MLFLOW_EXPERIMENT_NAME", "Fishy_Model_Tracking"))
+    client = MlflowClient()
+    on_frontier = {row["architecture"] for row in frontier}
+
+    with mlflow.start_run(run_name=f"ArchitectureSweep_{int(time.time())}") as sweep_run:
+        mlflow.log_param("architectures", ",".join(row["architecture"] for row in rows))
+        mlflow.log_param("batch_sizes", ",".join(map(str, args.batch_sizes)))
+        mlflow.log_param("slo_batch_size", args.slo_batch_size)
+        mlflow.log_param("backend", args.backend)
+        mlflow.log_param("torch_threads", torch.get_num_threads())
+        if args.latency_slo_ms:
+            mlflow.log_param("latency_slo_ms", args.latency_slo_ms)
+        for row in rows:
+            arch = row["architecture"]
+            mlflow.log_metric(f"{arch}.val_accuracy", row["val_accuracy"])
+            for b in args.batch_sizes:
+                mlflow.log_metric(f"{arch}.latency_ms_b{b}", row["latency_ms"][b])
+                mlflow.log_metric(f"{arch}.throughput_b{b}", row["throughput"][b])
+        mlflow.log_dict({"results": rows, "pareto": [row["architecture"] for row in frontier]}, "sweep_results.json")
+        mlflow.log_text(table, "pareto.md")
+        mlflow.set_tag("pareto_frontier", ",".join(row["architecture"] for row in frontier))
+        if choice is not None:
+            mlflow.set_tag("slo_choice", choice["architecture"])
+
+    for row in rows:
+        # Latences à côté de val_accuracy dans le run d'entraînement du candidat
+        run_id = row.get("mlflow_run_id")
+        if not run_id:
+            continue
+        for b in args.batch_sizes:
+            client.log_metric(run_id, f"latency_ms_b{b}", row["latency_ms"][b])
+            client.log_metric(run_id, f"throughput_b{b}", row["throughput"][b])
+        client.set_tag(run_id, "pareto_optimal", str(row["architecture"] in on_frontier).lower())
+        client.set_tag(run_id, "sweep_run_id", sweep_run.info.run_id)
+    print(f"✅ Balayage loggé dans MLflow ({mlflow.get_tracking_uri()})")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Balayage d'architectures : précision vs latence CPU, frontière de Pareto")
+    p.add_argument("--architectures", nargs="+", choices=list(ARCHITECTURES), default=list(ARCHITECTURES))
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--threads", type=int, help="Threads torch pour la mesure (défaut : ceux de torch)")
+    p.add_argument("--backend", choices=["eager", "torchscript"], default="eager",
+                   help="Backend de service mesuré (eager : précision et channels_last du run, comme l'API)")
+    p.add_argument("--precision", choices=PRECISIONS, help="Précision eager mesurée (défaut : celle du run, fp32 sinon)")
+    p.add_argument("--epochs", type=int, help="Epochs par candidat (EPOCHS de train_model.py)")
+    p.add_argument("--time-budget-min", type=float, help="Budget d'entraînement par candidat (TRAIN_TIME_BUDGET_MIN)")
+    p.add_argument("--latency-slo-ms", type=float, help="SLO de latence : choisit le candidat le plus précis qui le tient")
+    p.add_argument("--slo-batch-size", type=int, default=1, help="Taille de batch de la frontière et du SLO")
+    p.add_argument("--publish", action="store_true",
+                   help="Publie aussi chaque candidat dans le bucket des modèles (sous model_v1_<arch>, jamais servi)")
+    p.add_argument("--latency-only", action="store_true", help="Mesure la latence seule, sans entraîner")
+    p.add_argument("--no-mlflow", action="store_true")
+    p.add_argument("--output", help="Fichier JSON des résultats")
+    args = p.parse_args()
+    if args.slo_batch_size not in args.batch_sizes:
+        args.batch_sizes.append(args.slo_batch_size)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    rows = []
+    for architecture in args.architectures:
+        row = {"architecture": architecture}
+        summary = {}
+        output_dir = tempfile.mkdtemp(prefix=f"sweep_{architecture}_")
+        try:
+            if not args.latency_only:
+                summary = train_candidate(architecture, output_dir, args.epochs, args.time_budget_min, args.publish)
+                if summary is None:
+                    continue
+                row.update(val_accuracy=summary["best_val_accuracy"], mlflow_run_id=summary["mlflow_run_id"],
+                           epochs_run=summary["epochs_run"])
+            row.update(measure_inference(
+                architecture, args.batch_sizes, args.repeats, weights_path=summary.get("weights_path"),
+                backend=args.backend, precision=args.precision or summary.get("precision", "fp32"),
+                channels_last=summary.get("channels_last", False), work_dir=output_dir,
+            ))
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        print(f"⏱️  {architecture} ({row['backend']}) : {row['latency_ms'][args.slo_batch_size]} ms au batch {args.slo_batch_size}, "
+              f"{row['throughput'][max(args.batch_sizes)]} img/s au batch {max(args.batch_sizes)}")
+        rows.append(row)
+
+    frontier = [] if args.latency_only else pareto_frontier(rows, args.slo_batch_size)
+    choice = choose_for_slo(frontier, args.slo_batch_size, args.latency_slo_ms) if args.latency_slo_ms else None
+    table = markdown_table(rows, args.batch_sizes, frontier)
+    print("\n" + table + "\n")
+    if frontier:
+        print(f"📈 Frontière de Pareto (batch {args.slo_batch_size}) : "
+              + " → ".join(f"{r['architecture']} ({r['latency_ms'][args.slo_batch_size]} ms, {r['val_accuracy']:.2f}%)"
+                           for r in frontier))
+    if args.latency_slo_ms:
+        if choice is not None:
+            print(f"🎯 SLO {args.latency_slo_ms:g} ms : {choice['architecture']} "
+                  f"(MODEL_ARCH={choice['architecture']} MODEL_PREFIX=model_v1 python train_model.py pour le servir)")
+        else:
+            print(f"⚠️  Aucun candidat ne tient le SLO de {args.latency_slo_ms:g} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": rows, "pareto": [r["architecture"] for r in frontier],
+                       "slo_choice": choice["architecture"] if choice else None}, f, indent=2)
+    if rows and not args.latency_only and not args.no_mlflow:
+        log_to_mlflow(rows, frontier, choice, table, args)
+
+
+if __name__ == "__main__":
+    main()